@@ -35,14 +35,18 @@ class PipelineGUI(tk.Tk):
 			self.grid_rowconfigure(i, weight=1)
 
 	def gui_log(self, agent, msg):
-		self.log_queue.put((agent, msg))
+		self.log_queue.put((agent, msg + "\n"))
+
+	def gui_stream(self, agent, text):
+		# testo in streaming (token LLM): aggiunto così com'è, senza andare a capo
+		self.log_queue.put((agent, text))
 
 	def _poll_logs(self):
 		while not self.log_queue.empty():
 			agent, msg = self.log_queue.get()
 			box = self.agent_boxes.get(agent)
 			if box:
-				box.insert(tk.END, msg + "\n")
+				box.insert(tk.END, msg)
 				box.see(tk.END)
 		self.after(100, self._poll_logs)
 
@@ -1,13 +1,38 @@
 from app.models.anomaly_dummy import AnomalyDetectorMock
+from app.models.coalesce import AnomalyCoalescer
+from app.models.rule_engine import RuleEngineDetector
+from app.models.stream_detector import StreamingDetector
+from app.utils.config import settings
 from app.core.messages import Msg
+from app.core.object_store import store
 from app.core.bus import EventBus
 from app.utils.tracing import log
 
-_DETECT = AnomalyDetectorMock()
+_DETECTORS = {"mock": AnomalyDetectorMock, "rules": RuleEngineDetector, "stream": StreamingDetector}
+
+
+def _make_detector():
+    if settings.DETECTOR not in _DETECTORS:
+        raise ValueError(f"unknown DETECTOR {settings.DETECTOR!r}, expected one of {sorted(_DETECTORS)}")
+    if settings.DETECTOR == "stream" and settings.BUS_BACKEND == "sharded":
+        # window sketches are per process and traces are spread over shards by trace_id,
+        # so batches of one source would never add up in the same window
+        raise ValueError("DETECTOR=stream needs BUS_BACKEND=local: its window state cannot be split across shards")
+    return _DETECTORS[settings.DETECTOR]()
+
+
+# the streaming detector is stateful: every batch updates its window sketches in place
+_DETECT = _make_detector()
+_COALESCE = AnomalyCoalescer()
 
 async def anomaly_listener(bus: EventBus, msg: Msg):
-    df = msg.payload["df"]
-    anomalies = _DETECT.detect(df)
+    df_ref = msg.payload["df"]
+    detected = _DETECT.detect(store.get(df_ref))
+    store.release(df_ref)  # the batch is not needed past detection
+    anomalies = _COALESCE.coalesce(detected)
+    if len(anomalies) != len(detected):
+        log(f"AnomalyModel ▶ coalesced {len(detected)} detections into {len(anomalies)} anomalies {_COALESCE.stats()}")
+    # collection/model are forwarded as handles, not resolved here
     embedder = msg.payload.get("model", None)
     collection = msg.payload.get("collection", None)
     if not anomalies:
@@ -17,6 +42,8 @@ async def anomaly_listener(bus: EventBus, msg: Msg):
 
     for anom in anomalies:
         log(f"AnomalyModel ▶ detected anomaly: {anom.__dict__}")
-        await bus.publish(Msg(trace_id=msg.trace_id,
-                              role="MANAGER_PLAN",
-                              payload={"anomaly": anom.__dict__, "collection": collection, "model": embedder}))
+    # one plan per batch: the manager opens a sub-trace per anomaly
+    await bus.publish(Msg.fast(trace_id=msg.trace_id,
+                               role="MANAGER_PLAN",
+                               payload={"anomalies": [a.__dict__ for a in anomalies],
+                                        "collection": collection, "model": embedder}))
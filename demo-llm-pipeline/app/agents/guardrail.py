@@ -1,10 +1,12 @@
 import json
 from langchain_core.prompts import ChatPromptTemplate
 from app.core.bus import EventBus
-from app.core.messages import Msg
+from app.core.messages import CARRY_KEY, Msg
 from app.utils.tracing import log
 from app.utils.llm_factory import get_llm
 from app.utils.tracing import log_gui
+from app.utils.prompt_budget import PROMPT_STATS
+from app.utils.tokens import count_tokens
 
 MAX_RETRIES = 2
 
@@ -26,9 +28,9 @@ PROMPT = ChatPromptTemplate.from_messages([
     ("human", "{payload}")
 ])
 
-_llm = get_llm()  # Ollama or fallback
+_llm = get_llm("guardrail")  # lazy: Ollama or fallback, resolved on first call
 
-def _validate(text: str, tag: str):
+async def _validate(text: str, tag: str):
     # According to the role of the agent, the validation criteria may vary.
     agent_card = {}
     if "kretriever" in tag.lower():
@@ -42,7 +44,10 @@ def _validate(text: str, tag: str):
         # agent_card = json.load("demo-llm-pipeline\\app\\db\\agents_cards\\notify.json")
         agent_card = "Follow the previous instructions"
 
-    resp = _llm.invoke(PROMPT.format(agent_card=agent_card,payload=text))
+    prompt = PROMPT.format(agent_card=agent_card,payload=text)
+    # sized but never compacted: the validator has to see the whole payload
+    PROMPT_STATS.record("guardrail", count_tokens(prompt))
+    resp = await _llm.ainvoke(prompt)
     # log(f"GuardRail ▶ RESPONSE {resp}")
     valid = str(resp).strip().upper().startswith("VALID")
     if valid:
@@ -55,7 +60,13 @@ async def guard_listener(bus: EventBus, msg: Msg):
     tag = msg.role  # e.g. INGEST_VALIDATE, ENRICH_VALIDATE, REPORT_VALIDATE
     payload = msg.payload
     retry_count = msg.payload.get("retry_count", 0)
-    ok, feedback = _validate(str(payload),tag)
+    early = payload.get("early_feedback")
+    if early:
+        # a cheap check already failed while Notify was streaming: no LLM validation needed
+        ok, feedback = False, early
+        payload = {k: v for k, v in payload.items() if k != "early_feedback"}
+    else:
+        ok, feedback = await _validate(str({k: v for k, v in payload.items() if k != CARRY_KEY}), tag)
     log_gui("GuardRail", f"{tag} ok={ok} retry_count={retry_count} feedback={feedback}")
     if ok:
         nxt = tag.replace("VALIDATE", "OK")   # simple mapping
@@ -1,55 +1,185 @@
-import asyncio
-from app.utils.tracing import log, new_trace_id
+import asyncio, collections, itertools, time
+from app.utils.tracing import log, new_trace_id, child_trace_id, parent_trace_id
 from app.core.messages import Msg
 from app.core.bus import EventBus
+from app.core.completion import CompletionRegistry
+from app.utils.config import settings
 from app.utils.tracing import log_gui
 
+CLOSED_MAX = 10000   # failed/expired enrichment trace ids remembered to drop duplicate FATALs
+
 
 class ManagerSequencer:
-    def __init__(self, bus: EventBus):
+    """
+    A batch trace (``T-…``) fans out into one sub-trace per anomaly (``T-….1``,
+    ``T-….2``, …): enrichment, report and ``ACK_DONE`` run per sub-trace, and the
+    batch completes once every announced sub-trace is acknowledged. With
+    ``enrich_batch_size`` > 1, anomalies of the same rule share one enrichment
+    trace (``T-….g1``) and one KRetriever/HRetriever prompt; its result is then
+    handed to each member's report.
+    """
+
+    def __init__(self, bus: EventBus, ttl_s: float = settings.TRACE_TTL_S,
+                 enrich_batch_size: int = settings.ENRICH_BATCH_SIZE):
         self.bus, self.waiting = bus, {}
+        self.ttl_s = ttl_s
+        self.enrich_batch_size = enrich_batch_size
+        self.completions = CompletionRegistry(ttl_s)
+        self._waiting_deadline: collections.OrderedDict[str, float] = collections.OrderedDict()
+        # batch trace → {"children": sub-trace ids (None until BATCH_FANOUT), "acked": {sub-trace: status}}
+        self.batches: dict[str, dict] = {}
+        # enrichment traces already failed or expired: a second FATAL for them is a no-op
+        self._closed: collections.OrderedDict[str, None] = collections.OrderedDict()
+        # a single ACK listener for every trace, resolved by trace_id lookup
+        self.bus.subscribe("ACK_DONE", self.ack_listener)
+        self.bus.subscribe("BATCH_FANOUT", self.fanout_listener)
 
-    async def start_pipeline(self, raw_logs: str):
+    async def start_pipeline(self, raw_logs: str = None, path: str = None):
+        # ``path``: Proc parses the flow file itself in bounded chunks instead of receiving the text
+        self._sweep_waiting()
         tid = new_trace_id()
-        await self.bus.publish(Msg(trace_id=tid, role="Proc", payload={"raw_logs": raw_logs}))
-        fut = asyncio.get_running_loop().create_future()
-
-        async def done(msg: Msg):
-            if msg.trace_id == tid and not fut.done():
-                fut.set_result(True)
-        self.bus.subscribe("ACK_DONE", done)
-        await fut
-        from app.utils.tracing import log_gui
+        fut = self.completions.register(tid)
+        payload = {"path": path} if path is not None else {"raw_logs": raw_logs}
+        await self.bus.publish(Msg(trace_id=tid, role="Proc", payload=payload))
+        try:
+            await asyncio.wait_for(fut, self.ttl_s)
+        except asyncio.TimeoutError:
+            self.completions.expire(tid)
+            self._evict(tid)
+            log_gui("Manager", f"trace {tid} expired after {self.ttl_s}s", "warning")
+            return
         log_gui("Manager", "cycle end, restart if needed")
 
+    async def ack_listener(self, msg: Msg):
+        tid, status = msg.trace_id, msg.payload.get("status", "done")
+        parent = parent_trace_id(tid)
+        self._evict(tid)
+        if parent == tid:
+            self.completions.resolve(tid, status=status)
+            return
+        batch = self._batch(parent)
+        if batch is None or tid in batch["acked"]:
+            return  # duplicate ACK for a sub-trace already counted
+        if batch["children"] is not None and tid not in batch["children"]:
+            return  # not a sub-trace of this batch (e.g. a shared enrichment trace)
+        batch["acked"][tid] = status
+        self._maybe_complete(parent)
+
+    async def fanout_listener(self, msg: Msg):
+        batch = self._batch(msg.trace_id)
+        if batch is not None:
+            batch["children"] = set(msg.payload["children"])
+            # ACKs that raced ahead of the fan-out only count if they name a real sub-trace
+            batch["acked"] = {t: s for t, s in batch["acked"].items() if t in batch["children"]}
+            self._maybe_complete(msg.trace_id)
+
+    def _batch(self, parent: str):
+        # only the process that started the trace tracks it (shards also see exported roles)
+        if parent not in self.completions:
+            return None
+        return self.batches.setdefault(parent, {"children": None, "acked": {}})
+
+    def _maybe_complete(self, parent: str):
+        batch = self.batches[parent]
+        if batch["children"] is not None and batch["children"] <= batch["acked"].keys():
+            del self.batches[parent]
+            failed = sum(s != "done" for s in batch["acked"].values())
+            self.completions.resolve(parent, status="done" if not failed else "partial",
+                                     result={"expected": len(batch["children"]), "done": len(batch["acked"]),
+                                             "failed": failed})
+
+    def _close(self, tid: str):
+        self._closed[tid] = None
+        while len(self._closed) > CLOSED_MAX:
+            self._closed.popitem(last=False)
+
+    def _evict(self, tid: str):
+        self.waiting.pop(tid, None)
+        self._waiting_deadline.pop(tid, None)
+        self.batches.pop(tid, None)
+
+    def _sweep_waiting(self):
+        now = time.monotonic()
+        while self._waiting_deadline:
+            tid, deadline = next(iter(self._waiting_deadline.items()))
+            if deadline > now:
+                break
+            self._evict(tid)
+            self._close(tid)
+            self.completions.counts["waiting_expired"] += 1
+        # traces whose starter is gone (e.g. a cancelled start_pipeline) are reaped here too
+        for tid in self.completions.sweep(now):
+            self.batches.pop(tid, None)
+
+    def stats(self) -> dict[str, int]:
+        return {**self.completions.stats(), "waiting": len(self.waiting), "batches": len(self.batches)}
+
+    def _enrichment_groups(self, parent: str, children: list[tuple[str, dict]]):
+        """Yield (enrichment trace id, [(sub-trace id, anomaly), ...])."""
+        if self.enrich_batch_size <= 1:
+            for child in children:
+                yield child[0], [child]
+            return
+        by_rule: dict[str, list] = {}
+        for child in children:
+            by_rule.setdefault(child[1].get("rule") or child[1].get("description", ""), []).append(child)
+        gid = itertools.count(1)
+        for members in by_rule.values():
+            for i in range(0, len(members), self.enrich_batch_size):
+                chunk = members[i:i + self.enrich_batch_size]
+                yield (chunk[0][0] if len(chunk) == 1 else child_trace_id(parent, f"g{next(gid)}")), chunk
+
     async def manager_plan_listener(self, msg: Msg):
         log_gui("Manager", "planning enrichment retrieval")
-        anom = msg.payload["anomaly"]
-        tid = msg.trace_id
-        self.waiting[tid] = {"anomaly": anom, "ctx": None, "hist": None}
+        parent = msg.trace_id
+        anomalies = msg.payload.get("anomalies") or [msg.payload["anomaly"]]
+        children = [(child_trace_id(parent, i), anom) for i, anom in enumerate(anomalies, 1)]
+        self._sweep_waiting()
+        await self.bus.publish(Msg.fast(trace_id=parent, role="BATCH_FANOUT",
+                                        payload={"children": [tid for tid, _ in children]}))
         pool_collection = msg.payload.get("collection", None)
         pool_model = msg.payload.get("model", None)
         log_gui("Manager", f"passing collection: {pool_collection}, model: {pool_model}")
 
-        # parallel trigger
-        await self.bus.publish(Msg(trace_id=tid, role="KRetriever", payload={"anomaly": anom, "collection": pool_collection, "model": pool_model}))
-        await self.bus.publish(Msg(trace_id=tid, role="HRetriever", payload={"anomaly": anom, "collection": pool_collection, "model": pool_model}))
-        log_gui("Manager", f"received anomaly {anom}, triggering retrievers")
+        for tid, members in self._enrichment_groups(parent, children):
+            self.waiting[tid] = {"members": members, "ctx": None, "hist": None}
+            # re-inserted at the end: _sweep_waiting relies on deadline order
+            self._waiting_deadline.pop(tid, None)
+            self._waiting_deadline[tid] = time.monotonic() + self.ttl_s
+            # a shared prompt sees the list of related anomalies
+            anom = members[0][1] if len(members) == 1 else [a for _, a in members]
+            # parallel trigger
+            await self.bus.publish(Msg.fast(trace_id=tid, role="KRetriever", payload={"anomaly": anom, "collection": pool_collection, "model": pool_model}))
+            await self.bus.publish(Msg.fast(trace_id=tid, role="HRetriever", payload={"anomaly": anom, "collection": pool_collection, "model": pool_model}))
+            log_gui("Manager", f"{tid}: triggering retrievers for {len(members)} anomalies")
 
     async def enr_ok_listener(self, msg: Msg):
-        store = self.waiting[msg.trace_id]
+        store = self.waiting.get(msg.trace_id)
+        if store is None:
+            log_gui("Manager", f"late enrichment for evicted trace {msg.trace_id}, ignoring", "warning")
+            return
         if "hist" in msg.payload:
             store["hist"] = msg.payload["hist"]
         else:
             store["ctx"] = msg.payload["ctx"]
         if store["ctx"] and store["hist"]:
-            from app.utils.tracing import log_gui
-            log_gui("Manager", f"both enrichments ready for {msg.trace_id}, assembling report")
-            await self.bus.publish(Msg(trace_id=msg.trace_id,
-                                       role="NOTIFY_ASSEMBLE",
-                                       payload=store))
-            
+            log_gui("Manager", f"both enrichments ready for {msg.trace_id}, assembling {len(store['members'])} reports")
+            self._evict(msg.trace_id)
+            for tid, anom in store["members"]:
+                await self.bus.publish(Msg(trace_id=tid,
+                                           role="NOTIFY_ASSEMBLE",
+                                           payload={"anomaly": anom, "ctx": store["ctx"], "hist": store["hist"]}))
+
     async def fatal_error(self, msg: Msg):
+        if msg.trace_id in self._closed:
+            # the other retriever chain of the same trace already failed it
+            log_gui("Manager", f"fatal error for already failed trace {msg.trace_id}, ignoring", "warning")
+            return
         log_gui("Manager", f"fatal error occurred: too many retries in {msg.payload['reason']}")
-        await self.bus.publish(Msg(trace_id=msg.trace_id, role="ACK_DONE", payload={}))
+        store = self.waiting.get(msg.trace_id)
+        self._evict(msg.trace_id)
+        self._close(msg.trace_id)
+        # an enrichment failure fails every sub-trace it was serving
+        for tid in [t for t, _ in store["members"]] if store else [msg.trace_id]:
+            await self.bus.publish(Msg(trace_id=tid, role="ACK_DONE", payload={"status": "fatal"}))
 
@@ -1,9 +1,16 @@
+import asyncio, collections, contextlib, threading, time
 from langchain_core.prompts import ChatPromptTemplate
 from app.core.bus import EventBus
-from app.core.messages import Msg
+from app.core.messages import CARRY_KEY, Msg
 from app.utils.tracing import log
 from app.utils.llm_factory import get_llm   
-from app.utils.tracing import log_gui
+from app.utils.tracing import log_gui, stream_gui
+from app.utils.config import settings
+from app.utils.report_checks import partial_check
+from app.utils.tokens import count_tokens
+from app.utils.prompt_budget import build_prompt
+from app.utils.history_index import get_history_index
+from app.utils.incident_store import get_incident_store
 
 
 REPORT_PROMPT = """
@@ -15,52 +22,115 @@ Generate a thorough incident report including severity assessment,
 root cause hypothesis and recommended mitigations in concise business English.
 """
 
-llm = get_llm()   # Ollama if available, else FakeListLLM
+REFLECTION_PROMPT = """
+        You are a SOC analyst assistant. You only writes reports, you DO NOT answer to questions. 
+        You just do what is asked to do, do not add any more content that has not been requested.
+        Original Report: {original_report}
+        Please revise the report based on the feedback provided by the GuardRail agent:
+
+        <GUARDRAIL>
+        Feedback: {feedback}
+        </GUARDRAIL>
+        """
+
+llm = get_llm("notify")   # Ollama if available, else FakeListLLM; resolved on first call
+
+# time-to-first-token and generation rate of the last streamed reports
+STREAM_STATS: collections.deque = collections.deque(maxlen=1000)
+
+
+async def _stream_report(bus: EventBus, trace_id: str, prompt: str) -> tuple[str, str]:
+    """
+    Generate a report token by token: chunks go to the GUI pane and, when
+    anyone subscribes to NOTIFY_STREAM_ROLE, to the bus. Cheap guardrail checks
+    run on the partial text; on the first failure generation stops and the
+    feedback is returned with the partial report.
+    """
+    role = settings.NOTIFY_STREAM_ROLE
+    publish = bool(role) and bool(bus.subscribers.get(role))
+    cancel = threading.Event()
+    parts, feedback, checked, ttft, stopped = [], "", 0, None, False
+    started = time.perf_counter()
+    stream_gui("Notify", f"[{trace_id}] ")
+    async with contextlib.aclosing(llm.astream(prompt, cancel=cancel)) as chunks:
+        async for chunk in chunks:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            parts.append(chunk)
+            stream_gui("Notify", chunk)
+            if publish:
+                await bus.publish(Msg.fast(trace_id, role, {"delta": chunk, "seq": len(parts) - 1, "done": False}))
+            size = sum(map(len, parts))
+            if size - checked >= settings.NOTIFY_STREAM_CHECK_CHARS:
+                checked = size
+                feedback = partial_check("".join(parts)) or ""
+                if feedback:
+                    cancel.set()
+                    stopped = True
+                    break
+    stream_gui("Notify", "\n")
+    report = "".join(parts)
+    feedback = feedback or partial_check(report) or ""
+    elapsed = time.perf_counter() - started
+    tokens = count_tokens(report)
+    stats = {"trace_id": trace_id, "ttft_s": round(ttft if ttft is not None else elapsed, 3), "tokens": tokens,
+             "tokens_per_s": round(tokens / max(elapsed - (ttft or 0.0), 1e-6), 1), "stopped_early": stopped}
+    STREAM_STATS.append(stats)
+    log_gui("Notify", f"report streamed: first token {stats['ttft_s']}s, {tokens} tokens at {stats['tokens_per_s']} tok/s"
+                      + (f", stopped early: {feedback}" if stats["stopped_early"] else ""))
+    if publish:
+        await bus.publish(Msg.fast(trace_id, role, {"delta": "", "seq": len(parts), "done": True, **stats}))
+    return report, feedback
+
+
+async def _generate(bus: EventBus, trace_id: str, prompt: str) -> dict:
+    """Fields of the REPORT_VALIDATE payload: the report, plus ``early_feedback`` when a streamed check failed."""
+    if not settings.NOTIFY_STREAM:
+        return {"report": str(await llm.ainvoke(prompt))}
+    report, feedback = await _stream_report(bus, trace_id, prompt)
+    return {"report": report, "early_feedback": feedback} if feedback else {"report": report}
+
 
 async def notify_listener(bus: EventBus, msg: Msg):
     if msg.role == "NOTIFY_ASSEMBLE":
         b = msg.payload
-        prompt_str = REPORT_PROMPT.format(anomaly=b["anomaly"],
-                                          ctx=b["ctx"],
-                                          hist=b["hist"])
+        # domain knowledge ranks above history when the prompt has to be compacted
+        prompt_str = build_prompt("notify", REPORT_PROMPT, {"ctx": str(b["ctx"]), "hist": str(b["hist"])},
+                                  anomaly=b["anomaly"])
         log_gui("Notify", "generating report via LLM")
 
-        report = llm.invoke(prompt_str )
+        generated = await _generate(bus, msg.trace_id, prompt_str)
         retry_count = b.get("retry_count", 0)
         await bus.publish(Msg(trace_id=msg.trace_id,
                               role="REPORT_VALIDATE",
-                              payload={"report": str(report), "retry_count": retry_count}))
+                              # the anomaly rides along for REPORT_OK; the guardrail only validates the report
+                              payload={**generated, CARRY_KEY: {"anomaly": b["anomaly"]}, "retry_count": retry_count}))
     elif msg.role == "REPORT_VALIDATE_REFLECT":
         feedback = msg.payload.get("feedback", "No feedback provided.")
         original_report = ""
+        anomaly = {}
         if isinstance(msg.payload, dict) and "original_payload" in msg.payload:
             original_report = msg.payload.get("original_payload", {}).get("report", "")
+            anomaly = msg.payload.get("original_payload", {}).get(CARRY_KEY, {}).get("anomaly", {})
         log_gui("Notify", f"reflecting on report due to feedback: {feedback}", "warning")
         log_gui("Notify", f"original report: {original_report}", "debug")
-        reflection_prompt = f"""
-        You are a SOC analyst assistant. You only writes reports, you DO NOT answer to questions. 
-        You just do what is asked to do, do not add any more content that has not been requested.
-        Original Report: {original_report}
-        Please revise the report based on the feedback provided by the GuardRail agent:
-
-        <GUARDRAIL>
-        Feedback: {feedback}
-        </GUARDRAIL>
-        """
-        revised_report = llm.invoke(reflection_prompt)
+        reflection_prompt = build_prompt("notify", REFLECTION_PROMPT, {"original_report": str(original_report)},
+                                         feedback=feedback)
+        generated = await _generate(bus, msg.trace_id, reflection_prompt)
         retry_count = msg.payload.get("retry_count", 0)
         await bus.publish(Msg(trace_id=msg.trace_id,
                               role="REPORT_VALIDATE",
-                              payload={"report": str(revised_report), "retry_count": retry_count}))
+                              payload={**generated, CARRY_KEY: {"anomaly": anomaly}, "retry_count": retry_count}))
 
     elif msg.role == "REPORT_OK":
         report = msg.payload["report"]
+        anomaly = msg.payload.get(CARRY_KEY, {}).get("anomaly", {})
         log_gui("Notify", f"commiting validated report", "info")
-        import csv, pathlib
-        p = pathlib.Path("demo-llm-pipeline/app/db/pool_db.csv")
-        p.parent.mkdir(parents=True, exist_ok=True)
-        with p.open("a", newline="") as f:
-            csv.writer(f).writerow("\n")
-            csv.writer(f).writerow([msg.trace_id, report])
-        log_gui("Notify", f"report committed to pool_db.csv: {report}", "info")
+        # group commit: concurrent reports share one SQLite transaction
+        incidents = await asyncio.to_thread(get_incident_store)
+        await incidents.add_async(msg.trace_id, anomaly, report)
+        log_gui("Notify", f"report committed to the incident store: {report}", "info")
+        # keep the on-disk history index in step with the store, one report at a time
+        index = await asyncio.to_thread(get_history_index)
+        await asyncio.to_thread(index.add_report, msg.trace_id, anomaly, report)
         await bus.publish(Msg(trace_id=msg.trace_id, role="ACK_DONE", payload={}))
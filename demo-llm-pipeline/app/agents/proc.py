@@ -1,81 +1,140 @@
-import csv
-import chromadb
-import io, pandas as pd, numpy as np, ipaddress
-from sentence_transformers import SentenceTransformer
+import asyncio
+import io, pathlib, pandas as pd, numpy as np, ipaddress
+import joblib
 from sklearn.preprocessing import RobustScaler
 from app.core.messages import Msg
+from app.core.object_store import store
 from app.utils.tracing import log
 from app.core.bus import EventBus
 from app.utils.config import settings
+from app.utils.flow_schema import FLOW_COLUMNS, FLOW_DTYPES, encode_ips
+from app.utils.history_index import get_history_index
+from app.models.flow_features import SCALED_FEATURES, add_flow_features
+
+try:
+    import pyarrow  # noqa: F401
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
+
+class _FlowLines(io.TextIOBase):
+    """Read-only text stream over the flow lines of ``lines`` (they start with the epoch timestamp)."""
+
+    def __init__(self, lines):
+        self._lines = (line for line in lines if line[:1].isdigit())
+        self._buf = ""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        if size is None or size < 0:
+            out, self._buf = self._buf + "".join(self._lines), ""
+            return out
+        parts, n = [self._buf], len(self._buf)
+        while n < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            n += len(line)
+        buf = "".join(parts)
+        out, self._buf = buf[:size], buf[size:]
+        return out
+
 
 class NetworkLogPreprocessor:
     def __init__(self):
         self.scaler = RobustScaler()
         self.POOLDB_PATH = settings.POOL_DB_PATH
 
-    def preprocess(self, raw_csv: str):
-        df = pd.read_csv(io.StringIO(raw_csv), header=None, names=[
-            'timestamp','src_ip','dst_ip','src_port','dst_port','protocol',
-            'bytes','packets','duration','cell_id','user_hash'
-        ])
-        df["datetime"] = pd.to_datetime(df["timestamp"], unit="s")
-        df["hour"] = df["datetime"].dt.hour
+    def preprocess(self, raw_logs: str):
+        return self.preprocess_source(io.StringIO(raw_logs))
+
+    def preprocess_source(self, source, chunksize: int | None = None):
+        """
+        Parse the flow lines of a path, an open text file or a text buffer
+        with explicit compact dtypes; any other line (headers, banners) is
+        skipped. The C engine reads ``chunksize`` rows at a time, so the raw
+        text is never held whole, but the typed frame is: features and
+        detection need every row.
+        """
+        chunks = list(self.iter_chunks(source, chunksize or settings.PROC_CHUNK_ROWS))
+        if not chunks:
+            return self._finalize(pd.DataFrame({c: pd.Series(dtype=t) for c, t in FLOW_DTYPES.items()}))
+        if len(chunks) == 1:
+            return chunks[0]
+        df = pd.concat(chunks, ignore_index=True)
+        for col in ("cell_id", "user_hash"):
+            df[col] = df[col].astype("category")  # categories differ between chunks
         return df
 
-    def setup_vector_db(self):
-        db = chromadb.Client()
-        collection = db.create_collection("incident_reports")
-        model = SentenceTransformer("all-MiniLM-L6-v2")
-        # Indicizza i report storici
-        # Indicizza ogni anomalia come nodo, usando il nome come documento e id
-        with open(self.POOLDB_PATH, "r") as f:
-            reports = []
-            current_report = {}
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                if line.startswith("Anomaly_id"):
-                    if current_report:
-                        reports.append(current_report)
-                        current_report = {}
-                    parts = line.split(",", 1)
-                    current_report["Anomaly_id"] = parts[1].strip() if len(parts) > 1 else ""
-                elif line.startswith("Anomaly_description"):
-                    parts = line.split(",", 1)
-                    current_report["Anomaly_description"] = parts[1].strip() if len(parts) > 1 else ""
-                else:
-                    # Assume the rest is the report content
-                    current_report.setdefault("Report", []).append(line)
-            if current_report:
-                reports.append(current_report)
+    def iter_chunks(self, source, chunksize: int):
+        if isinstance(source, (str, pathlib.Path)):
+            with open(source, encoding="utf-8", newline="") as f:
+                yield from self.iter_chunks(f, chunksize)
+            return
+        lines = _FlowLines(source)
+        if settings.PROC_CSV_ENGINE == "pyarrow" and _HAS_PYARROW:
+            # pyarrow parses multi-threaded but has no chunked reader in pandas: one pass, ``chunksize`` unused
+            yield self._finalize(pd.read_csv(io.StringIO(lines.read()), header=None, names=FLOW_COLUMNS,
+                                             dtype=FLOW_DTYPES, engine="pyarrow"))
+            return
+        reader = pd.read_csv(lines, header=None, names=FLOW_COLUMNS, dtype=FLOW_DTYPES,
+                             skip_blank_lines=True, engine="c", chunksize=chunksize)
+        for chunk in reader:
+            yield self._finalize(chunk)
 
-            for i, report in enumerate(reports):
-                r = "\n".join(report["Report"])
-                anomaly_id = report.get("Anomaly_id", "")
-                anomaly_description = report.get("Anomaly_description", "")
-                if anomaly_id:
-                    embedding = model.encode(anomaly_description).tolist()
-                    collection.add(
-                        documents=[anomaly_description],
-                        embeddings=[embedding],
-                        ids=[str(i)],
-                        metadatas=[{"full_report": r, "description": anomaly_description}]
-                    )
+    def _finalize(self, df: pd.DataFrame):
+        df["src_ip"] = encode_ips(df["src_ip"])
+        df["dst_ip"] = encode_ips(df["dst_ip"])
+        df["datetime"] = pd.to_datetime(df["timestamp"], unit="s")
+        df["hour"] = df["datetime"].dt.hour.astype("int8")
+        return df
 
-        return collection, model
+    def scale_features(self, df: pd.DataFrame, fit: bool = False):
+        """
+        Add ``<feature>_scaled`` columns with a RobustScaler persisted at
+        FEATURE_SCALER_PATH: loaded if present, otherwise fitted on this frame
+        (or refitted when ``fit``) and saved.
+        """
+        path = pathlib.Path(settings.FEATURE_SCALER_PATH)
+        X = df[SCALED_FEATURES].to_numpy(dtype=np.float32)
+        if path.exists() and not fit:
+            self.scaler = joblib.load(path)
+        else:
+            self.scaler.fit(X)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            joblib.dump(self.scaler, path)
+        scaled = self.scaler.transform(X).astype(np.float32)
+        for i, col in enumerate(SCALED_FEATURES):
+            df[f"{col}_scaled"] = scaled[:, i]
+        return df
+
+    def setup_vector_db(self):
+        # long-lived on-disk index: opened once per process, updated by Notify on REPORT_OK
+        index = get_history_index()
+        return index.collection, index.model
 
 async def proc_listener(bus: EventBus, msg: Msg):
     from app.utils.tracing import log_gui
-    raw = msg.payload["raw_logs"]
     log_gui("Proc", "start")
 
     pre = NetworkLogPreprocessor()
-    csv_part = "\n".join(l for l in raw.splitlines() if l and l[0].isdigit())
-    df = pre.preprocess(csv_part)
+    if "path" in msg.payload:
+        # file ingest: read in chunks, never loaded as one string
+        df = pre.preprocess_source(msg.payload["path"])
+    else:
+        df = pre.preprocess(msg.payload["raw_logs"])
+    df = add_flow_features(df, window_s=settings.FEATURE_WINDOW_S)
+    if settings.FEATURE_SCALE:
+        df = pre.scale_features(df)
     log_gui("Proc", f"produced the following DataFrame:\n{df.head().to_string()}")
-    collection, model = pre.setup_vector_db()
+    collection, model = await asyncio.to_thread(pre.setup_vector_db)  # first call opens the index
     log_gui("Proc", f"produced the following vector DB:\n{collection}\n{model}")
-    await bus.publish(Msg(trace_id=msg.trace_id,
-                          role="INGEST_OK",
-                          payload={"df": df, "collection": collection, "model": model}))
+    # heavy objects stay in the object store, the message only carries handles
+    await bus.publish(Msg.fast(trace_id=msg.trace_id,
+                               role="INGEST_OK",
+                               payload={"df": store.put(df),
+                                        "collection": store.put(collection, key="incident_reports"),
+                                        "model": store.put(model, key="embedder")}))
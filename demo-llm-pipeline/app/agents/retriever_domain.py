@@ -3,17 +3,25 @@ import pathlib
 from app.utils.tracing import log
 from app.core.messages import Msg
 from app.core.bus import EventBus
+from app.core.object_store import store
 from app.utils.llm_factory import get_llm
 from app.utils.tracing import log_gui
+from app.utils.config import settings
+from app.utils.rule_index import RuleIndex
+from app.utils.tokens import count_tokens
+from app.utils.prompt_budget import build_prompt, render_payload
 
 
 DK_PATH = str(pathlib.Path(__file__).parent.parent / "db" / "domain_knowledge.json")
+F5_PATH = str(pathlib.Path(__file__).parent.parent / "db" / "domain_knowledge" / "f5_anomaly_rules_en.json")
 RULE_PATH = str(pathlib.Path(__file__).parent.parent / "db" / "agents_cards" / "kretriever.json")
 
 with open(RULE_PATH, "r", encoding="utf-8") as f:
     prompt = json.load(f)
 
-llm = get_llm()
+llm = get_llm("kretriever")
+# built once; rebuilt by the next search when a rule file's mtime changes
+rule_index = RuleIndex([DK_PATH, F5_PATH])
 
 agent_instructions = prompt["instructions"]
 prompt_template = agent_instructions["prompt_template"]
@@ -50,16 +58,18 @@ async def kretrieve_listener(bus: EventBus, msg: Msg):
     if msg.role == "KRetriever":
         log_gui("KRetriever", "received retrieval request")
         anomaly = msg.payload["anomaly"]
-        # Load candidate "chunks" from domain_knowledge.json
-        with open(DK_PATH, "r") as f:
-            kb = json.load(f)["rules"]
-        kb_str = "\n".join(
-            f'- {r["rule"]}: {r.get("explaination", "")} Example: {", ".join([ex["description"] for ex in r.get("examples", [])[:1]])}'
-            if isinstance(r, dict) else f'- {r}' for r in kb
-        )
-        prompt = RAG_PROMPT.format(prompt_template=prompt_template, anomaly=anomaly, knowledge_base=kb_str, response_properties=response_properties, required_fields=required_fields)
+        # only the top-k rules for this anomaly (or group of related anomalies) go into the prompt
+        anomalies = anomaly if isinstance(anomaly, list) else [anomaly]
+        query = " ".join(a.get("description", "") for a in anomalies)
+        rule = anomalies[0].get("rule") if len(anomalies) == 1 else None
+        encoder = store.get(msg.payload.get("model")) if settings.KB_RETRIEVAL == "hybrid" else None
+        kb_str = rule_index.context(query, k=settings.KB_TOP_K, rule=rule, encoder=encoder)
+        prompt = build_prompt("kretriever", RAG_PROMPT, {"knowledge_base": kb_str}, prompt_template=prompt_template,
+                              anomaly=anomaly, response_properties=response_properties, required_fields=required_fields)
         log_gui("KRetriever", f"prompt: {prompt}")
-        ctx_result = llm.invoke(prompt)
+        log_gui("KRetriever", f"prompt ~{count_tokens(prompt)} tokens "
+                              f"(knowledge base {count_tokens(kb_str)} of {count_tokens(rule_index.full_context())})")
+        ctx_result = await llm.ainvoke(prompt)
         log_gui("KRetriever", f"context result: {ctx_result}")
         retry_count = msg.payload.get("retry_count", 0)
         await bus.publish(Msg(
@@ -75,8 +85,9 @@ async def kretrieve_listener(bus: EventBus, msg: Msg):
         anomaly = reflection["original_payload"]["anomaly"]
         feedback = reflection["feedback"]
         original_payload = reflection["original_payload"]
-        prompt = REFLECTION_PROMPT.format(original_payload=original_payload, feedback=feedback)
-        ctx_result = llm.invoke(prompt)
+        prompt = build_prompt("kretriever", REFLECTION_PROMPT, {"original_payload": render_payload(original_payload)},
+                              feedback=feedback)
+        ctx_result = await llm.ainvoke(prompt)
         log_gui("KRetriever", f"Reflection retry with feedback: {feedback}")
         log_gui("KRetriever", f"New context result: {ctx_result}")
         retry_count = msg.payload.get("retry_count", 0)
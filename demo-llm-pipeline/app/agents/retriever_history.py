@@ -1,14 +1,19 @@
-import csv
+import asyncio
 import json
 import pathlib
+import time
 from app.utils.tracing import log
 from app.core.messages import Msg
 from app.core.bus import EventBus
+from app.core.object_store import store
 from app.utils.llm_factory import get_llm
 from app.utils.tracing import log_gui
 from app.utils.config import settings
+from app.utils.history_index import get_history_index, search_reports
+from app.utils.incident_store import get_incident_store
+from app.utils.tokens import count_tokens, fit_budget
+from app.utils.prompt_budget import build_prompt, render_payload
 
-POOLDB_PATH = settings.POOL_DB_PATH
 RULE_PATH = str(pathlib.Path(__file__).parent.parent / "db" / "agents_cards" / "hretriever.json")
 
 with open(RULE_PATH, "r", encoding="utf-8") as f:
@@ -21,7 +26,7 @@ response_properties = response_format["properties"]
 required_fields = response_format["required"]
 
 notes = agent_instructions.get("notes", "No additional notes provided.")
-llm = get_llm()
+llm = get_llm("hretriever")
 
 RAG_PROMPT = """
 {prompt_template}:
@@ -46,32 +51,62 @@ History:
 </GUARDRAIL>
 """
 
-async def hretrieve_listener(bus: EventBus, msg: Msg):
-    
+def _history_filter(anomalies: list[dict]):
+    conds = []
+    if "rule" in settings.HISTORY_FILTERS and len({a.get("rule") or a.get("description") for a in anomalies}) == 1:
+        conds.append({"rule": anomalies[0].get("rule") or anomalies[0].get("description", "")})
+    if "severity" in settings.HISTORY_FILTERS and len({a.get("severity") for a in anomalies}) == 1:
+        conds.append({"severity": anomalies[0].get("severity", "")})
+    if settings.HISTORY_MAX_AGE_S > 0:
+        conds.append({"ts": {"$gte": time.time() - settings.HISTORY_MAX_AGE_S}})
+    if not conds:
+        return None
+    return conds[0] if len(conds) == 1 else {"$and": conds}
+
+
+async def _vector_history(msg: Msg, anomaly) -> str:
+    """Top-k similar past reports, filtered by metadata, packed into HISTORY_TOKEN_BUDGET tokens."""
+    collection, embedder = store.get(msg.payload.get("collection")), store.get(msg.payload.get("model"))
+    if collection is None or embedder is None:
+        index = await asyncio.to_thread(get_history_index)
+        collection, embedder = index.collection, index.model
+    anomalies = anomaly if isinstance(anomaly, list) else [anomaly]
+    query = " ".join(a.get("description", "") for a in anomalies)
+    where = _history_filter(anomalies)
+    hits = await asyncio.to_thread(search_reports, collection, embedder, query, settings.HISTORY_TOP_K, where)
+    if not hits:
+        return "No prior incidents recorded yet."
+    parts = fit_budget([f'- {h.get("description", "")}: {h.get("full_report", "")}' for h in hits],
+                       settings.HISTORY_TOKEN_BUDGET)
+    log_gui("HRetriever", f"retrieved {len(hits)} reports (filter {where}), kept {len(parts)} "
+                          f"within {settings.HISTORY_TOKEN_BUDGET} tokens")
+    return "\n".join(parts)
+
 
+def _full_history() -> str:
+    # legacy mode: every report in the incident store
+    history_rows = [r["report"] for r in get_incident_store().range(limit=None)]
+    return "\n".join(history_rows) if history_rows else "No prior incidents recorded yet."
+
+
+async def hretrieve_listener(bus: EventBus, msg: Msg):
     if msg.role == "HRetriever":
         anomaly = msg.payload["anomaly"]
-        # Load up to 5 recent history reports
-        history_rows = []
-        try:
-            with open(POOLDB_PATH, "r") as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if row:
-                        history_rows.append(row[-1])
-        except FileNotFoundError:
-            history_rows = ["No prior incidents recorded yet."]
-        context_hist = "\n".join(history_rows)
-        prompt = RAG_PROMPT.format(
+        if settings.HISTORY_RETRIEVAL == "vector":
+            context_hist = await _vector_history(msg, anomaly)
+        else:
+            context_hist = await asyncio.to_thread(_full_history)
+        prompt = build_prompt(
+            "hretriever", RAG_PROMPT, {"knowledge_base": context_hist},
             prompt_template=prompt_template,
             anomaly=anomaly,
-            knowledge_base=context_hist,
             required_fields=required_fields,
             response_properties=response_properties,
             notes=notes
             )
         log_gui("HRetriever", f"prompt: {prompt}")
-        rag_result = llm.invoke(prompt)
+        log_gui("HRetriever", f"prompt ~{count_tokens(prompt)} tokens (history {count_tokens(context_hist)})")
+        rag_result = await llm.ainvoke(prompt)
         log_gui("HRetriever", f"history result: {rag_result}")
         retry_count = msg.payload.get("retry_count", 0)
         await bus.publish(Msg(
@@ -80,40 +115,6 @@ async def hretrieve_listener(bus: EventBus, msg: Msg):
             payload={"anomaly": anomaly, "hist": rag_result, "retry_count": retry_count}
         ))
 
-    ############## STILL WORK IN PROGRESS TO TRANSFORM IT INTO A RAG #################
-    # if msg.role == "HRetriever":
-    #     vector_collection = msg.payload["collection"]
-    #     embedder = msg.payload["model"]
-    #     log_gui("HRetriever", f"vector collection: {vector_collection}, embedder: {embedder}")
-    #     anomaly = msg.payload["anomaly"]
-    #     # Recupera i report più simili all'anomalia
-    #     anomaly_embedding = embedder.encode(anomaly["description"]).tolist()
-    #     results = vector_collection.query(
-    #         query_embeddings=[anomaly_embedding],
-    #         n_results=3
-    #     )
-    #     # Flatten the first 3 lists in results['documents'] and join their contents
-    #     top_docs = results['documents'][:3]
-    #     retrieved_reports = [item for sublist in top_docs for item in sublist]
-    #     context_hist = "\n".join(retrieved_reports)
-    #     log_gui("HRetriever", f"retrieved reports: {retrieved_reports}")
-    #     prompt = RAG_PROMPT.format(
-    #         prompt_template=prompt_template,
-    #         knowledge_base=context_hist,
-    #         required_fields=required_fields,
-    #         response_properties=response_properties,
-    #         notes=notes
-    #     )
-    #     log_gui("HRetriever", f"prompt: {prompt}")
-    #     rag_result = llm.invoke(prompt)
-    #     log_gui("HRetriever", f"history result: {rag_result}")
-    #     retry_count = msg.payload.get("retry_count", 0)
-    #     await bus.publish(Msg(
-    #         trace_id=msg.trace_id,
-    #         role="HRETRIEVE_VALIDATE",
-    #         payload={"anomaly": anomaly, "hist": rag_result, "retry_count": retry_count}
-    #     ))
-
     elif msg.role == "HRETRIEVE_VALIDATE_REFLECT":
         # Reflection: get feedback and use new prompt
         reflection = msg.payload
@@ -121,8 +122,11 @@ async def hretrieve_listener(bus: EventBus, msg: Msg):
         anomaly = original_payload["anomaly"]
         feedback = reflection["feedback"]
         history_rows = original_payload["hist"]
-        prompt = REFLECTION_PROMPT.format(original_payload=original_payload, feedback=feedback, history=history_rows)
-        rag_result = llm.invoke(prompt)
+        # the rejected payload already carries the history: repeated lines are dropped from the History section
+        prompt = build_prompt("hretriever", REFLECTION_PROMPT,
+                              {"original_payload": render_payload(original_payload), "history": str(history_rows)},
+                              feedback=feedback)
+        rag_result = await llm.ainvoke(prompt)
         log_gui("HRetriever", f"Reflection retry with feedback: {feedback}")
         log_gui("HRetriever", f"Reflection result: {rag_result}")
         retry_count = msg.payload.get("retry_count", 0)
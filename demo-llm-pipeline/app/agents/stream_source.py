@@ -0,0 +1,151 @@
+import asyncio, os, sys, time
+from typing import AsyncIterator
+from app.utils.tracing import log
+
+# A chunk is a list of complete raw log lines, as read from the source in one go.
+Chunks = AsyncIterator[list[str]]
+
+
+async def tail_file(path: str, from_start: bool = False, poll_s: float = 0.2, chunk_size: int = 1 << 16) -> Chunks:
+    """Follow a growing flow log (like ``tail -F``): handles truncation/rotation by reopening."""
+    partial = ""
+    f = open(path, "r", encoding="utf-8", errors="replace")
+    try:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                try:
+                    rotated = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino or os.path.getsize(path) < f.tell()
+                except FileNotFoundError:
+                    rotated = False
+                if rotated:
+                    f.close()
+                    f = open(path, "r", encoding="utf-8", errors="replace")
+                    partial = ""
+                await asyncio.sleep(poll_s)
+                continue
+            lines = (partial + data).split("\n")
+            partial = lines.pop()
+            if lines:
+                yield lines
+    finally:
+        f.close()
+
+
+async def read_stream(reader: asyncio.StreamReader, chunk_size: int = 1 << 16) -> Chunks:
+    partial = b""
+    while data := await reader.read(chunk_size):
+        lines = (partial + data).split(b"\n")
+        partial = lines.pop()
+        if lines:
+            yield [l.decode("utf-8", "replace") for l in lines]
+    if partial:
+        yield [partial.decode("utf-8", "replace")]
+
+
+async def read_stdin(chunk_size: int = 1 << 16) -> Chunks:
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=chunk_size)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    async for lines in read_stream(reader, chunk_size):
+        yield lines
+
+
+async def serve_socket(host: str, port: int, chunk_size: int = 1 << 16, backlog: int = 8) -> Chunks:
+    """Accept any number of TCP producers; the bounded queue pushes back on them via TCP flow control."""
+    q: asyncio.Queue = asyncio.Queue(maxsize=backlog)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            async for lines in read_stream(reader, chunk_size):
+                await q.put(lines)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    log(f"Stream ▶ listening on {host}:{port}")
+    async with server:
+        while True:
+            yield await q.get()
+
+
+class MicroBatcher:
+    """
+    Cuts a stream of lines into micro-batches: a batch is emitted when it reaches
+    ``max_rows`` lines or when its oldest line has waited ``max_wait_s`` seconds.
+    """
+
+    def __init__(self, max_rows: int = 5000, max_wait_s: float = 1.0, prefetch: int = 4):
+        self.max_rows, self.max_wait_s, self.prefetch = max_rows, max_wait_s, prefetch
+
+    async def batches(self, chunks: Chunks) -> AsyncIterator[list[str]]:
+        # the reader runs in its own task so the time window can fire while the source is idle;
+        # the small queue keeps it at most `prefetch` chunks ahead of the consumer
+        q: asyncio.Queue = asyncio.Queue(maxsize=self.prefetch)
+
+        async def pump():
+            try:
+                async for lines in chunks:
+                    await q.put(lines)
+            except Exception as err:
+                log(f"Stream ▶ source failed: {err!r}", "error")
+            await q.put(None)
+
+        reader = asyncio.create_task(pump())
+        buf: list[str] = []
+        deadline = 0.0
+        try:
+            while True:
+                timeout = max(0.0, deadline - time.monotonic()) if buf else None
+                try:
+                    lines = await asyncio.wait_for(q.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield buf
+                    buf = []
+                    continue
+                if lines is None:
+                    break
+                if not buf:
+                    deadline = time.monotonic() + self.max_wait_s
+                buf.extend(l for l in lines if l.strip())
+                while len(buf) >= self.max_rows:
+                    yield buf[:self.max_rows]
+                    buf = buf[self.max_rows:]
+                    deadline = time.monotonic() + self.max_wait_s
+            if buf:
+                yield buf
+        finally:
+            reader.cancel()
+
+
+async def stream_ingest(seq, chunks: Chunks, max_rows: int, max_wait_s: float, max_in_flight: int):
+    """
+    Feed every micro-batch to the Proc stage as its own trace. At most
+    ``max_in_flight`` traces are open at once: when the pipeline falls behind,
+    reading stops, so lag stays bounded to roughly ``max_in_flight`` batches.
+    """
+    slots = asyncio.Semaphore(max_in_flight)
+    in_flight: set[asyncio.Task] = set()
+    n_batches = n_rows = 0
+    started = time.monotonic()
+
+    async def run(batch: list[str], cut_at: float):
+        try:
+            await seq.start_pipeline("\n".join(batch))
+            log(f"Stream ▶ batch of {len(batch)} rows done, lag {time.monotonic() - cut_at:.2f}s")
+        finally:
+            slots.release()
+
+    async for batch in MicroBatcher(max_rows, max_wait_s).batches(chunks):
+        await slots.acquire()
+        task = asyncio.create_task(run(batch, time.monotonic()))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        n_batches += 1
+        n_rows += len(batch)
+        elapsed = time.monotonic() - started
+        log(f"Stream ▶ batch {n_batches}: {len(batch)} rows, {len(in_flight)} in flight, "
+            f"{n_rows / elapsed if elapsed else 0:.0f} rows/s")
+    await asyncio.gather(*in_flight, return_exceptions=True)
@@ -1,19 +1,156 @@
-import asyncio, collections
-from typing import Callable, Awaitable
+import asyncio, collections, contextvars
+from dataclasses import dataclass
+from typing import Callable, Awaitable, Optional
 from .messages import Msg
+from app.utils.tracing import log
+
+# roles that drive trace completion: losing one leaves a trace open until TRACE_TTL_S
+CONTROL_ROLES = frozenset({"ACK_DONE", "BATCH_FANOUT", "FATAL", "MANAGER_PLAN"})
+
+# set while a bounded-mode worker runs a handler (and in tasks it spawns)
+_IN_HANDLER: contextvars.ContextVar[bool] = contextvars.ContextVar("in_handler", default=False)
+
+
+@dataclass
+class RoleLimits:
+    concurrency: int = 4          # handlers running at the same time for the role
+    maxsize: int = 100            # bounded queue; publish waits when full
+    drop_when_full: bool = False  # drop instead of waiting (counted in stats); never for CONTROL_ROLES
+
+
+@dataclass
+class RoleStats:
+    in_flight: int = 0
+    processed: int = 0
+    dropped: int = 0
+    failed: int = 0
+
 
 class EventBus:
-    def __init__(self):
+    """
+    In-memory asyncio bus.
+
+    Default mode keeps the original behaviour: one shared queue and one task per
+    subscriber per message. Passing ``limits`` and/or ``default_limits`` switches
+    to bounded mode: every role gets its own bounded queue drained by a fixed
+    pool of workers, so ``publish`` blocks (backpressure) when a role is saturated.
+
+    Only publishes from outside the bus wait. A handler re-publishing (e.g. the
+    GuardRail ``*_VALIDATE`` ↔ ``*_VALIDATE_REFLECT`` loop) enqueues past
+    ``maxsize`` instead, otherwise two saturated roles feeding each other would
+    block both worker pools for good. ``CONTROL_ROLES`` are never dropped.
+    """
+
+    def __init__(self, limits: Optional[dict[str, RoleLimits]] = None,
+                 default_limits: Optional[RoleLimits] = None):
         self.queue = asyncio.Queue()
         self.subscribers: dict[str, list[Callable[[Msg], Awaitable]]] = collections.defaultdict(list)
+        self.bounded = bool(limits) or default_limits is not None
+        self.limits = dict(limits or {})
+        self.default_limits = default_limits or RoleLimits()
+        for role in CONTROL_ROLES & {r for r, lim in self.limits.items() if lim.drop_when_full}:
+            raise ValueError(f"drop_when_full is not allowed for control role {role!r}")
+        self.role_queues: dict[str, asyncio.Queue] = {}
+        self._space: dict[str, asyncio.Condition] = {}
+        self.role_stats: dict[str, RoleStats] = collections.defaultdict(RoleStats)
+        self._workers: dict[str, list[asyncio.Task]] = collections.defaultdict(list)
+        self._started = False
+
+    @classmethod
+    def from_settings(cls):
+        from app.utils.config import settings
+        if settings.BUS_MODE != "bounded":
+            return cls()
+        limits = {role: RoleLimits(**cfg) for role, cfg in settings.BUS_ROLE_LIMITS.items()}
+        return cls(limits=limits, default_limits=RoleLimits(
+            concurrency=settings.BUS_DEFAULT_CONCURRENCY,
+            maxsize=settings.BUS_DEFAULT_QUEUE_SIZE,
+        ))
+
+    def _limits_for(self, role: str) -> RoleLimits:
+        return self.limits.get(role, self.default_limits)
+
+    def _role_queue(self, role: str) -> asyncio.Queue:
+        # unbounded underneath: ``maxsize`` is enforced in publish so handlers can go past it
+        q = self.role_queues.get(role)
+        if q is None:
+            q = self.role_queues[role] = asyncio.Queue()
+            self._space[role] = asyncio.Condition()
+        return q
 
     async def publish(self, msg: Msg):
-        await self.queue.put(msg)
+        if not self.bounded:
+            await self.queue.put(msg)
+            return
+        if not self.subscribers.get(msg.role):
+            # same as unbounded mode: nobody listening, nothing to deliver
+            return
+        q = self._role_queue(msg.role)
+        lim = self._limits_for(msg.role)
+        full = lim.maxsize > 0 and q.qsize() >= lim.maxsize
+        if full and lim.drop_when_full and msg.role not in CONTROL_ROLES:
+            self.role_stats[msg.role].dropped += 1
+            log(f"EventBus ▶ {msg.role} saturated, dropped message for {msg.trace_id}", "warning")
+            return
+        if full and not _IN_HANDLER.get():
+            space = self._space[msg.role]
+            async with space:
+                await space.wait_for(lambda: q.qsize() < lim.maxsize)
+        q.put_nowait(msg)
 
     def subscribe(self, role: str, coro: Callable[[Msg], Awaitable]):
         self.subscribers[role].append(coro)
+        if self.bounded and self._started and not self._workers.get(role):
+            self._spawn_workers(role)
+
+    def _spawn_workers(self, role: str):
+        q = self._role_queue(role)
+        for _ in range(max(1, self._limits_for(role).concurrency)):
+            self._workers[role].append(asyncio.create_task(self._worker(role, q)))
+
+    async def _worker(self, role: str, q: asyncio.Queue):
+        stats, space = self.role_stats[role], self._space[role]
+        _IN_HANDLER.set(True)  # the worker task runs in its own context copy
+        while True:
+            msg: Msg = await q.get()
+            async with space:
+                space.notify()
+            stats.in_flight += 1
+            try:
+                for coro in list(self.subscribers.get(role, [])):
+                    try:
+                        await coro(msg)
+                    except Exception as err:
+                        stats.failed += 1
+                        log(f"EventBus ▶ handler for {role} failed on {msg.trace_id}: {err!r}", "error")
+            finally:
+                stats.in_flight -= 1
+                stats.processed += 1
+                q.task_done()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Live per-role counters: queue depth, in-flight handlers, processed, drops."""
+        if not self.bounded:
+            return {"*": {"queued": self.queue.qsize()}}
+        roles = set(self.role_queues) | set(self.role_stats)
+        return {
+            role: {
+                "queued": self.role_queues[role].qsize() if role in self.role_queues else 0,
+                "in_flight": self.role_stats[role].in_flight,
+                "processed": self.role_stats[role].processed,
+                "dropped": self.role_stats[role].dropped,
+                "failed": self.role_stats[role].failed,
+            }
+            for role in sorted(roles)
+        }
 
     async def start(self):
+        if self.bounded:
+            self._started = True
+            for role in list(self.subscribers):
+                if not self._workers.get(role):
+                    self._spawn_workers(role)
+            await asyncio.Event().wait()  # workers run until the loop is torn down
         while True:
             msg: Msg = await self.queue.get()
             for coro in self.subscribers.get(msg.role, []):
@@ -0,0 +1,59 @@
+import asyncio, collections, time
+from typing import Any, Optional
+
+
+class CompletionRegistry:
+    """
+    Trace-indexed completion futures.
+
+    One ``ACK_DONE`` listener resolves the future of its trace with a dict lookup,
+    instead of fanning out to one closure per pipeline ever started. Entries are
+    evicted on completion or TTL; insertion order equals deadline order (single
+    TTL), so ``sweep`` only looks at the oldest entries.
+    """
+
+    def __init__(self, ttl_s: float = 300.0):
+        self.ttl_s = ttl_s
+        self._entries: collections.OrderedDict[str, tuple[float, asyncio.Future]] = collections.OrderedDict()
+        self.counts: collections.Counter[str] = collections.Counter()
+
+    def register(self, trace_id: str) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._entries.pop(trace_id, None)  # a re-registered trace moves to the end (deadline order)
+        self._entries[trace_id] = (time.monotonic() + self.ttl_s, fut)
+        return fut
+
+    def resolve(self, trace_id: str, status: str = "done", result: Any = True) -> bool:
+        entry = self._entries.pop(trace_id, None)
+        if entry is None:
+            return False
+        self.counts[status] += 1
+        if not entry[1].done():
+            entry[1].set_result(result)
+        return True
+
+    def expire(self, trace_id: str) -> bool:
+        entry = self._entries.pop(trace_id, None)
+        if entry is None:
+            return False
+        self.counts["expired"] += 1
+        if not entry[1].done():
+            entry[1].set_exception(asyncio.TimeoutError(f"trace {trace_id} not completed in {self.ttl_s}s"))
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> list[str]:
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self._entries:
+            tid, (deadline, _) = next(iter(self._entries.items()))
+            if deadline > now:
+                break
+            self.expire(tid)
+            expired.append(tid)
+        return expired
+
+    def __contains__(self, trace_id: str) -> bool:
+        return trace_id in self._entries
+
+    def stats(self) -> dict[str, int]:
+        return {"in_flight": len(self._entries), **self.counts}
@@ -1,7 +1,15 @@
 from pydantic import BaseModel
 from typing import Any, Dict
 
+# payload field a *_VALIDATE step forwards to *_OK (and to reflection) without showing it to the GuardRail LLM
+CARRY_KEY = "carry"
+
 class Msg(BaseModel):
     trace_id: str
     role: str
     payload: Dict[str, Any]
+
+    @classmethod
+    def fast(cls, trace_id: str, role: str, payload: Dict[str, Any]) -> "Msg":
+        """Validation-free constructor for internal hops: the payload dict is not copied or checked."""
+        return cls.model_construct(trace_id=trace_id, role=role, payload=payload)
@@ -0,0 +1,60 @@
+import dataclasses, itertools, os, threading
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+@dataclass(frozen=True)
+class Ref:
+    """Lightweight, picklable handle to an object kept outside the message."""
+    key: str
+    pid: int = dataclasses.field(default_factory=os.getpid)   # process whose store holds the object
+
+
+class ObjectStore:
+    """
+    Process-local store for heavy payload objects (DataFrames, vector collections,
+    embedding models). Messages carry a ``Ref`` instead of the object itself, so
+    hops through the bus do not copy or validate it.
+
+    A ``Ref`` only resolves in the process that created it. With the
+    ``ShardedEventBus`` that holds because a trace and its sub-traces stay on
+    one shard, and the roles exported between processes carry plain data.
+    """
+
+    def __init__(self):
+        self._objs: dict[str, Any] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def put(self, obj: Any, key: Optional[str] = None) -> Ref:
+        # a fixed key registers a long-lived object once (e.g. the shared embedding model)
+        with self._lock:
+            key = key or f"obj-{os.getpid()}-{next(self._ids)}"
+            self._objs[key] = obj
+        return Ref(key)
+
+    def get(self, ref: Any) -> Any:
+        """Resolve a ``Ref``; any other value is returned unchanged."""
+        if not isinstance(ref, Ref):
+            return ref
+        if ref.pid != os.getpid():
+            raise LookupError(f"object {ref.key} belongs to process {ref.pid}, not {os.getpid()}: "
+                              "refs are process-local and cannot cross bus shards")
+        obj = self._objs.get(ref.key, _MISSING)
+        if obj is _MISSING:
+            raise KeyError(f"object {ref.key} not in this process' store")
+        return obj
+
+    def release(self, ref: Any):
+        if not isinstance(ref, Ref):
+            return
+        with self._lock:
+            self._objs.pop(ref.key, None)
+
+    def __len__(self) -> int:
+        return len(self._objs)
+
+
+_MISSING = object()
+
+store = ObjectStore()
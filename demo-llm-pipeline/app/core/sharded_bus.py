@@ -0,0 +1,125 @@
+import asyncio, collections, importlib, multiprocessing, threading, zlib
+from typing import Callable, Awaitable, Iterable
+from .messages import Msg
+from .bus import EventBus
+from app.utils.tracing import log
+
+_STOP = None
+
+
+def shard_of(trace_id: str, shards: int) -> int:
+    # crc32 instead of hash(): str hashing is salted per process.
+    # Sub-traces ("T-….3") hash like their parent, so a whole batch stays on one shard.
+    return zlib.crc32(trace_id.partition(".")[0].encode()) % shards
+
+
+def _load_wiring(spec: str) -> Callable[[EventBus], object]:
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+def _pump(src, loop: asyncio.AbstractEventLoop, deliver: Callable[[Msg], Awaitable]):
+    """Blocking reader thread: moves messages from a multiprocessing queue into an event loop."""
+    while True:
+        msg = src.get()
+        if msg is _STOP:
+            return
+        asyncio.run_coroutine_threadsafe(deliver(msg), loop)
+
+
+class _ShardBus(EventBus):
+    """Bus running inside a worker process; routes foreign traces and exported roles over IPC."""
+
+    def _bind(self, index: int, inboxes: list, outbox, export_roles: set[str]):
+        self.index, self.inboxes, self.outbox, self.export_roles = index, inboxes, outbox, export_roles
+
+    async def publish(self, msg: Msg):
+        if msg.role in self.export_roles:
+            self.outbox.put(msg)
+        owner = shard_of(msg.trace_id, len(self.inboxes))
+        if owner != self.index:
+            self.inboxes[owner].put(msg)
+            return
+        await super().publish(msg)
+
+
+def _shard_main(index: int, wiring: str, inboxes: list, outbox, export_roles: set[str]):
+    from app.utils.tracing import init_logger
+    init_logger()
+
+    async def run():
+        bus = _ShardBus.from_settings()
+        bus._bind(index, inboxes, outbox, export_roles)
+        _load_wiring(wiring)(bus)
+        loop = asyncio.get_running_loop()
+        pump = threading.Thread(target=_pump, args=(inboxes[index], loop, super(_ShardBus, bus).publish), daemon=True)
+        pump.start()
+        log(f"ShardedEventBus ▶ shard {index} ready")
+        await bus.start()
+
+    asyncio.run(run())
+
+
+class ShardedEventBus:
+    """
+    Multi-process bus backend: traces are partitioned across ``shards`` worker
+    processes by hashing ``Msg.trace_id``, so every message of a trace is handled
+    by the same process and the CPU-heavy stages of different traces run on
+    different cores.
+
+    ``wiring`` is an importable ``"module:function"`` that receives a bus and
+    subscribes the agents; it runs once in every worker. Agents keep using the
+    plain ``publish``/``subscribe`` API. Handlers subscribed on this object run
+    in the parent process and receive the messages whose role is listed in
+    ``export_roles`` (by default ``ACK_DONE`` and ``BATCH_FANOUT``, which is what
+    the sequencer needs to complete a batch trace).
+    Transport is local IPC (``multiprocessing`` queues), so payloads that leave a
+    shard must be picklable. GUI logging only reaches the window from the parent.
+    """
+
+    def __init__(self, wiring: str, shards: int = 2, export_roles: Iterable[str] = ("ACK_DONE", "BATCH_FANOUT")):
+        self.wiring = wiring
+        self.shards = max(1, shards)
+        self.export_roles = set(export_roles)
+        self.subscribers: dict[str, list[Callable[[Msg], Awaitable]]] = collections.defaultdict(list)
+        self._ctx = multiprocessing.get_context("spawn")
+        self.inboxes = [self._ctx.Queue() for _ in range(self.shards)]
+        self.outbox = self._ctx.Queue()
+        self.procs: list[multiprocessing.Process] = []
+
+    def subscribe(self, role: str, coro: Callable[[Msg], Awaitable]):
+        self.subscribers[role].append(coro)
+
+    async def publish(self, msg: Msg):
+        if msg.role in self.subscribers and msg.role in self.export_roles:
+            await self._deliver(msg)
+            return
+        self.inboxes[shard_of(msg.trace_id, self.shards)].put(msg)
+
+    async def _deliver(self, msg: Msg):
+        for coro in self.subscribers.get(msg.role, []):
+            asyncio.create_task(coro(msg))
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {f"shard-{i}": {"alive": int(p.is_alive())} for i, p in enumerate(self.procs)}
+
+    async def start(self):
+        for i in range(self.shards):
+            p = self._ctx.Process(target=_shard_main, name=f"bus-shard-{i}",
+                                  args=(i, self.wiring, self.inboxes, self.outbox, self.export_roles),
+                                  daemon=True)
+            p.start()
+            self.procs.append(p)
+        log(f"ShardedEventBus ▶ started {self.shards} shard processes")
+        threading.Thread(target=_pump, args=(self.outbox, asyncio.get_running_loop(), self._deliver),
+                         daemon=True).start()
+        await asyncio.Event().wait()
+
+    def close(self):
+        for q in self.inboxes:
+            q.put(_STOP)
+        self.outbox.put(_STOP)
+        for p in self.procs:
+            p.join(timeout=2)
+            if p.is_alive():
+                p.terminate()
@@ -4,6 +4,7 @@ from typing import List, Dict
 from pandas import DataFrame
 from app.utils.tracing import log
 from app.utils.tracing import log_gui
+from app.utils.flow_schema import to_records
 
 @dataclass
 class Anomaly:
@@ -11,6 +12,15 @@ class Anomaly:
     severity: str
     description: str
     flows: List[Dict]
+    # filled by the rule engine: which rule fired, for which endpoints/window, how many hits
+    rule: str = ""
+    src_ip: str = ""
+    dst_ip: str = ""
+    window_start: int = 0
+    hits: int = 1
+    # filled by the coalescer: detections merged into this one, repeats suppressed during the cooldown
+    count: int = 1
+    suppressed: int = 0
 
 class AnomalyDetectorMock:
     _cid = itertools.count(1)
@@ -52,5 +62,5 @@ class AnomalyDetectorMock:
             "High entropy in outbound payloads suggests covert channel",
             "Unusual increase in reset packets (RST) during business hours"
             ]),
-            flows=df.sample(1).to_dict("records"),
+            flows=to_records(df.sample(1)),
         )]
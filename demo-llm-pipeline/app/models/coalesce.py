@@ -0,0 +1,82 @@
+import collections, time
+from dataclasses import replace
+from typing import Optional
+from app.models.anomaly_dummy import Anomaly
+from app.utils.config import settings
+
+
+class AnomalyCoalescer:
+    """
+    Stage between detection and ``MANAGER_PLAN``: LLM work follows distinct incidents, not raw hits.
+
+    - anomalies of one batch are grouped by (rule, src, dst, window): one
+      anomaly per group, hits summed, ``count`` detections merged and at most
+      ``max_flows`` representative flows kept;
+    - an incident (rule, src, dst) that was forwarded less than ``cooldown_s``
+      ago is suppressed; the number of suppressed detections is reported on
+      the next forwarded anomaly of that incident (``suppressed``).
+
+    Cooldown entries are kept in expiry order and bounded by ``max_keys``.
+    """
+
+    def __init__(self, cooldown_s: float = settings.COALESCE_COOLDOWN_S,
+                 max_flows: int = settings.RULE_MAX_FLOWS, max_keys: int = settings.COALESCE_MAX_KEYS):
+        self.cooldown_s, self.max_flows, self.max_keys = cooldown_s, max_flows, max_keys
+        # incident → [cooldown deadline, detections suppressed since the last forward]
+        self._cooldown: collections.OrderedDict[tuple, list] = collections.OrderedDict()
+        self.counts: collections.Counter[str] = collections.Counter()
+
+    @staticmethod
+    def incident(a: Anomaly) -> tuple:
+        return (a.rule or a.description, a.src_ip, a.dst_ip)
+
+    def _group(self, anomalies: list[Anomaly]) -> list[Anomaly]:
+        groups: dict[tuple, Anomaly] = {}
+        for a in anomalies:
+            key = self.incident(a) + (a.window_start,)
+            g = groups.get(key)
+            if g is None:
+                groups[key] = replace(a, flows=list(a.flows[:self.max_flows]))
+                continue
+            g.hits += a.hits
+            g.count += a.count
+            if len(g.flows) < self.max_flows:
+                g.flows.extend(a.flows[:self.max_flows - len(g.flows)])
+        return list(groups.values())
+
+    def _sweep(self, now: float):
+        while self._cooldown:
+            key, (deadline, suppressed) = next(iter(self._cooldown.items()))
+            # expired entries stay one more cooldown so their suppressed count can still be reported
+            if deadline + self.cooldown_s > now and len(self._cooldown) <= self.max_keys:
+                break
+            self._cooldown.popitem(last=False)
+            if suppressed:
+                self.counts["suppressed_unreported"] += suppressed
+
+    def coalesce(self, anomalies: list[Anomaly], now: Optional[float] = None) -> list[Anomaly]:
+        now = time.monotonic() if now is None else now
+        self.counts["in"] += len(anomalies)
+        grouped = self._group(anomalies)
+        self.counts["grouped"] += len(anomalies) - len(grouped)
+        if self.cooldown_s <= 0:
+            self.counts["out"] += len(grouped)
+            return grouped
+        self._sweep(now)
+        out = []
+        for a in grouped:
+            key = self.incident(a)
+            entry = self._cooldown.get(key)
+            if entry is not None and entry[0] > now:
+                entry[1] += a.count
+                self.counts["suppressed"] += a.count
+                continue
+            a.suppressed = entry[1] if entry is not None else 0
+            self._cooldown.pop(key, None)
+            self._cooldown[key] = [now + self.cooldown_s, 0]
+            out.append(a)
+        self.counts["out"] += len(out)
+        return out
+
+    def stats(self) -> dict[str, int]:
+        return {**self.counts, "cooldown_keys": len(self._cooldown)}
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+# RFC 1918 private ranges as (network, mask) on uint32 addresses
+_PRIVATE_NETS = [
+    (0x0A000000, 0xFF000000),  # 10.0.0.0/8
+    (0xAC100000, 0xFFF00000),  # 172.16.0.0/12
+    (0xC0A80000, 0xFFFF0000),  # 192.168.0.0/16
+]
+
+# service buckets for the well-known side of the flow
+_SERVICE_PORTS = {
+    "dns": [53],
+    "http": [80, 8080],
+    "https": [443, 8443],
+    "ssh": [22],
+    "smb": [139, 445],
+    "rdp": [3389],
+    "dhcp": [67, 68],
+}
+PORT_BUCKETS = list(_SERVICE_PORTS) + ["other_well_known", "registered", "dynamic"]
+
+# numeric features that the optional RobustScaler is fitted on
+SCALED_FEATURES = [
+    "bytes_per_s", "packets_per_s", "bytes_per_packet",
+    "src_flows_win", "src_bytes_win", "cell_flows_win", "cell_bytes_win",
+]
+
+
+def is_internal(ips: np.ndarray) -> np.ndarray:
+    ips = ips.astype(np.uint32, copy=False)
+    mask = np.zeros(len(ips), dtype=bool)
+    for net, netmask in _PRIVATE_NETS:
+        mask |= (ips & np.uint32(netmask)) == np.uint32(net)
+    return mask
+
+
+def _port_lut() -> np.ndarray:
+    # one bucket code per possible port, so bucketing is a single gather
+    lut = np.full(65536, PORT_BUCKETS.index("dynamic"), dtype=np.int8)
+    lut[:49152] = PORT_BUCKETS.index("registered")
+    lut[:1024] = PORT_BUCKETS.index("other_well_known")
+    for code, ports in enumerate(_SERVICE_PORTS.values()):
+        lut[ports] = code
+    return lut
+
+
+_PORT_LUT = _port_lut()
+
+
+def port_bucket(ports: np.ndarray) -> pd.Categorical:
+    return pd.Categorical.from_codes(_PORT_LUT[ports.astype(np.uint16, copy=False)], categories=PORT_BUCKETS)
+
+
+def rolling_by_key(keys: np.ndarray, ts: np.ndarray, values: np.ndarray, window_s: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Trailing time-window count and sum of ``values`` per key, for every row.
+
+    Rows are sorted once by (key, ts) and packed into a single int64 so that the
+    start of each row's window is one ``searchsorted`` away; sums come from a
+    cumulative sum. O(n log n), no Python-level loop over groups.
+    """
+    n = len(keys)
+    if n == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+    ts = ts.astype(np.int64, copy=False)
+    order = np.lexsort((ts, keys))
+    t0 = ts.min()
+    span = int(ts.max() - t0) + window_s + 1
+    packed = keys[order].astype(np.int64) * span + (ts[order] - t0)
+    start = np.searchsorted(packed, packed - window_s, side="left")
+    pos = np.arange(n)
+    csum = np.concatenate(([0.0], np.cumsum(values[order], dtype=np.float64)))
+    count = np.empty(n, dtype=np.int32)
+    total = np.empty(n, dtype=np.float64)
+    count[order] = pos - start + 1
+    total[order] = csum[pos + 1] - csum[start]
+    return count, total
+
+
+def add_flow_features(df: pd.DataFrame, window_s: int = 60) -> pd.DataFrame:
+    """
+    Columnar feature stage run after ``NetworkLogPreprocessor.preprocess``.
+    Expects the typed frame (uint32 IPs); every feature is a whole-column operation.
+    """
+    duration = np.maximum(df["duration"].to_numpy(dtype=np.float32), np.float32(1e-3))
+    bytes_ = df["bytes"].to_numpy()
+    packets = df["packets"].to_numpy()
+    df["bytes_per_s"] = (bytes_ / duration).astype(np.float32)
+    df["packets_per_s"] = (packets / duration).astype(np.float32)
+    df["bytes_per_packet"] = (bytes_ / np.maximum(packets, 1)).astype(np.float32)
+
+    src = df["src_ip"].to_numpy(dtype=np.uint32)
+    dst = df["dst_ip"].to_numpy(dtype=np.uint32)
+    df["src_net24"] = src >> np.uint32(8)
+    df["dst_net24"] = dst >> np.uint32(8)
+    df["src_internal"] = is_internal(src)
+    df["dst_internal"] = is_internal(dst)
+    df["outbound"] = df["src_internal"].to_numpy() & ~df["dst_internal"].to_numpy()
+
+    # the lower port is taken as the service side of the flow
+    service_port = np.minimum(df["src_port"].to_numpy(), df["dst_port"].to_numpy())
+    df["service_port"] = service_port.astype(np.uint16)
+    df["port_bucket"] = port_bucket(service_port)
+
+    ts = df["timestamp"].to_numpy()
+    cell = df["cell_id"].cat.codes.to_numpy() if isinstance(df["cell_id"].dtype, pd.CategoricalDtype) \
+        else pd.factorize(df["cell_id"])[0]
+    src_count, src_bytes = rolling_by_key(src, ts, bytes_, window_s)
+    cell_count, cell_bytes = rolling_by_key(cell, ts, bytes_, window_s)
+    df["src_flows_win"], df["src_bytes_win"] = src_count, src_bytes
+    df["cell_flows_win"], df["cell_bytes_win"] = cell_count, cell_bytes
+    return df
@@ -0,0 +1,160 @@
+import numpy as np
+
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def mix64(x: np.ndarray, seed: int = 0) -> np.ndarray:
+    """Vectorized splitmix64 finalizer: uint64 in, well-mixed uint64 out."""
+    with np.errstate(over="ignore"):
+        z = x.astype(np.uint64) + np.uint64((_GOLDEN * (seed + 1)) & 0xFFFFFFFFFFFFFFFF)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def combine(*cols: np.ndarray) -> np.ndarray:
+    """Hash several integer columns into one uint64 key per row."""
+    h = np.zeros(len(cols[0]), dtype=np.uint64)
+    for i, c in enumerate(cols):
+        with np.errstate(over="ignore"):
+            h = mix64(h ^ mix64(np.asarray(c).astype(np.uint64), seed=100 + i))
+    return h
+
+
+class CountMinSketch:
+    """``depth`` × ``width`` counters; ``query`` never under-counts."""
+
+    def __init__(self, width: int = 1 << 16, depth: int = 4, dtype=np.int32):
+        self.width, self.depth = width, depth
+        self.table = np.zeros((depth, width), dtype=dtype)
+
+    def _cols(self, keys: np.ndarray) -> np.ndarray:
+        return np.stack([mix64(keys, seed=d) % np.uint64(self.width) for d in range(self.depth)]).astype(np.int64)
+
+    def add(self, keys: np.ndarray, counts: np.ndarray | int = 1):
+        cols = self._cols(keys)
+        for d in range(self.depth):
+            np.add.at(self.table[d], cols[d], counts)
+
+    def query(self, keys: np.ndarray) -> np.ndarray:
+        return self.merged_query([self], keys)
+
+    @staticmethod
+    def merged_query(sketches: list["CountMinSketch"], keys: np.ndarray) -> np.ndarray:
+        """Counts over the sum of ``sketches`` (same shape), hashing ``keys`` once."""
+        head = sketches[0]
+        cols = head._cols(keys)
+        rows = np.arange(head.depth)[:, None]
+        return np.sum([s.table[rows, cols] for s in sketches], axis=0).min(axis=0)
+
+    def clear(self):
+        self.table.fill(0)
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+
+class HyperLogLogBank:
+    """
+    Fixed-size bank of HyperLogLog counters addressed by key hash.
+
+    Keys are hashed into ``slots`` HLLs of ``registers`` uint8 registers each,
+    ``depth`` times with independent hashes; a key's distinct count is the
+    minimum over its ``depth`` HLLs, which limits the over-count caused by two
+    keys sharing a slot (same idea as count-min). Memory is
+    ``depth * slots * registers`` bytes whatever the number of keys.
+    """
+
+    def __init__(self, slots: int = 1 << 14, registers: int = 64, depth: int = 2):
+        assert registers & (registers - 1) == 0, "registers must be a power of two"
+        self.slots, self.registers, self.depth = slots, registers, depth
+        self.p = registers.bit_length() - 1
+        self.regs = np.zeros((depth, slots, registers), dtype=np.uint8)
+        self.alpha = 0.7213 / (1 + 1.079 / registers) if registers >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}.get(registers, 0.709)
+
+    def add(self, keys: np.ndarray, items: np.ndarray):
+        h = mix64(items, seed=7)
+        reg = (h & np.uint64(self.registers - 1)).astype(np.int64)
+        w = h >> np.uint64(self.p)
+        # rank = position of the leftmost 1-bit in the remaining (64 - p) bits
+        bits = np.frexp(w.astype(np.float64))[1]
+        rank = np.where(w == 0, 64 - self.p + 1, 64 - self.p - bits + 1).astype(np.uint8)
+        slots = self._slots(keys)
+        for d in range(self.depth):
+            np.maximum.at(self.regs[d], (slots[d], reg), rank)
+
+    def _slots(self, keys: np.ndarray) -> np.ndarray:
+        return np.stack([(mix64(keys, seed=20 + d) % np.uint64(self.slots)).astype(np.int64) for d in range(self.depth)])
+
+    @staticmethod
+    def estimate(regs: np.ndarray, alpha: float) -> np.ndarray:
+        """Distinct-count estimate for each row of ``regs`` (..., registers)."""
+        m = regs.shape[-1]
+        raw = alpha * m * m / np.sum(np.exp2(-regs.astype(np.float64)), axis=-1)
+        zeros = np.count_nonzero(regs == 0, axis=-1)
+        with np.errstate(divide="ignore"):
+            linear = m * np.log(m / np.maximum(zeros, 1))
+        return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+    def query(self, keys: np.ndarray) -> np.ndarray:
+        return self.merged_query([self], keys)
+
+    @staticmethod
+    def merged_query(banks: list["HyperLogLogBank"], keys: np.ndarray) -> np.ndarray:
+        """Distinct counts over the union of ``banks`` (same shape), merging only the registers of ``keys``."""
+        head = banks[0]
+        slots = head._slots(keys)
+        est = []
+        for d in range(head.depth):
+            regs = np.maximum.reduce([b.regs[d, slots[d]] for b in banks])
+            est.append(head.estimate(regs, head.alpha))
+        return np.min(est, axis=0)
+
+    def clear(self):
+        self.regs.fill(0)
+
+    @property
+    def nbytes(self) -> int:
+        return self.regs.nbytes
+
+
+class SlidingWindow:
+    """
+    Ring of ``panes`` sketches covering ``panes * pane_s`` seconds. Each row is
+    added to the pane of its timestamp; a pane is cleared when its slot is
+    reused for a newer epoch, and rows older than the window are dropped.
+    Queries merge the live panes (max for HLL registers, sum for counters).
+    """
+
+    def __init__(self, factory, panes: int = 5, pane_s: int = 60):
+        self.panes, self.pane_s = panes, pane_s
+        self.sketches = [factory() for _ in range(panes)]
+        self.epochs = np.full(panes, -1, dtype=np.int64)
+        self.newest = -1
+
+    def add(self, ts: np.ndarray, *args):
+        epoch = ts.astype(np.int64) // self.pane_s
+        self.newest = max(self.newest, int(epoch.max())) if len(epoch) else self.newest
+        live = epoch > self.newest - self.panes
+        for e in np.unique(epoch[live]):
+            i = int(e % self.panes)
+            if self.epochs[i] != e:
+                if self.epochs[i] > e:
+                    continue  # pane already reused by a newer epoch
+                self.sketches[i].clear()
+                self.epochs[i] = e
+            sel = epoch == e
+            self.sketches[i].add(*(a[sel] if isinstance(a, np.ndarray) else a for a in args))
+
+    def live(self) -> list:
+        return [s for s, e in zip(self.sketches, self.epochs) if e > self.newest - self.panes and e >= 0]
+
+    def live_ordered(self) -> list:
+        """Sketches of the live panes, oldest first, with ``None`` for panes that saw no data."""
+        by_epoch = {int(e): s for s, e in zip(self.sketches, self.epochs) if e >= 0}
+        return [by_epoch.get(e) for e in range(self.newest - self.panes + 1, self.newest + 1)]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(s.nbytes for s in self.sketches)
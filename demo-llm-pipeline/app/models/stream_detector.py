@@ -0,0 +1,153 @@
+from dataclasses import dataclass, field
+from typing import Optional
+import numpy as np
+import pandas as pd
+from app.models.anomaly_dummy import Anomaly
+from app.models.rule_engine import RULE_IMPLS, RuleEngineDetector, RuleImpl
+from app.models.sketches import CountMinSketch, HyperLogLogBank, SlidingWindow, combine
+from app.utils.config import settings
+from app.utils.flow_schema import to_records, uint32_to_ip
+from app.utils.tracing import log
+
+
+@dataclass
+class SketchRule:
+    """Windowed form of a rule: rows matching the rule's mask update one sketch keyed by ``keys``."""
+    keys: list[str]
+    kind: str                     # "distinct" | "count" | "sum" | "periodic"
+    threshold: str                # key in the rule engine thresholds
+    items: list[str] = field(default_factory=list)  # distinct: counted columns; sum: summed column
+
+
+# Rules whose aggregate spans batches; the others are per-flow or per-batch and stay in the rule engine.
+STREAM_RULES: dict[str, SketchRule] = {
+    "Abnormal port scanning activity": SketchRule(["src_ip"], "distinct", "scan_targets", ["dst_ip", "dst_port"]),
+    "Source IP scanning on multiple destination ports (horizontal scan)":
+        SketchRule(["src_ip", "dst_ip"], "distinct", "horizontal_ports", ["dst_port"]),
+    "Destination port scanning across many targets (vertical scan)":
+        SketchRule(["src_ip", "dst_port"], "distinct", "vertical_targets", ["dst_ip"]),
+    "Lateral movement pattern detected across internal subnets":
+        SketchRule(["src_ip"], "distinct", "lateral_targets", ["dst_ip"]),
+    "SMB enumeration or suspicious file share access spikes":
+        SketchRule(["src_ip"], "distinct", "smb_targets", ["dst_ip"]),
+    "SYN Flood": SketchRule(["dst_ip"], "distinct", "syn_flood_sources", ["src_ip"]),
+    "SSH brute force attempts detected on port 22": SketchRule(["src_ip", "dst_ip"], "count", "ssh_attempts"),
+    "Multiple authentication failures from same source IP": SketchRule(["src_ip", "dst_ip"], "count", "auth_attempts"),
+    "High number of failed TCP handshakes (SYN retransmissions)": SketchRule(["src_ip"], "count", "syn_fail"),
+    "Suspicious DNS burst to 8.8.8.8": SketchRule(["src_ip", "dst_ip"], "count", "dns_burst"),
+    "HTTP flood to specific endpoint suggests L7 DDoS": SketchRule(["dst_ip"], "count", "http_flood"),
+    "Unusual outbound traffic volume to a single external IP":
+        SketchRule(["src_ip", "dst_ip"], "sum", "outbound_bytes", ["bytes"]),
+    "Unusual spike of UDP 53 traffic (DNS amplification hint)": SketchRule(["dst_ip"], "sum", "dns_amp_bytes", ["bytes"]),
+    "Beaconing behavior: periodic small connections to same C2 endpoint":
+        SketchRule(["src_ip", "dst_ip", "service_port"], "periodic", "beacon_min_events"),
+}
+
+
+class StreamingDetector:
+    """
+    Rule engine with state carried across micro-batches.
+
+    Each rule in ``STREAM_RULES`` keeps a sliding window of ``panes`` sketches
+    (``pane_s`` seconds each): HyperLogLog banks for distinct counts, count-min
+    sketches for counts and byte sums, and per-pane counts for beaconing. A
+    batch only updates the sketches and queries the keys it contains, so the
+    cost is O(batch) and memory is fixed by the sketch sizes, not by the number
+    of sources seen. Remaining compiled rules run per batch as in ``RuleEngineDetector``.
+
+    State is per process: with ``BUS_BACKEND=sharded`` each shard sees only its traces.
+    Rows older than the window (late data) are dropped.
+    """
+
+    def __init__(self, thresholds: Optional[dict] = None,
+                 panes: int = settings.STREAM_PANES, pane_s: int = settings.STREAM_PANE_S,
+                 beacon_pane_s: int = settings.STREAM_BEACON_PANE_S,
+                 hll_slots: int = settings.STREAM_HLL_SLOTS, hll_registers: int = settings.STREAM_HLL_REGISTERS,
+                 cm_width: int = settings.STREAM_CM_WIDTH, cm_depth: int = settings.STREAM_CM_DEPTH,
+                 max_flows: int = settings.RULE_MAX_FLOWS):
+        self.engine = RuleEngineDetector(thresholds=thresholds, max_flows=max_flows)
+        self.thresholds, self.max_flows = self.engine.thresholds, max_flows
+        compiled = {r.name for r in self.engine.rules}
+        self.rules: dict[str, tuple[SketchRule, RuleImpl, SlidingWindow]] = {}
+        for name, spec in STREAM_RULES.items():
+            if name not in compiled:
+                continue
+            if spec.kind == "distinct":
+                factory = lambda: HyperLogLogBank(hll_slots, hll_registers)
+            else:
+                dtype = np.int64 if spec.kind == "sum" else np.int32
+                factory = lambda dtype=dtype: CountMinSketch(cm_width, cm_depth, dtype)
+            window = SlidingWindow(factory, panes, beacon_pane_s if spec.kind == "periodic" else pane_s)
+            self.rules[name] = (spec, RULE_IMPLS[name], window)
+        self.engine.rules = [r for r in self.engine.rules if r.name not in self.rules]
+        log(f"StreamDetector ▶ {len(self.rules)} windowed rules, {len(self.engine.rules)} per-batch rules, "
+            f"{self.nbytes / 2**20:.1f} MB of sketches")
+
+    @property
+    def nbytes(self) -> int:
+        return sum(w.nbytes for _, _, w in self.rules.values())
+
+    def _query(self, spec: SketchRule, window: SlidingWindow, keys: np.ndarray) -> np.ndarray:
+        if spec.kind == "distinct":
+            return HyperLogLogBank.merged_query(window.live(), keys)
+        if spec.kind != "periodic":
+            return CountMinSketch.merged_query(window.live(), keys)
+        # the newest pane is still filling up: judge regularity on the closed ones
+        cols = window.sketches[0]._cols(keys)
+        rows = np.arange(cols.shape[0])[:, None]
+        per = np.stack([s.table[rows, cols].min(axis=0) if s is not None else np.zeros(len(keys))
+                        for s in window.live_ordered()[:-1]]).astype(np.float64)
+        total = per.sum(axis=0)
+        cv = per.std(axis=0) / np.maximum(per.mean(axis=0), 1e-9)
+        ok = (per.min(axis=0) > 0) & (cv <= self.thresholds["beacon_pane_cv"])
+        return np.where(ok, total, 0)
+
+    def _anomalies(self, name: str, impl: RuleImpl, spec: SketchRule, window: SlidingWindow, df: pd.DataFrame,
+                   idx: np.ndarray, keys: np.ndarray, bad: np.ndarray, metric: np.ndarray) -> list[Anomaly]:
+        out = []
+        sel = np.isin(keys, bad)
+        rows, row_keys = idx[sel], keys[sel]
+        window_start = (window.newest - window.panes + 1) * window.pane_s
+        for key, hits in zip(bad, metric):
+            sample = df.iloc[rows[row_keys == key][:self.max_flows]]
+            first = sample.iloc[0]
+            out.append(Anomaly(
+                id=f"A-{next(RuleEngineDetector._cid):04d}",
+                severity=impl.severity,
+                description=name,
+                flows=to_records(sample, impl.features),
+                rule=name,
+                src_ip=uint32_to_ip(first["src_ip"]) if "src_ip" in spec.keys else "",
+                dst_ip=uint32_to_ip(first["dst_ip"]) if "dst_ip" in spec.keys else "",
+                window_start=int(window_start),
+                hits=int(hits),
+            ))
+        return out
+
+    def detect(self, df: pd.DataFrame) -> list[Anomaly]:
+        if df.empty:
+            return []
+        df = self.engine._prepare(df)
+        ts = df["timestamp"].to_numpy()
+        anomalies = []
+        for name, (spec, impl, window) in self.rules.items():
+            idx = np.flatnonzero(impl.mask(df, self.thresholds))
+            if spec.kind == "periodic":
+                idx = idx[df["bytes"].to_numpy()[idx] <= self.thresholds["beacon_max_bytes"]]
+            if len(idx) == 0:
+                continue
+            keys = combine(*(df[k].to_numpy()[idx] for k in spec.keys))
+            if spec.kind == "distinct":
+                window.add(ts[idx], keys, combine(*(df[c].to_numpy()[idx] for c in spec.items)))
+            elif spec.kind == "sum":
+                window.add(ts[idx], keys, df[spec.items[0]].to_numpy()[idx].astype(np.int64))
+            else:
+                window.add(ts[idx], keys, 1)
+            # only keys present in this batch can have changed
+            uniq = np.unique(keys)
+            metric = self._query(spec, window, uniq)
+            hit = metric >= self.thresholds[spec.threshold]
+            if hit.any():
+                anomalies.extend(self._anomalies(name, impl, spec, window, df, idx, keys, uniq[hit], metric[hit]))
+        anomalies.extend(self.engine._detect(df))
+        return anomalies
@@ -1,14 +1,138 @@
 import datetime
+import os
 from typing import ClassVar
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     OLLAMA_BASE_URL: str = "http://localhost:11434"
     OLLAMA_MODEL: str = "llama3.2"
+    # Named LLM profiles per agent (JSON), each overriding model/base_url/temperature/... of the default,
+    # e.g. {"notify": {"temperature": 0.2}}; unknown names use the default
+    LLM_PROFILES: dict[str, dict] = {}
+    LLM_HEALTH_TTL_S: float = 60.0     # re-probe a healthy backend after this long
+    LLM_RETRY_S: float = 10.0          # re-probe a down backend after this long
+    LLM_PROBE_TIMEOUT_S: float = 2.0
+    # LLM calls run off the event loop: at most this many in flight overall, and per backend URL
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_BACKEND_CONCURRENCY: int = 4
+    LLM_BACKEND_LIMITS: dict[str, int] = {}   # per-URL override of LLM_BACKEND_CONCURRENCY
+    # LLM response cache (memory LRU + SQLite), for the listed profiles at temperature 0; [] disables it
+    LLM_CACHE_PROFILES: list[str] = ["guardrail", "kretriever", "hretriever", "notify"]
+    LLM_CACHE_PATH: str = "demo-llm-pipeline/app/db/llm_cache.sqlite3"
+    LLM_CACHE_MEM_ITEMS: int = 2048
+    LLM_CACHE_MAX_ROWS: int = 100000
+    LLM_CACHE_TTL_S: float = 7 * 24 * 3600.0
+    # Cross-trace micro-batching: concurrent requests for the same model go out as one batch() call.
+    # 1 disables it (LangChain's Ollama client generates batch members one after another)
+    LLM_BATCH_MAX_SIZE: int = 1
+    LLM_BATCH_MAX_WAIT_S: float = 0.005
     AGENT_LOG_DIR: str = "demo-llm-pipeline/app/db/agents_logs"
     now: ClassVar[str] = str(datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
     AGENT_LOG_FILE: ClassVar[str] = str(AGENT_LOG_DIR) + f"/agent_log_data_{now}.txt"
     AGENT_CARDS_DIR: ClassVar[str] = "demo-llm-pipeline/app/db/agents_cards"
-    POOL_DB_PATH: ClassVar[str] = "demo-llm-pipeline/app/db/pool_db.csv"
+    POOL_DB_PATH: ClassVar[str] = "demo-llm-pipeline/app/db/pool_db.csv"   # legacy, migrated into the incident store
+
+    # Incident store (SQLite, WAL + FTS5): writes are group-committed by one writer thread
+    INCIDENT_DB_PATH: str = "demo-llm-pipeline/app/db/incidents.sqlite3"
+    INCIDENT_COMMIT_MAX: int = 64       # rows per transaction at most
+    INCIDENT_COMMIT_WAIT_S: float = 0.02  # how long the writer waits for more rows before committing
+
+    # Traces not acknowledged within this many seconds are expired by the Manager
+    TRACE_TTL_S: float = 300.0
+
+    # Ingest: "once" (read raw_logs_demo.txt a single time), "file" (parse INGEST_PATH once, in chunks),
+    # "tail" (follow INGEST_PATH), "socket" (TCP on INGEST_HOST:INGEST_PORT) or "stdin"
+    INGEST_MODE: str = "once"
+    INGEST_PATH: str = "demo-llm-pipeline/raw_logs_demo.txt"
+    INGEST_FROM_START: bool = True
+    INGEST_HOST: str = "127.0.0.1"
+    INGEST_PORT: int = 5140
+    STREAM_MAX_ROWS: int = 5000        # micro-batch size bound
+    STREAM_MAX_WAIT_S: float = 1.0     # micro-batch time window
+    STREAM_MAX_IN_FLIGHT: int = 8      # open traces before reading pauses (bounded lag)
+
+    # History vector index (persistent chromadb), built once from the incident store
+    HISTORY_INDEX_DIR: str = "demo-llm-pipeline/app/db/history_index"
+    EMBED_MODEL_NAME: str = "all-MiniLM-L6-v2"
+    EMBED_BATCH_SIZE: int = 256        # reports per encode() call / bulk upsert
+    EMBED_WORKERS: str = "thread"      # "none", "thread" (overlap encode/write) or "process"
+
+    # Embedding cache: in-memory LRU + memory-mapped float32 matrix per model
+    EMBED_CACHE_DIR: str = "demo-llm-pipeline/app/db/embedding_cache"
+    EMBED_CACHE_MEM_ITEMS: int = 10_000
+
+    # rag_system incremental ingestion: chunks per embedding request, requests in flight
+    RAG_EMBED_BATCH_SIZE: int = 32
+    RAG_EMBED_WORKERS: int = 4
+    # Semantic answer cache of AnomalyInterpreterAgentChroma: cosine threshold for a hit, entry TTL, LRU capacity
+    RAG_CACHE_THRESHOLD: float = 0.92
+    RAG_CACHE_TTL_S: float = 3600.0
+    RAG_CACHE_MAX_ITEMS: int = 1000
+
+    # Proc parser: rows per parsed chunk and CSV engine ("c" or "pyarrow" when installed)
+    PROC_CHUNK_ROWS: int = 250_000
+    PROC_CSV_ENGINE: str = "c"
+
+    # Flow features: rolling window for per-src/per-cell aggregates, optional persisted RobustScaler
+    FEATURE_WINDOW_S: int = 60
+    FEATURE_SCALE: bool = False
+    FEATURE_SCALER_PATH: str = "demo-llm-pipeline/app/db/models/robust_scaler.joblib"
+
+    # Detector: "mock" (random demo anomalies), "rules" (rule engine compiled from domain_knowledge)
+    # or "stream" (rule engine + sliding-window sketches carried across batches)
+    DETECTOR: str = "mock"
+    RULE_WINDOW_S: int = 60
+    RULE_MAX_FLOWS: int = 5             # offending flows attached to each anomaly
+    RULE_THRESHOLDS: dict[str, float] = {}  # overrides of rule_engine.DEFAULT_THRESHOLDS
+
+    # Anomaly coalescing before fan-out: same (rule, src, dst) is forwarded at most once per cooldown (0 = off)
+    COALESCE_COOLDOWN_S: float = 300.0
+    COALESCE_MAX_KEYS: int = 100_000
+
+    # KRetriever: rules put in the prompt, ranked by "bm25" or "hybrid" (BM25 + embedder cosine)
+    KB_TOP_K: int = 5
+    KB_RETRIEVAL: str = "bm25"
+
+    # HRetriever: "vector" (top-k similar past reports from the history index) or "full" (every stored report)
+    HISTORY_RETRIEVAL: str = "vector"
+    HISTORY_TOP_K: int = 5
+    HISTORY_FILTERS: list[str] = ["rule"]   # metadata that must match the anomaly: "rule", "severity"
+    HISTORY_MAX_AGE_S: float = 0            # only reports younger than this (0 = any age)
+    HISTORY_TOKEN_BUDGET: int = 1500        # hard cap on the history context in the prompt
+
+    # Anomalies of the same rule enriched by one KRetriever/HRetriever prompt (1 = one prompt per anomaly)
+    ENRICH_BATCH_SIZE: int = 1
+
+    # Notify streaming: tokens go to the GUI pane and to NOTIFY_STREAM_ROLE subscribers as generated,
+    # with cheap guardrail checks every NOTIFY_STREAM_CHECK_CHARS new characters
+    NOTIFY_STREAM: bool = False
+    NOTIFY_STREAM_ROLE: str = "REPORT_STREAM"
+    NOTIFY_STREAM_CHECK_CHARS: int = 200
+    NOTIFY_MAX_REPORT_TOKENS: int = 1200
+
+    # Prompt budget (tokens) per agent; context beyond it is deduplicated, summarized, then truncated,
+    # least important first. PROMPT_BUDGETS overrides it per agent, e.g. {"notify": 4000}
+    PROMPT_TOKEN_BUDGET: int = 3000
+    PROMPT_BUDGETS: dict[str, int] = {}
+    PROMPT_STATS_EVERY: int = 50            # log each agent's prompt-size histogram every N prompts
+
+    # Streaming detector sketches: window = STREAM_PANES × STREAM_PANE_S seconds; fixed memory per rule of
+    # STREAM_PANES × (2·SLOTS·REGISTERS bytes for HyperLogLog, or CM_DEPTH·CM_WIDTH counters for count-min)
+    STREAM_PANES: int = 6
+    STREAM_PANE_S: int = 10
+    STREAM_BEACON_PANE_S: int = 60      # beaconing needs a longer window: one count per pane
+    STREAM_HLL_SLOTS: int = 4096
+    STREAM_HLL_REGISTERS: int = 64      # ~13% standard error per distinct count
+    STREAM_CM_WIDTH: int = 1 << 15
+    STREAM_CM_DEPTH: int = 4
+
+    # Event bus backend: "local" (single event loop) or "sharded" (one process per shard, by trace_id)
+    BUS_BACKEND: str = "local"
+    BUS_SHARDS: int = os.cpu_count() or 2
+    # Event bus: "unbounded" (one task per message) or "bounded" (per-role worker pools)
+    BUS_MODE: str = "unbounded"
+    BUS_DEFAULT_CONCURRENCY: int = 4
+    BUS_DEFAULT_QUEUE_SIZE: int = 100
+    BUS_ROLE_LIMITS: dict[str, dict] = {}  # e.g. {"Proc": {"concurrency": 1, "maxsize": 8}}
 
 settings = Settings()
@@ -0,0 +1,253 @@
+import collections
+import contextlib
+import hashlib
+import os
+import pathlib
+import re
+import threading
+from typing import Callable, Optional, Sequence
+import numpy as np
+from langchain_core.embeddings import Embeddings
+try:
+    from app.utils.config import settings
+except ImportError:
+    from config import settings  # standalone use next to rag_system.py
+
+_KEY = re.compile(r"^[0-9a-f]{40}$")
+
+
+@contextlib.contextmanager
+def _file_lock(path: pathlib.Path):
+    """Exclusive advisory lock on ``path``, held across processes (bus shards share the cache directory)."""
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache for one embedding model.
+
+    Keys are ``sha1(text)``; the model name selects the namespace, so the full
+    key is (model name, text hash). Two tiers:
+
+    - an in-memory LRU of ``mem_items`` vectors;
+    - an append-only persistent tier: ``<model>.f32`` is a float32 matrix read
+      through ``np.memmap`` and ``<model>.idx`` lists the hash of each row.
+
+    Rows are appended, never rewritten. Appends from several processes (e.g.
+    bus shards) are serialized by ``<model>.lock``; each writer first picks up
+    rows the others appended, so row numbers stay aligned with the matrix.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = settings.EMBED_CACHE_DIR,
+                 mem_items: int = settings.EMBED_CACHE_MEM_ITEMS):
+        self.model_name = model_name
+        self.mem_items = mem_items
+        base = pathlib.Path(cache_dir)
+        base.mkdir(parents=True, exist_ok=True)
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        self.idx_path, self.mat_path = base / f"{safe}.idx", base / f"{safe}.f32"
+        self.lock_path = base / f"{safe}.lock"
+        self._idx_pos = 0   # bytes of the index file already read
+        self._mem: collections.OrderedDict[str, np.ndarray] = collections.OrderedDict()
+        self._rows: dict[str, int] = {}
+        self._n_rows = 0
+        self._mat: Optional[np.memmap] = None
+        self.dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits_mem = self.hits_disk = self.misses = 0
+        self._load()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        with _file_lock(self.lock_path):
+            if not self.idx_path.exists():
+                return
+            with open(self.idx_path, "r", newline="") as f:
+                header = f.readline()
+                self.dim = int(header.strip().split("=", 1)[1])
+                keys = []
+                for line in f:
+                    # a torn last line (crash mid-append) ends the valid part
+                    if not line.endswith("\n") or not _KEY.match(line.strip()):
+                        break
+                    keys.append(line.strip())
+            # a crash between the matrix and the index append leaves extra rows (or index
+            # lines): cut both files back to the rows they agree on before appending again
+            n = min(len(keys), self.mat_path.stat().st_size // (4 * self.dim) if self.mat_path.exists() else 0)
+            if self.mat_path.exists() and self.mat_path.stat().st_size != n * 4 * self.dim:
+                os.truncate(self.mat_path, n * 4 * self.dim)
+            body = header + "".join(f"{k}\n" for k in keys[:n])
+            if n != len(keys) or self.idx_path.stat().st_size != len(body.encode()):
+                tmp = self.idx_path.with_suffix(".idx.tmp")
+                with open(tmp, "w", newline="\n") as f:
+                    f.write(body)
+                os.replace(tmp, self.idx_path)
+            self._rows = {}
+            for i, k in enumerate(keys[:n]):
+                self._rows.setdefault(k, i)
+            self._n_rows, self._idx_pos = n, len(body.encode())
+
+    def _sync(self):
+        """Pick up rows appended by other processes (caller holds the file lock)."""
+        if not self.idx_path.exists() or self.idx_path.stat().st_size <= self._idx_pos:
+            return
+        with open(self.idx_path, "rb") as f:
+            if self.dim is None:
+                self.dim = int(f.readline().decode().strip().split("=", 1)[1])
+                self._idx_pos = f.tell()
+            f.seek(self._idx_pos)
+            tail = f.read()
+        for k in tail.decode().splitlines():
+            self._rows.setdefault(k.strip(), self._n_rows)
+            self._n_rows += 1
+        self._idx_pos += len(tail)
+        self._mat = None
+
+    def _matrix(self) -> Optional[np.memmap]:
+        if self._mat is None and self._rows:
+            self._mat = np.memmap(self.mat_path, dtype=np.float32, mode="r", shape=(self._n_rows, self.dim))
+        return self._mat
+
+    def _remember(self, key: str, vec: np.ndarray):
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._mem.get(key)
+            if vec is not None:
+                self._mem.move_to_end(key)
+                self.hits_mem += 1
+                return vec
+            row = self._rows.get(key)
+            if row is None and self.idx_path.exists() and self.idx_path.stat().st_size > self._idx_pos:
+                with _file_lock(self.lock_path):
+                    self._sync()
+                row = self._rows.get(key)
+            if row is not None:
+                vec = np.array(self._matrix()[row])
+                self._remember(key, vec)
+                self.hits_disk += 1
+                return vec
+            self.misses += 1
+            return None
+
+    def put_many(self, keys: Sequence[str], vecs: np.ndarray):
+        vecs = np.asarray(vecs, dtype=np.float32).reshape(len(keys), -1)
+        with self._lock:
+            with _file_lock(self.lock_path):
+                self._sync()
+                if self.dim is None:
+                    self.dim = vecs.shape[1]
+                    with open(self.idx_path, "w", newline="\n") as f:
+                        f.write(f"# dim={self.dim}\n")
+                    self._idx_pos = self.idx_path.stat().st_size
+                # one row per distinct key not already on disk (also within this call)
+                first: dict[str, int] = {}
+                for i, k in enumerate(keys):
+                    if k not in self._rows:
+                        first.setdefault(k, i)
+                new = list(first.values())
+                if new:
+                    with open(self.mat_path, "ab") as f:
+                        f.write(vecs[new].tobytes())
+                    lines = "".join(f"{keys[i]}\n" for i in new)
+                    with open(self.idx_path, "a", newline="\n") as f:
+                        f.write(lines)
+                    for i in new:
+                        self._rows[keys[i]] = self._n_rows
+                        self._n_rows += 1
+                    self._idx_pos += len(lines.encode())
+                    self._mat = None  # remapped with the new shape on next read
+            for k, v in zip(keys, vecs):
+                self._remember(k, v)
+
+    def encode(self, texts: Sequence[str], encode_fn: Callable[[list[str]], np.ndarray]) -> np.ndarray:
+        """Return embeddings for ``texts``; only distinct texts missing from both tiers reach ``encode_fn``."""
+        keys = [self.key(t) for t in texts]
+        found = {k: v for k in dict.fromkeys(keys) if (v := self.get(k)) is not None}
+        missing = {k: t for k, t in zip(keys, texts) if k not in found}
+        if missing:
+            vecs = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            self.put_many(list(missing), vecs)
+            found.update(zip(missing, vecs))
+        return np.stack([found[k] for k in keys]) if keys else np.zeros((0, self.dim or 0), dtype=np.float32)
+
+    def stats(self) -> dict:
+        lookups = self.hits_mem + self.hits_disk + self.misses
+        return {
+            "model": self.model_name,
+            "hits_mem": self.hits_mem,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_rate": (self.hits_mem + self.hits_disk) / lookups if lookups else 0.0,
+            "disk_rows": self._n_rows,
+        }
+
+
+class CachedEncoder:
+    """Drop-in wrapper for a ``SentenceTransformer``: ``encode`` and ``encode_multi_process`` go through the cache."""
+
+    def __init__(self, model, cache: EmbeddingCache):
+        self.inner, self.cache = model, cache
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        kwargs.pop("convert_to_numpy", None)
+        vecs = self.cache.encode(texts, lambda miss: self.inner.encode(miss, convert_to_numpy=True, **kwargs))
+        return vecs[0] if single else vecs
+
+    def encode_multi_process(self, sentences, pool, **kwargs):
+        # only the misses are sent to the worker pool
+        return self.cache.encode(list(sentences), lambda miss: self.inner.encode_multi_process(miss, pool, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain ``Embeddings`` wrapper (e.g. around ``OllamaEmbeddings``) backed by the cache."""
+
+    def __init__(self, inner: Embeddings, model_name: str):
+        self.inner = inner
+        # some models embed queries differently from documents: keep separate namespaces
+        self.cache = get_embedding_cache(model_name)
+        self.query_cache = get_embedding_cache(f"{model_name}.query")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.cache.encode(texts, self.inner.embed_documents).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.query_cache.encode([text], lambda miss: [self.inner.embed_query(miss[0])])[0].tolist()
+
+
+_CACHES: dict[str, EmbeddingCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_embedding_cache(model_name: str) -> EmbeddingCache:
+    with _CACHES_LOCK:
+        if model_name not in _CACHES:
+            _CACHES[model_name] = EmbeddingCache(model_name)
+        return _CACHES[model_name]
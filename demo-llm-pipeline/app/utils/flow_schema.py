@@ -0,0 +1,73 @@
+import ipaddress
+from typing import Sequence
+import numpy as np
+import pandas as pd
+
+# Column layout of the raw flow log (no header line).
+FLOW_COLUMNS = [
+    'timestamp', 'src_ip', 'dst_ip', 'src_port', 'dst_port', 'protocol',
+    'bytes', 'packets', 'duration', 'cell_id', 'user_hash'
+]
+
+# Parse-time dtypes: IPs are read as categoricals and converted to uint32 per
+# distinct value (see ``encode_ips``); counters are narrowed to 32 bits except
+# bytes, which can exceed 4 GiB on long flows.
+FLOW_DTYPES = {
+    'timestamp': 'int64',
+    'src_ip': 'category',
+    'dst_ip': 'category',
+    'src_port': 'uint16',
+    'dst_port': 'uint16',
+    'protocol': 'uint8',
+    'bytes': 'int64',
+    'packets': 'int32',
+    'duration': 'float32',
+    'cell_id': 'category',
+    'user_hash': 'category',
+}
+
+
+def ip_to_uint32(values) -> np.ndarray:
+    """Dotted IPv4 strings → uint32; anything that is not IPv4 maps to 0."""
+    out = np.zeros(len(values), dtype=np.uint32)
+    for i, v in enumerate(values):
+        try:
+            out[i] = int(ipaddress.IPv4Address(str(v)))
+        except ValueError:
+            pass
+    return out
+
+
+def encode_ips(col: pd.Series) -> pd.Series:
+    # convert each distinct address once, then broadcast through the category codes
+    cat = col if isinstance(col.dtype, pd.CategoricalDtype) else col.astype("category")
+    lookup = ip_to_uint32(cat.cat.categories)
+    codes = cat.cat.codes.to_numpy()
+    out = np.where(codes >= 0, lookup[codes.clip(0)] if len(lookup) else 0, 0).astype(np.uint32)
+    return pd.Series(out, index=col.index, name=col.name)
+
+
+def uint32_to_ip(value) -> str:
+    return str(ipaddress.IPv4Address(int(value)))
+
+
+def to_records(df: pd.DataFrame, extra: Sequence[str] = ()) -> list[dict]:
+    """
+    Flow rows as JSON-safe dicts for messages and LLM prompts: the raw flow
+    columns plus the ``extra`` derived ones, with dotted IPs and plain Python
+    scalars. Every other engineered column is left out.
+    """
+    cols = {}
+    for col in dict.fromkeys([*FLOW_COLUMNS, *extra]):
+        if col not in df.columns:
+            continue
+        s = df[col]
+        if col in ("src_ip", "dst_ip") and pd.api.types.is_integer_dtype(s.dtype):
+            cols[col] = [uint32_to_ip(v) for v in s.to_numpy()]
+        elif isinstance(s.dtype, pd.CategoricalDtype) or not pd.api.types.is_numeric_dtype(s.dtype):
+            cols[col] = s.astype(str).tolist()
+        elif pd.api.types.is_float_dtype(s.dtype):
+            cols[col] = np.round(s.to_numpy(dtype=np.float64), 3).tolist()  # hide float32 noise (45.2000007…)
+        else:
+            cols[col] = s.to_numpy().tolist()
+    return [dict(zip(cols, row)) for row in zip(*cols.values())]
@@ -0,0 +1,183 @@
+import concurrent.futures
+import itertools
+import pathlib
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+from tqdm import tqdm
+import chromadb
+from sentence_transformers import SentenceTransformer
+from app.utils.config import settings
+from app.utils.embedding_cache import CachedEncoder, get_embedding_cache
+from app.utils.incident_store import get_incident_store
+from app.utils.tracing import log
+
+COLLECTION_NAME = "incident_reports"
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    it = iter(items)
+    while batch := list(itertools.islice(it, size)):
+        yield batch
+
+
+def bulk_index(collection, model, docs: Iterable[tuple[str, str, dict]], batch_size: int = 256,
+               workers: str = "none", total: Optional[int] = None) -> int:
+    """
+    Index ``(id, text, metadata)`` triples in batches: one vectorized ``encode``
+    and one bulk ``upsert`` per batch.
+
+    ``workers="thread"`` encodes the next batch while the previous one is being
+    written; ``workers="process"`` spreads encoding over a SentenceTransformer
+    multi-process pool (one worker per CPU). Returns the number of indexed docs.
+    """
+    max_batch = getattr(getattr(collection, "_client", None), "get_max_batch_size", lambda: batch_size)()
+    batch_size = max(1, min(batch_size, max_batch))
+    pool = model.start_multi_process_pool() if workers == "process" else None
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if workers == "thread" else None
+
+    def encode(texts: list[str]):
+        if pool is not None:
+            return model.encode_multi_process(texts, pool, batch_size=64)
+        return model.encode(texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False)
+
+    def write(batch, embeddings):
+        ids, texts, metas = zip(*batch)
+        collection.upsert(ids=list(ids), documents=list(texts), embeddings=embeddings.tolist(), metadatas=list(metas))
+
+    done = 0
+    started = time.monotonic()
+    progress = tqdm(total=total, unit="doc", desc="indexing", disable=total == 0)
+    pending = None
+    try:
+        for batch in _batched(docs, batch_size):
+            if executor is not None:
+                # overlap: encode this batch in the background while the previous one is written
+                fut = executor.submit(encode, [t for _, t, _ in batch])
+                if pending is not None:
+                    write(*pending)
+                pending = (batch, fut.result())
+            else:
+                write(batch, encode([t for _, t, _ in batch]))
+            done += len(batch)
+            progress.update(len(batch))
+            progress.set_postfix(docs_per_s=f"{done / max(time.monotonic() - started, 1e-9):.0f}")
+        if pending is not None:
+            write(*pending)
+    finally:
+        progress.close()
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+        if executor is not None:
+            executor.shutdown()
+    elapsed = time.monotonic() - started
+    log(f"HistoryIndex ▶ indexed {done} docs in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.0f} docs/s)")
+    if isinstance(model, CachedEncoder):
+        log(f"HistoryIndex ▶ embedding cache {model.cache.stats()}")
+    return done
+
+
+class HistoryIndex:
+    """
+    On-disk vector index of past incident reports.
+
+    Built from the incident store the first time, then reopened as-is at startup and
+    updated one report at a time when Notify commits (``add_report``), so the
+    per-trace cost no longer depends on the size of the history.
+    """
+
+    def __init__(self, path: str = settings.HISTORY_INDEX_DIR, model_name: str = settings.EMBED_MODEL_NAME):
+        pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+        self.client = chromadb.PersistentClient(path=path)
+        self.collection = self.client.get_or_create_collection(COLLECTION_NAME)
+        self.model = CachedEncoder(SentenceTransformer(model_name), get_embedding_cache(model_name))
+        self._lock = threading.Lock()
+        if self.collection.count() == 0:
+            self.bootstrap()
+        log(f"HistoryIndex ▶ opened {path} with {self.collection.count()} reports")
+
+    def bootstrap(self, batch_size: int = settings.EMBED_BATCH_SIZE, workers: str = settings.EMBED_WORKERS):
+        incidents = get_incident_store()
+        docs = (
+            (f'{r["trace_id"]}:{r["anomaly_id"]}', r["description"] or r["report"],
+             report_metadata({**r, "id": r["anomaly_id"]}, r["report"], trace_id=r["trace_id"], ts=r["ts"]))
+            for r in incidents.iter_all()
+        )
+        with self._lock:
+            bulk_index(self.collection, self.model, docs, batch_size=batch_size, workers=workers,
+                       total=incidents.count())
+
+    def reindex(self, **kwargs):
+        """Drop and rebuild the collection from the incident store (e.g. after changing embedding model)."""
+        with self._lock:
+            self.client.delete_collection(COLLECTION_NAME)
+            self.collection = self.client.get_or_create_collection(COLLECTION_NAME)
+        self.bootstrap(**kwargs)
+
+    def add_report(self, trace_id: str, anomaly: dict, report: str):
+        anomaly = anomaly if isinstance(anomaly, dict) else {"description": str(anomaly)}
+        meta = report_metadata(anomaly, report, trace_id=trace_id)
+        self._add(f"{trace_id}:{anomaly.get('id', '')}", meta["description"], meta)
+
+    def _add(self, doc_id: str, description: str, metadata: dict):
+        embedding = self.model.encode(description).tolist()
+        with self._lock:
+            self.collection.upsert(
+                documents=[description],
+                embeddings=[embedding],
+                ids=[doc_id],
+                metadatas=[metadata]
+            )
+
+
+def report_metadata(anomaly: dict, report: str, trace_id: str = "", ts: Optional[float] = None) -> dict:
+    """Metadata stored with each report; ``rule``/``severity``/``ts`` are what retrieval filters on."""
+    description = anomaly.get("description", "")
+    return {
+        "full_report": report,
+        "description": description,
+        "rule": anomaly.get("rule") or description,
+        "severity": anomaly.get("severity", ""),
+        "ts": time.time() if ts is None else ts,
+        "trace_id": trace_id,
+    }
+
+
+def search_reports(collection, model, query: str, k: int = 5, where: Optional[dict] = None) -> list[dict]:
+    """
+    Top-k past reports by embedding similarity (Chroma's HNSW index, so the
+    cost does not grow linearly with the history). Falls back to an unfiltered
+    search when the ``where`` filter matches nothing.
+    """
+    embedding = model.encode(query).tolist()
+    for flt in ([where, None] if where else [None]):
+        res = collection.query(query_embeddings=[embedding], n_results=k, where=flt,
+                               include=["metadatas", "distances"])
+        metas = res.get("metadatas", [[]])[0]
+        if metas:
+            return [{**m, "distance": d} for m, d in zip(metas, res.get("distances", [[]])[0])]
+    return []
+
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_history_index() -> HistoryIndex:
+    """Process-wide index, opened on first use."""
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = HistoryIndex()
+        return _INDEX
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.utils.tracing import init_logger
+    parser = argparse.ArgumentParser(description="Rebuild the incident history vector index from the incident store")
+    parser.add_argument("--batch-size", type=int, default=settings.EMBED_BATCH_SIZE)
+    parser.add_argument("--workers", choices=["none", "thread", "process"], default=settings.EMBED_WORKERS)
+    args = parser.parse_args()
+    init_logger()
+    get_history_index().reindex(batch_size=args.batch_size, workers=args.workers)
@@ -0,0 +1,254 @@
+import asyncio, concurrent.futures, csv, pathlib, queue, sqlite3, threading, time
+from typing import Iterator, Optional
+from app.utils.config import settings
+from app.utils.tracing import log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents (
+    id          INTEGER PRIMARY KEY,
+    trace_id    TEXT NOT NULL,
+    anomaly_id  TEXT NOT NULL DEFAULT '',
+    rule        TEXT NOT NULL DEFAULT '',
+    severity    TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    src_ip      TEXT NOT NULL DEFAULT '',
+    dst_ip      TEXT NOT NULL DEFAULT '',
+    report      TEXT NOT NULL,
+    ts          REAL NOT NULL,
+    UNIQUE (trace_id, anomaly_id)
+);
+CREATE INDEX IF NOT EXISTS ix_incidents_ts ON incidents (ts);
+CREATE INDEX IF NOT EXISTS ix_incidents_rule_ts ON incidents (rule, ts);
+CREATE INDEX IF NOT EXISTS ix_incidents_severity_ts ON incidents (severity, ts);
+CREATE INDEX IF NOT EXISTS ix_incidents_anomaly ON incidents (anomaly_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS incidents_fts USING fts5 (
+    description, report, content='incidents', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS incidents_ai AFTER INSERT ON incidents BEGIN
+    INSERT INTO incidents_fts (rowid, description, report) VALUES (new.id, new.description, new.report);
+END;
+CREATE TRIGGER IF NOT EXISTS incidents_ad AFTER DELETE ON incidents BEGIN
+    INSERT INTO incidents_fts (incidents_fts, rowid, description, report) VALUES ('delete', old.id, old.description, old.report);
+END;
+CREATE TRIGGER IF NOT EXISTS incidents_au AFTER UPDATE ON incidents BEGIN
+    INSERT INTO incidents_fts (incidents_fts, rowid, description, report) VALUES ('delete', old.id, old.description, old.report);
+    INSERT INTO incidents_fts (rowid, description, report) VALUES (new.id, new.description, new.report);
+END;
+"""
+
+_COLUMNS = ("trace_id", "anomaly_id", "rule", "severity", "description", "src_ip", "dst_ip", "report", "ts")
+_UPSERT = (
+    f"INSERT INTO incidents ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+    "ON CONFLICT (trace_id, anomaly_id) DO UPDATE SET "
+    + ", ".join(f"{c} = excluded.{c}" for c in _COLUMNS[2:])
+)
+
+
+def iter_pool_reports(path: str) -> Iterator[dict]:
+    """
+    Parse a legacy pool_db.csv. Two layouts are found in the wild: seeded
+    ``Anomaly_id`` / ``Anomaly_description`` blocks followed by report lines,
+    and ``trace_id,report`` rows appended by Notify.
+    """
+    current = {}
+    with open(path, "r", newline="") as f:
+        for row in csv.reader(f):
+            if not row or not "".join(row).strip():
+                continue
+            head = row[0].strip()
+            if head == "Anomaly_id":
+                if current:
+                    yield current
+                current = {"anomaly_id": row[1].strip() if len(row) > 1 else "", "report": []}
+            elif head == "Anomaly_description" and current:
+                current["description"] = ",".join(row[1:]).strip()
+            elif head.startswith("T-") and len(row) == 2:
+                if current:
+                    yield current
+                    current = {}
+                yield {"trace_id": head, "report": [row[1]]}
+            elif current:
+                # Assume the rest is the report content
+                current["report"].append(",".join(row).strip())
+    if current:
+        yield current
+
+
+class IncidentStore:
+    """
+    Incident reports in SQLite (WAL), replacing the append-only pool_db.csv.
+
+    Indexed by trace/anomaly id, (rule, time), (severity, time) and time, with
+    an FTS5 index over descriptions and reports. Writes go through one writer
+    thread that commits whatever has queued up in a single transaction (group
+    commit: up to ``commit_max`` rows or ``commit_wait_s`` seconds); ``add``
+    returns a future resolved once the row is durable. Reads use one
+    connection per thread and never block the writer.
+    """
+
+    def __init__(self, path: str = settings.INCIDENT_DB_PATH, commit_max: int = settings.INCIDENT_COMMIT_MAX,
+                 commit_wait_s: float = settings.INCIDENT_COMMIT_WAIT_S):
+        self.path = path
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.commit_max, self.commit_wait_s = commit_max, commit_wait_s
+        self._local = threading.local()
+        self._queue: queue.Queue = queue.Queue()
+        self.commits = self.rows_written = 0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="incident-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # --- writes ---------------------------------------------------------
+
+    @staticmethod
+    def _row(trace_id: str, anomaly: dict, report: str, ts: Optional[float]) -> tuple:
+        return (trace_id, anomaly.get("id", ""), anomaly.get("rule") or anomaly.get("description", ""),
+                anomaly.get("severity", ""), anomaly.get("description", ""), anomaly.get("src_ip", ""),
+                anomaly.get("dst_ip", ""), report, time.time() if ts is None else ts)
+
+    def add(self, trace_id: str, anomaly: dict, report: str, ts: Optional[float] = None) -> concurrent.futures.Future:
+        fut = concurrent.futures.Future()
+        self._queue.put((self._row(trace_id, anomaly or {}, report, ts), fut))
+        return fut
+
+    async def add_async(self, trace_id: str, anomaly: dict, report: str, ts: Optional[float] = None):
+        await asyncio.wrap_future(self.add(trace_id, anomaly, report, ts))
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.commit_wait_s
+            while len(batch) < self.commit_max:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany(_UPSERT, [row for row, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self.commits += 1
+            self.rows_written += len(batch)
+            for _, fut in batch:
+                fut.set_result(True)
+
+    def add_many(self, rows: list[tuple[str, dict, str, Optional[float]]]):
+        """Bulk load (migration): one transaction, bypassing the writer queue."""
+        with self._connect() as conn:
+            conn.executemany(_UPSERT, [self._row(*r) for r in rows])
+
+    # --- reads ----------------------------------------------------------
+
+    def count(self) -> int:
+        return self._reader().execute("SELECT COUNT(*) FROM incidents").fetchone()[0]
+
+    def get(self, trace_id: str, anomaly_id: Optional[str] = None) -> list[dict]:
+        """Point lookup by trace (and anomaly) id."""
+        sql, args = "SELECT * FROM incidents WHERE trace_id = ?", [trace_id]
+        if anomaly_id is not None:
+            sql, args = sql + " AND anomaly_id = ?", args + [anomaly_id]
+        return [dict(r) for r in self._reader().execute(sql, args)]
+
+    def range(self, since: Optional[float] = None, until: Optional[float] = None, rule: Optional[str] = None,
+              severity: Optional[str] = None, limit: Optional[int] = 100) -> list[dict]:
+        """Most recent incidents first, optionally restricted to a time range, rule and severity."""
+        where, args = [], []
+        for cond, value in (("rule = ?", rule), ("severity = ?", severity), ("ts >= ?", since), ("ts < ?", until)):
+            if value is not None:
+                where.append(cond)
+                args.append(value)
+        sql = "SELECT * FROM incidents" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY ts DESC"
+        if limit is not None:
+            sql, args = sql + " LIMIT ?", args + [limit]
+        return [dict(r) for r in self._reader().execute(sql, args)]
+
+    def search(self, text: str, limit: int = 10) -> list[dict]:
+        """Full-text search (FTS5, bm25-ranked) over descriptions and reports."""
+        query = " OR ".join(f'"{t}"' for t in text.replace('"', " ").split())
+        if not query:
+            return []
+        sql = ("SELECT incidents.* FROM incidents_fts JOIN incidents ON incidents.id = incidents_fts.rowid "
+               "WHERE incidents_fts MATCH ? ORDER BY bm25(incidents_fts) LIMIT ?")
+        return [dict(r) for r in self._reader().execute(sql, (query, limit))]
+
+    def iter_all(self, chunk: int = 1000) -> Iterator[dict]:
+        """Every incident in insertion order, read in chunks (for re-indexing)."""
+        last = 0
+        while True:
+            rows = self._reader().execute("SELECT * FROM incidents WHERE id > ? ORDER BY id LIMIT ?", (last, chunk)).fetchall()
+            if not rows:
+                return
+            yield from (dict(r) for r in rows)
+            last = rows[-1]["id"]
+
+    # --- migration ------------------------------------------------------
+
+    def migrate_csv(self, path: str = settings.POOL_DB_PATH) -> int:
+        """Import a legacy pool_db.csv (idempotent: rows are keyed by trace/anomaly id)."""
+        if not pathlib.Path(path).exists():
+            return 0
+        rows = []
+        for i, r in enumerate(iter_pool_reports(path)):
+            anomaly = {"id": r.get("anomaly_id", ""), "description": r.get("description", "")}
+            rows.append((r.get("trace_id", f"pool-{i}"), anomaly, "\n".join(r.get("report", [])), 0.0))
+        self.add_many(rows)
+        log(f"IncidentStore ▶ migrated {len(rows)} reports from {path}")
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {"incidents": self.count(), "commits": self.commits, "rows_written": self.rows_written,
+                "rows_per_commit": self.rows_written / self.commits if self.commits else 0.0}
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_incident_store() -> IncidentStore:
+    """Process-wide store, opened on first use; an empty store imports pool_db.csv once."""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = IncidentStore()
+            if _STORE.count() == 0:
+                _STORE.migrate_csv(settings.POOL_DB_PATH)
+        return _STORE
+
+
+if __name__ == "__main__":
+    import argparse, json
+    from app.utils.tracing import init_logger
+    parser = argparse.ArgumentParser(description="Incident store maintenance")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("migrate", help="import pool_db.csv").add_argument("--csv", default=settings.POOL_DB_PATH)
+    sub.add_parser("search", help="full-text search").add_argument("text")
+    sub.add_parser("stats")
+    args = parser.parse_args()
+    init_logger()
+    incidents = IncidentStore()
+    if args.cmd == "migrate":
+        incidents.migrate_csv(args.csv)
+    elif args.cmd == "search":
+        for r in incidents.search(args.text):
+            print(json.dumps({k: r[k] for k in ("trace_id", "anomaly_id", "rule", "severity", "ts")}))
+    else:
+        print(incidents.stats())
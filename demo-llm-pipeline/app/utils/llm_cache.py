@@ -0,0 +1,132 @@
+import collections
+import hashlib
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Optional
+from app.utils.config import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key      TEXT PRIMARY KEY,
+    model    TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created  REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_responses_accessed ON responses (accessed);
+"""
+
+
+class ResponseCache:
+    """
+    LLM response cache keyed by ``sha256(model, params, prompt)``.
+
+    Two tiers: an in-memory LRU of ``mem_items`` responses and a SQLite table
+    (WAL) that survives restarts. Entries older than ``ttl_s`` are misses and
+    are purged; beyond ``max_rows`` the least recently read rows are dropped.
+    Eviction runs every ``evict_every`` writes. Hits and misses are counted per
+    agent profile.
+    """
+
+    def __init__(self, path: str = settings.LLM_CACHE_PATH, mem_items: int = settings.LLM_CACHE_MEM_ITEMS,
+                 max_rows: int = settings.LLM_CACHE_MAX_ROWS, ttl_s: float = settings.LLM_CACHE_TTL_S,
+                 evict_every: int = 256):
+        self.path, self.mem_items, self.max_rows, self.ttl_s, self.evict_every = path, mem_items, max_rows, ttl_s, evict_every
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._mem: collections.OrderedDict[str, tuple[str, float]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits_mem: collections.Counter = collections.Counter()
+        self.hits_disk: collections.Counter = collections.Counter()
+        self.misses: collections.Counter = collections.Counter()
+        self.puts = self.evicted = 0
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def key(spec: dict, prompt, params: Optional[dict] = None) -> str:
+        raw = json.dumps([spec, str(prompt), params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, response: str, created: float):
+        self._mem[key] = (response, created)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def get(self, key: str, profile: str = "default") -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None and now - hit[1] <= self.ttl_s:
+                self._mem.move_to_end(key)
+                self.hits_mem[profile] += 1
+                return hit[0]
+            self._mem.pop(key, None)
+        row = self._conn().execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > self.ttl_s:
+            with self._lock:
+                self.misses[profile] += 1
+            return None
+        with self._conn() as conn:
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self._remember(key, row[0], row[1])
+            self.hits_disk[profile] += 1
+        return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses (key, model, response, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                         (key, model, response, now, now))
+        with self._lock:
+            self._remember(key, response, now)
+            self.puts += 1
+            evict = self.puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop expired rows, then the least recently read ones beyond ``max_rows``."""
+        with self._conn() as conn:
+            n = conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_s,)).rowcount
+            n += conn.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed DESC "
+                              "LIMIT -1 OFFSET ?)", (self.max_rows,)).rowcount
+        self.evicted += n
+        return n
+
+    def stats(self) -> dict:
+        profiles = set(self.hits_mem) | set(self.hits_disk) | set(self.misses)
+        per_profile = {}
+        for p in sorted(profiles):
+            hits = self.hits_mem[p] + self.hits_disk[p]
+            lookups = hits + self.misses[p]
+            per_profile[p] = {"hits_mem": self.hits_mem[p], "hits_disk": self.hits_disk[p], "misses": self.misses[p],
+                              "hit_rate": hits / lookups if lookups else 0.0}
+        rows = self._conn().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"profiles": per_profile, "mem_items": len(self._mem), "disk_rows": rows,
+                "puts": self.puts, "evicted": self.evicted}
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ResponseCache()
+        return _CACHE
@@ -1,23 +1,382 @@
+import asyncio, concurrent.futures, contextlib, functools, json, threading, time, urllib.request, weakref
 from langchain_community.llms import fake
 from app.utils.config import settings
+from app.utils.llm_cache import ResponseCache, get_response_cache
 from app.utils.tracing import log
 
-def get_llm():
-    """
-    Return an Ollama-backed LangChain LLM if the server responds,
-    otherwise fall back to a deterministic FakeListLLM.
-    """
-    try:
-        from langchain_ollama import OllamaLLM
-        # Attempt a very small health-check call
-        llm = OllamaLLM(
-            model=settings.OLLAMA_MODEL,
-            base_url=settings.OLLAMA_BASE_URL,
-            temperature=0
-        )
-        llm.invoke("ping")  # ≈1-token check
-        log("LLM Factory ▶ using Ollama backend")  # success
-        return llm
-    except Exception as err:
-        log(f"LLM Factory ▶ Ollama unreachable → using FakeListLLM ({err})", "warning")
-        return fake.FakeListLLM(responses=["VALID", "Sample report.", "INVALID"])
+FAKE_RESPONSES = ["VALID", "Sample report.", "INVALID"]
+_END = object()
+
+
+class LLMRegistry:
+    """
+    Process-wide LLM clients, created on first use and shared by every agent.
+
+    Agents ask for a named profile (``LLM_PROFILES``, merged over the default
+    Ollama model/URL/temperature). One client is kept per distinct backend,
+    model and parameters, so its HTTP connection pool is reused across agents.
+    Backend health is probed with a cheap ``/api/tags`` request, cached for
+    ``health_ttl_s`` while up and re-probed every ``retry_s`` while down; an
+    unreachable backend (or missing model) falls back to a FakeListLLM. Probes
+    run outside the registry lock: while one is in flight, other callers keep
+    the previous result (only the very first probe of a backend is waited for).
+    """
+
+    def __init__(self, profiles: dict = settings.LLM_PROFILES, health_ttl_s: float = settings.LLM_HEALTH_TTL_S,
+                 retry_s: float = settings.LLM_RETRY_S, probe_timeout_s: float = settings.LLM_PROBE_TIMEOUT_S):
+        self.default = {"model": settings.OLLAMA_MODEL, "base_url": settings.OLLAMA_BASE_URL, "temperature": 0}
+        self.profiles = dict(profiles)
+        self.health_ttl_s, self.retry_s, self.probe_timeout_s = health_ttl_s, retry_s, probe_timeout_s
+        self._clients: dict[str, object] = {}
+        self._fakes: dict[str, object] = {}
+        self._health: dict[str, tuple[bool, float, set, str]] = {}   # base_url → (up, checked_at, models, error)
+        self._probe_locks: dict[str, threading.Lock] = {}
+        self._missing: set[tuple[str, str]] = set()   # (base_url, model) already reported as not available
+        self._lock = threading.Lock()
+
+    def profile(self, name: str) -> dict:
+        return {**self.default, **self.profiles.get(name, {})}
+
+    def _probe(self, base_url: str) -> tuple[bool, set, str]:
+        try:
+            with urllib.request.urlopen(base_url.rstrip("/") + "/api/tags", timeout=self.probe_timeout_s) as r:
+                models = {m["name"] for m in json.load(r).get("models", [])}
+            return True, models | {m.split(":")[0] for m in models}, ""
+        except Exception as err:
+            return False, set(), str(err)
+
+    def _stale(self, up, checked_at: float) -> bool:
+        return up is None or time.monotonic() - checked_at > (self.health_ttl_s if up else self.retry_s)
+
+    def _status(self, base_url: str) -> tuple[bool, set]:
+        with self._lock:
+            up, checked_at, models, _ = self._health.get(base_url, (None, 0.0, set(), ""))
+            probe_lock = self._probe_locks.setdefault(base_url, threading.Lock())
+        if not self._stale(up, checked_at):
+            return up, models
+        # one probe per backend, outside the registry lock; callers with a previous result keep using it
+        if not probe_lock.acquire(blocking=up is None):
+            return up, models
+        try:
+            with self._lock:
+                was, checked_at, old_models, _ = self._health.get(base_url, (None, 0.0, set(), ""))
+            if not self._stale(was, checked_at):
+                return was, old_models   # probed by another thread while this one waited
+            up, models, error = self._probe(base_url)
+            with self._lock:
+                self._health[base_url] = (up, time.monotonic(), models, error)
+                if models != old_models:
+                    self._missing = {(url, m) for url, m in self._missing if url != base_url}
+        finally:
+            probe_lock.release()
+        if up and was is not True:
+            log(f"LLM Factory ▶ Ollama backend {base_url} is up")
+        elif not up and was is not False:
+            log(f"LLM Factory ▶ Ollama unreachable at {base_url} ({error}) → using FakeListLLM", "warning")
+        return up, models
+
+    def healthy(self, base_url: str, model: str) -> bool:
+        up, models = self._status(base_url)
+        if up and model not in models:
+            with self._lock:
+                report = (base_url, model) not in self._missing
+                self._missing.add((base_url, model))
+            if report:
+                log(f"LLM Factory ▶ model '{model}' not available at {base_url} → using FakeListLLM", "warning")
+            return False
+        return bool(up)
+
+    def mark_down(self, base_url: str):
+        """Called after a failed request: skip the backend until the next re-probe."""
+        with self._lock:
+            _, _, models, _ = self._health.get(base_url, (None, 0.0, set(), ""))
+            self._health[base_url] = (False, time.monotonic(), models, "request failed")
+
+    def get(self, name: str = "default"):
+        """The client for profile ``name``: the shared Ollama client, or a fake while the backend is down."""
+        spec = self.profile(name)
+        if not self.healthy(spec["base_url"], spec["model"]):
+            with self._lock:
+                if name not in self._fakes:
+                    self._fakes[name] = fake.FakeListLLM(responses=FAKE_RESPONSES)
+                return self._fakes[name]
+        key = json.dumps(spec, sort_keys=True)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                from langchain_ollama import OllamaLLM
+                client = self._clients[key] = OllamaLLM(**spec)
+                log(f"LLM Factory ▶ created Ollama client for profile '{name}' ({spec['model']})")
+            return client
+
+    def stats(self) -> dict:
+        return {"clients": len(self._clients), "fakes": len(self._fakes),
+                "backends": {url: up for url, (up, _, _, _) in self._health.items()}}
+
+
+class LLMLimiter:
+    """
+    Concurrency caps for LLM calls made from the event loop: at most
+    ``global_max`` in flight overall and ``backend_max`` (or the per-URL value
+    in ``backend_limits``) per backend. Blocking client calls run on a thread
+    pool of ``global_max`` workers, so waiting on Ollama never stalls the bus.
+    Semaphores are kept per event loop (one per bus shard process).
+    """
+
+    def __init__(self, global_max: int = settings.LLM_MAX_CONCURRENCY,
+                 backend_max: int = settings.LLM_BACKEND_CONCURRENCY,
+                 backend_limits: dict = settings.LLM_BACKEND_LIMITS):
+        self.global_max, self.backend_max, self.backend_limits = global_max, backend_max, dict(backend_limits)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=global_max, thread_name_prefix="llm")
+        self._sems: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.in_flight = self.peak = self.calls = 0
+
+    def _semaphores(self, base_url: str) -> tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        sems = self._sems.get(loop)
+        if sems is None:
+            sems = self._sems[loop] = (asyncio.Semaphore(self.global_max), {})
+        per_backend = sems[1].get(base_url)
+        if per_backend is None:
+            per_backend = sems[1][base_url] = asyncio.Semaphore(self.backend_limits.get(base_url, self.backend_max))
+        return sems[0], per_backend
+
+    @contextlib.asynccontextmanager
+    async def slot(self, base_url: str):
+        global_sem, backend_sem = self._semaphores(base_url)
+        async with global_sem, backend_sem:
+            self.in_flight += 1
+            self.calls += 1
+            self.peak = max(self.peak, self.in_flight)
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    async def run(self, base_url: str, fn, *args, **kwargs):
+        async with self.slot(base_url):
+            return await asyncio.get_running_loop().run_in_executor(self.pool, functools.partial(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "peak": self.peak, "calls": self.calls}
+
+
+class LLMBatcher:
+    """
+    Micro-batching of concurrent LLM requests across traces.
+
+    Requests for the same client spec and call parameters that arrive within
+    ``max_wait_s`` of the first one (or until ``max_batch`` have queued) are
+    sent as one ``batch`` call, taking a single concurrency slot; identical
+    prompts in a batch are sent once. Each caller awaits its own future.
+    Pending requests are kept per event loop.
+    """
+
+    def __init__(self, max_batch: int = settings.LLM_BATCH_MAX_SIZE, max_wait_s: float = settings.LLM_BATCH_MAX_WAIT_S):
+        self.max_batch, self.max_wait_s = max_batch, max_wait_s
+        self._pending: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()   # loop → {group: [entry, ...]}
+        self._tasks: set = set()
+        self.batches = self.requests = self.deduped = 0
+
+    async def submit(self, handle: "LLMHandle", prompt, key, kwargs: dict):
+        loop = asyncio.get_running_loop()
+        groups = self._pending.setdefault(loop, {})
+        group = json.dumps([handle.registry.profile(handle.profile), kwargs], sort_keys=True, default=str)
+        fut = loop.create_future()
+        entries = groups.get(group)
+        if entries is None:
+            entries = groups[group] = []
+            loop.call_later(self.max_wait_s, self._flush, loop, group, entries)
+        entries.append((handle, prompt, key, kwargs, fut))
+        self.requests += 1
+        if len(entries) >= self.max_batch:
+            self._flush(loop, group, entries)
+        return await fut
+
+    def _flush(self, loop, group: str, entries: list):
+        groups = self._pending.get(loop, {})
+        if groups.get(group) is not entries:
+            return  # already sent when it filled up
+        del groups[group]
+        task = loop.create_task(self._send(entries))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, entries: list):
+        handle, kwargs = entries[0][0], entries[0][3]
+        unique: dict[str, tuple] = {}
+        for _, prompt, key, _, _ in entries:
+            unique.setdefault(str(prompt), (prompt, key))
+        self.batches += 1
+        self.deduped += len(entries) - len(unique)
+        base_url = handle.registry.profile(handle.profile)["base_url"]
+        try:
+            responses = await get_limiter().run(base_url, handle._call_batch, [p for p, _ in unique.values()],
+                                                [k for _, k in unique.values()], **kwargs)
+        except Exception as err:
+            for *_, fut in entries:
+                if not fut.done():
+                    fut.set_exception(err)
+            return
+        by_prompt = dict(zip(unique, responses))
+        for _, prompt, _, _, fut in entries:
+            if not fut.done():
+                fut.set_result(by_prompt[str(prompt)])
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "requests": self.requests, "deduped": self.deduped,
+                "avg_batch": self.requests / self.batches if self.batches else 0.0}
+
+
+class LLMHandle:
+    """What agents hold instead of a client: resolves its profile on every call, so nothing connects at import."""
+
+    def __init__(self, registry: LLMRegistry, profile: str):
+        self.registry, self.profile = registry, profile
+
+    def _cache_key(self, prompt, kwargs: dict):
+        # opt-in per profile, and only for deterministic (temperature 0) sampling
+        spec = self.registry.profile(self.profile)
+        if self.profile not in settings.LLM_CACHE_PROFILES or spec.get("temperature", 0) > 0:
+            return None
+        return ResponseCache.key(spec, prompt, kwargs)
+
+    def _call(self, prompt, key, **kwargs):
+        llm = self.registry.get(self.profile)
+        try:
+            response = llm.invoke(prompt, **kwargs)
+        except Exception:
+            self.registry.mark_down(self.registry.profile(self.profile)["base_url"])
+            raise
+        if key is not None and not isinstance(llm, fake.FakeListLLM):
+            get_response_cache().put(key, self.registry.profile(self.profile)["model"], str(response))
+        return response
+
+    def _call_batch(self, prompts: list, keys: list, **kwargs) -> list:
+        llm = self.registry.get(self.profile)
+        try:
+            responses = llm.batch(prompts, **kwargs) if len(prompts) > 1 else [llm.invoke(prompts[0], **kwargs)]
+        except Exception:
+            self.registry.mark_down(self.registry.profile(self.profile)["base_url"])
+            raise
+        if not isinstance(llm, fake.FakeListLLM):
+            model = self.registry.profile(self.profile)["model"]
+            for key, response in zip(keys, responses):
+                if key is not None:
+                    get_response_cache().put(key, model, str(response))
+        return responses
+
+    def invoke(self, prompt, **kwargs):
+        key = self._cache_key(prompt, kwargs)
+        if key is not None:
+            cached = get_response_cache().get(key, self.profile)
+            if cached is not None:
+                return cached
+        return self._call(prompt, key, **kwargs)
+
+    async def ainvoke(self, prompt, **kwargs):
+        """``invoke`` off the event loop, within the global and per-backend concurrency limits."""
+        key = self._cache_key(prompt, kwargs)
+        if key is not None:
+            # memory or SQLite point read: answered without taking a concurrency slot
+            cached = get_response_cache().get(key, self.profile)
+            if cached is not None:
+                return cached
+        if settings.LLM_BATCH_MAX_SIZE > 1:
+            return await get_batcher().submit(self, prompt, key, kwargs)
+        base_url = self.registry.profile(self.profile)["base_url"]
+        return await get_limiter().run(base_url, self._call, prompt, key, **kwargs)
+
+    async def astream(self, prompt, cancel: threading.Event = None, **kwargs):
+        """
+        Yield the response in chunks as the backend generates them. The client's
+        blocking ``stream`` runs on the LLM thread pool within the usual limits;
+        setting ``cancel`` abandons the generation at the next chunk. ``kwargs``
+        (e.g. ``stop`` sequences) go to the client. Cache hits are yielded
+        whole, and only complete responses are cached.
+        """
+        key = self._cache_key(prompt, kwargs)
+        if key is not None:
+            cached = get_response_cache().get(key, self.profile)
+            if cached is not None:
+                yield cached
+                return
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        cancel = cancel or threading.Event()
+
+        def produce():
+            llm = self.registry.get(self.profile)
+            parts = []
+            try:
+                for chunk in llm.stream(prompt, **kwargs):
+                    parts.append(str(chunk))
+                    loop.call_soon_threadsafe(chunks.put_nowait, parts[-1])
+                    if cancel.is_set():
+                        return
+            except Exception:
+                self.registry.mark_down(self.registry.profile(self.profile)["base_url"])
+                raise
+            if key is not None and not isinstance(llm, fake.FakeListLLM):
+                get_response_cache().put(key, self.registry.profile(self.profile)["model"], "".join(parts))
+
+        limiter = get_limiter()
+        async with limiter.slot(self.registry.profile(self.profile)["base_url"]):
+            task = loop.run_in_executor(limiter.pool, produce)
+            task.add_done_callback(lambda _: chunks.put_nowait(_END))
+            completed = False
+            try:
+                while (chunk := await chunks.get()) is not _END:
+                    yield chunk
+                completed = True
+            finally:
+                cancel.set()
+                # keep the slot until the pool thread has left llm.stream, and always collect its outcome
+                try:
+                    await task
+                except Exception as err:
+                    if completed:
+                        raise  # a backend error surfaces to the consumer
+                    log(f"LLM Factory ▶ abandoned stream for '{self.profile}' ended with {err!r}", "warning")
+
+    def __getattr__(self, name):
+        return getattr(self.registry.get(self.profile), name)
+
+
+_REGISTRY = None
+_LIMITER = None
+_BATCHER = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry() -> LLMRegistry:
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = LLMRegistry()
+        return _REGISTRY
+
+
+def get_limiter() -> LLMLimiter:
+    global _LIMITER
+    with _REGISTRY_LOCK:
+        if _LIMITER is None:
+            _LIMITER = LLMLimiter()
+        return _LIMITER
+
+
+def get_batcher() -> LLMBatcher:
+    global _BATCHER
+    with _REGISTRY_LOCK:
+        if _BATCHER is None:
+            _BATCHER = LLMBatcher()
+        return _BATCHER
+
+
+def get_llm(profile: str = "default") -> LLMHandle:
+    """
+    Return a lazy handle on the shared LLM for ``profile``: Ollama when the
+    server responds, otherwise a deterministic FakeListLLM. No request is made
+    until the first ``invoke``.
+    """
+    return LLMHandle(get_registry(), profile)
@@ -0,0 +1,128 @@
+import bisect, collections, re, threading
+from typing import Optional
+from app.utils.config import settings
+from app.utils.tokens import count_tokens, truncate_tokens
+from app.utils.tracing import log
+
+BUCKETS = [256, 512, 1024, 2048, 4096, 8192, 16384]   # upper bounds of the histogram bins, in tokens
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+class PromptStats:
+    """Per-agent prompt-size histograms (tokens), plus how often context had to be compacted."""
+
+    def __init__(self, every: int = settings.PROMPT_STATS_EVERY):
+        self.every = every
+        self.hist: dict[str, list[int]] = collections.defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self.totals: collections.Counter = collections.Counter()
+        self.prompts: collections.Counter = collections.Counter()
+        self.compacted: collections.Counter = collections.Counter()
+        self.saved: collections.Counter = collections.Counter()
+        self.peak: collections.Counter = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, agent: str, tokens: int, saved: int = 0):
+        with self._lock:
+            self.hist[agent][bisect.bisect_left(BUCKETS, tokens)] += 1
+            self.prompts[agent] += 1
+            self.totals[agent] += tokens
+            self.peak[agent] = max(self.peak[agent], tokens)
+            if saved:
+                self.compacted[agent] += 1
+                self.saved[agent] += saved
+            emit = self.every and self.prompts[agent] % self.every == 0
+        if emit:
+            log(f"PromptBudget ▶ {agent}: {self.summary(agent)}")
+
+    def summary(self, agent: str) -> str:
+        bins = " ".join(f"≤{b}:{n}" if i < len(BUCKETS) else f">{BUCKETS[-1]}:{n}"
+                        for i, (b, n) in enumerate(zip(BUCKETS + [BUCKETS[-1]], self.hist[agent])) if n)
+        n = self.prompts[agent]
+        return (f"{n} prompts, mean {self.totals[agent] / max(n, 1):.0f} tokens, peak {self.peak[agent]}, "
+                f"compacted {self.compacted[agent]} (−{self.saved[agent]} tokens) [{bins}]")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {agent: {"prompts": self.prompts[agent], "mean_tokens": self.totals[agent] / max(self.prompts[agent], 1),
+                            "peak_tokens": self.peak[agent], "compacted": self.compacted[agent],
+                            "tokens_saved": self.saved[agent],
+                            "histogram": dict(zip([f"<={b}" for b in BUCKETS] + [f">{BUCKETS[-1]}"], self.hist[agent]))}
+                    for agent in self.prompts}
+
+
+PROMPT_STATS = PromptStats()
+
+
+def budget_for(agent: str) -> int:
+    return settings.PROMPT_BUDGETS.get(agent, settings.PROMPT_TOKEN_BUDGET)
+
+
+def _dedup(sections: dict[str, str]) -> dict[str, str]:
+    # repeated lines across context fields: the first (highest priority) occurrence is kept
+    seen, out = set(), {}
+    for name, text in sections.items():
+        kept = []
+        for line in text.splitlines():
+            norm = " ".join(line.split()).lower()
+            if len(norm) > 20 and norm in seen:
+                continue
+            seen.add(norm)
+            kept.append(line)
+        out[name] = "\n".join(kept)
+    return out
+
+
+def _summarize(text: str) -> str:
+    # extractive: every line is cut to its first sentence
+    return "\n".join(_SENTENCE_END.split(line.strip(), 1)[0] for line in text.splitlines() if line.strip())
+
+
+def compact(sections: dict[str, str], budget: int) -> dict[str, str]:
+    """
+    Fit the context ``sections`` (most important first) into ``budget`` tokens.
+    Steps, each applied only while still over budget: deduplicate repeated lines
+    across sections, then summarize and finally truncate sections starting
+    from the least important.
+    """
+    def size(s):
+        return sum(count_tokens(t) for t in s.values())
+
+    if size(sections) <= budget:
+        return dict(sections)
+    out = _dedup(sections)
+    for step in ("summarize", "truncate"):
+        for name in reversed(list(out)):
+            over = size(out) - budget
+            if over <= 0:
+                return out
+            if not out[name].strip():
+                continue
+            if step == "summarize":
+                out[name] = _summarize(out[name])
+            else:
+                keep = max(0, count_tokens(out[name]) - over)
+                out[name] = truncate_tokens(out[name], keep) if keep else "(omitted: prompt budget)"
+    return out
+
+
+def render_payload(payload) -> str:
+    """A payload dict as ``key: value`` lines, so repeated content can be deduplicated against other fields."""
+    if not isinstance(payload, dict):
+        return str(payload)
+    return "\n".join(f"{k}:\n{v}" if "\n" in str(v) else f"{k}: {v}" for k, v in payload.items() if k != "retry_count")
+
+
+def build_prompt(agent: str, template: str, context: dict[str, str], budget: Optional[int] = None, **fixed) -> str:
+    """
+    ``template.format(**fixed, **context)`` within the agent's token budget
+    (``PROMPT_BUDGETS`` / ``PROMPT_TOKEN_BUDGET``): the fixed fields are kept
+    as they are and the ``context`` fields (ordered by importance) are
+    compacted into what is left. The prompt size is recorded per agent.
+    """
+    budget = budget_for(agent) if budget is None else budget
+    overhead = count_tokens(template.format(**fixed, **{k: "" for k in context}))
+    before = sum(count_tokens(t) for t in context.values())
+    fitted = compact(context, max(0, budget - overhead))
+    prompt = template.format(**fixed, **fitted)
+    PROMPT_STATS.record(agent, count_tokens(prompt), saved=max(0, before - sum(count_tokens(t) for t in fitted.values())))
+    return prompt
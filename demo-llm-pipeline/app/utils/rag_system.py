@@ -1,5 +1,9 @@
 import asyncio
+import concurrent.futures
+import hashlib
+import json
 import os
+import time
 import chromadb
 import pathlib
 from llama_index.core import (
@@ -8,12 +12,17 @@ from llama_index.core import (
     StorageContext,
     Settings,
 )
+from llama_index.core.node_parser import SentenceSplitter
 # from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.chroma import ChromaVectorStore  # VERSIONI VECCHIE
 try:
     from app.utils.config import settings
+    from app.utils.embedding_cache import CachedEmbeddings
+    from app.utils.semantic_cache import SemanticCache
 except:
     from config import settings  # per test standalone
+    from embedding_cache import CachedEmbeddings
+    from semantic_cache import SemanticCache
 from langchain_ollama.llms import OllamaLLM
 from langchain_ollama import OllamaEmbeddings
 
@@ -26,25 +35,125 @@ CHROMA_COLLECTION_NAME = "network_anomalies" # Nome della collection
 # EMBEDDING_MODEL_NAME = "BAAI/bge-base-en-v1.5"
 KNOWLEDGE_BASE_DIR = str(pathlib.Path(__file__).parent.parent / "db" / "anomaly_pool")
 EMBEDDING_MODEL_NAME = "embeddinggemma" # Un modello di embedding potente e open-source
+MANIFEST_PATH = os.path.join(CHROMA_DB_PATH, "ingest_manifest.json")  # file → hash e chunk id
+KB_EXTS = [".pdf", ".md", ".txt"]
 
 print(f"Chroma DB Path: {CHROMA_DB_PATH}")
 
 
-def ingest_with_chroma():
+def _file_hash(path: pathlib.Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_manifest(manifest: dict):
+    # scrittura atomica: un crash non lascia un manifest a metà
+    os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+    tmp = MANIFEST_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def _embed_parallel(embed_model, texts: list[str], batch_size: int, workers: int) -> list[list[float]]:
+    """Embed ``texts`` in batches, ``workers`` batches in flight at once; order is preserved."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return [vec for batch in pool.map(embed_model.embed_documents, batches) for vec in batch]
+
+
+def ingest_incremental(chroma_collection, embed_model, batch_size: int = settings.RAG_EMBED_BATCH_SIZE,
+                       workers: int = settings.RAG_EMBED_WORKERS) -> dict:
+    """
+    Ingestione incrementale: il manifest (``MANIFEST_PATH``) registra hash del
+    contenuto e chunk id di ogni file. Solo i file nuovi o modificati vengono
+    ri-chunkati e ri-embeddati (in batch paralleli); i chunk dei file modificati
+    o rimossi vengono cancellati dalla collection.
+    """
+    started = time.monotonic()
+    manifest = _load_manifest()
+    if not manifest and chroma_collection.count() > 0:
+        # collection riempita da un'ingestione completa: chunk id sconosciuti, si riparte da zero
+        chroma_collection.delete(ids=chroma_collection.get(include=[])["ids"])
+    base = pathlib.Path(KNOWLEDGE_BASE_DIR)
+    files = {str(p.relative_to(base)): p for p in sorted(base.rglob("*")) if p.is_file() and p.suffix.lower() in KB_EXTS}
+    hashes = {rel: _file_hash(p) for rel, p in files.items()}
+    removed = [rel for rel in manifest if rel not in files]
+    changed = [rel for rel in files if manifest.get(rel, {}).get("sha1") != hashes[rel]]
+
+    stale_ids = [cid for rel in removed + changed for cid in manifest.get(rel, {}).get("chunk_ids", [])]
+    if stale_ids:
+        chroma_collection.delete(ids=stale_ids)
+    for rel in removed:
+        manifest.pop(rel, None)
+
+    chunks = 0
+    if changed:
+        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+        splitter = SentenceSplitter(chunk_size=Settings.chunk_size, chunk_overlap=Settings.chunk_overlap)
+        documents = SimpleDirectoryReader(input_files=[str(files[rel]) for rel in changed]).load_data()
+        nodes_by_file: dict[str, list] = {rel: [] for rel in changed}
+        path_to_rel = {str(files[rel].resolve()): rel for rel in changed}
+        for doc in documents:
+            rel = path_to_rel[str(pathlib.Path(doc.metadata["file_path"]).resolve())]
+            nodes_by_file[rel].extend(splitter.get_nodes_from_documents([doc]))
+        nodes = []
+        for rel, file_nodes in nodes_by_file.items():
+            # id stabili: file + hash + posizione, così un re-run non duplica i chunk
+            for i, node in enumerate(file_nodes):
+                node.id_ = f"{hashes[rel][:12]}:{i}:{rel}"
+            nodes.extend(file_nodes)
+        embeddings = _embed_parallel(embed_model, [n.get_content(metadata_mode="embed") for n in nodes], batch_size, workers)
+        for node, emb in zip(nodes, embeddings):
+            node.embedding = emb
+        vector_store.add(nodes)
+        for rel, file_nodes in nodes_by_file.items():
+            manifest[rel] = {"sha1": hashes[rel], "chunk_ids": [n.id_ for n in file_nodes]}
+        chunks = len(nodes)
+    _save_manifest(manifest)
+    summary = {"files": len(files), "changed": len(changed), "removed": len(removed),
+               "chunks_embedded": chunks, "chunks_deleted": len(stale_ids),
+               "seconds": round(time.monotonic() - started, 2)}
+    print(f"-> Ingestione incrementale: {summary}")
+    return summary
+
+
+def ingest_with_chroma(incremental: bool = True):
     """
     Carica, processa e indicizza i documenti in una collection ChromaDB.
+    Con ``incremental`` (default) vengono processati solo i file nuovi, modificati o rimossi.
     """
     print("Avvio del processo di ingestione con LlamaIndex e ChromaDB...")
 
     # 1. Configura LLM e Embedding
     Settings.llm = OllamaLLM(model=settings.OLLAMA_MODEL, base_url=settings.OLLAMA_BASE_URL, temperature=0.1)
-    Settings.embed_model = OllamaEmbeddings(model=EMBEDDING_MODEL_NAME, base_url=settings.OLLAMA_BASE_URL)
+    embed_model = CachedEmbeddings(OllamaEmbeddings(model=EMBEDDING_MODEL_NAME, base_url=settings.OLLAMA_BASE_URL), EMBEDDING_MODEL_NAME)
+    Settings.embed_model = embed_model
     Settings.chunk_size = 1000
     Settings.chunk_overlap = 200
 
+    if incremental:
+        db = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        chroma_collection = db.get_or_create_collection(CHROMA_COLLECTION_NAME)
+        ingest_incremental(chroma_collection, embed_model)
+        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
+        print(f"\nIngestione completata. Dati salvati in ChromaDB a '{CHROMA_DB_PATH}' nella collection '{CHROMA_COLLECTION_NAME}'.")
+        return VectorStoreIndex.from_vector_store(vector_store=vector_store)
+
     # 2. Carica i documenti
     print(f"Caricamento documenti da: {KNOWLEDGE_BASE_DIR}")
-    reader = SimpleDirectoryReader(KNOWLEDGE_BASE_DIR, required_exts=[".pdf", ".md", ".txt"])
+    reader = SimpleDirectoryReader(KNOWLEDGE_BASE_DIR, required_exts=KB_EXTS)
     documents = reader.load_data()
     print(f"-> Caricati {len(documents)} documenti.")
 
@@ -72,7 +181,7 @@ class AnomalyInterpreterAgentChroma:
 
         # 1. Configura LLM e Embedding
         Settings.llm = OllamaLLM(model=settings.OLLAMA_MODEL, base_url=settings.OLLAMA_BASE_URL, temperature=0.1)
-        Settings.embed_model = OllamaEmbeddings(model=EMBEDDING_MODEL_NAME, base_url=settings.OLLAMA_BASE_URL)
+        Settings.embed_model = CachedEmbeddings(OllamaEmbeddings(model=EMBEDDING_MODEL_NAME, base_url=settings.OLLAMA_BASE_URL), EMBEDDING_MODEL_NAME)
 
         # 2. Connettiti a ChromaDB e carica l'indice
         print(f"Caricamento della knowledge base da ChromaDB: '{CHROMA_DB_PATH}'")
@@ -82,9 +191,18 @@ class AnomalyInterpreterAgentChroma:
         except Exception as e:
             raise ValueError(f"Collection '{CHROMA_COLLECTION_NAME}' non trovata in ChromaDB. Errore: {str(e)}")
         vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        
+        self.collection = chroma_collection
+
         index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
 
+        # cache semantica delle risposte: invalidata quando cambia la collection
+        self.cache = SemanticCache(
+            threshold=settings.RAG_CACHE_THRESHOLD,
+            ttl_s=settings.RAG_CACHE_TTL_S,
+            max_items=settings.RAG_CACHE_MAX_ITEMS,
+            fingerprint=self._collection_version,
+        )
+
         # 3. Crea il Query Engine Tool dall'indice caricato
         query_engine = index.as_query_engine(similarity_top_k=5)
         knowledge_base_tool = QueryEngineTool.from_defaults(
@@ -124,11 +242,28 @@ class AnomalyInterpreterAgentChroma:
         #     """
         # )
 
+    def _collection_version(self):
+        # numero di chunk + mtime del manifest: cambia a ogni ingestione che tocca la collection
+        try:
+            manifest_mtime = os.stat(MANIFEST_PATH).st_mtime_ns
+        except FileNotFoundError:
+            manifest_mtime = 0
+        return self.collection.count(), manifest_mtime
+
     async def interpret_anomaly(self, anomaly_description: str):
         print(f"\n--- Analisi dell'anomalia: '{anomaly_description}' ---")
-        response = await self.agent.acall(anomaly_description)
+        started = time.perf_counter()
+        query_vec = await asyncio.to_thread(Settings.embed_model.get_query_embedding, anomaly_description)
+        cached = self.cache.get(query_vec)
+        if cached is not None:
+            print(f"\n[RISPOSTA DALLA CACHE in {(time.perf_counter() - started) * 1000:.1f} ms]:")
+            print(cached)
+            return cached
+        response = str(await self.agent.acall(anomaly_description))
+        self.cache.put(query_vec, response, anomaly_description)
         print("\n[RISPOSTA FINALE DELL'AGENTE]:")
-        print(str(response))
+        print(response)
+        return response
 
 async def main():
     agent = AnomalyInterpreterAgentChroma()
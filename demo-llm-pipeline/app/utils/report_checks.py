@@ -0,0 +1,25 @@
+import re
+from typing import Optional
+from app.utils.config import settings
+from app.utils.tokens import count_tokens
+
+# Cheap, LLM-free checks on (possibly partial) report text. Each returns the
+# feedback GuardRail would give, so a failing report can go to reflection
+# without waiting for the full generation or an LLM validation.
+
+_AI_REFUSAL = re.compile(r"\bas an ai\b|\bai language model\b|\bi(?: cannot|can't|'m unable to) (?:help|assist|provide)", re.I)
+_SCHEMA_ECHO = re.compile(r'["\']?type["\']?\s*:\s*["\']?(?:string|array|object|integer)\b', re.I)
+
+
+def partial_check(text: str) -> Optional[str]:
+    """Feedback for the first failed check on ``text``, or None."""
+    if _AI_REFUSAL.search(text):
+        return ("Do not answer as an AI language model or refuse: write the incident report "
+                "as a SOC analyst, using only the anomaly data, domain knowledge and history given.")
+    if _SCHEMA_ECHO.search(text):
+        return ("Do not report meta-information about types or schemas: write the incident report "
+                "with severity, root cause hypothesis and mitigations.")
+    if count_tokens(text) > settings.NOTIFY_MAX_REPORT_TOKENS:
+        return (f"The report is too long: keep it concise, under {settings.NOTIFY_MAX_REPORT_TOKENS} tokens, "
+                "covering severity, root cause hypothesis and mitigations only.")
+    return None
@@ -0,0 +1,106 @@
+import collections, json, math, pathlib, re, threading
+from typing import Optional, Sequence
+import numpy as np
+from app.utils.tracing import log
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOP = {"a", "an", "and", "are", "as", "at", "by", "for", "from", "in", "is", "of", "on", "or", "the", "to", "with"}
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOP]
+
+
+def rule_text(r) -> str:
+    """Line used in the KRetriever prompt for one knowledge-base rule."""
+    if not isinstance(r, dict):
+        return f"- {r}"
+    examples = ", ".join(ex["description"] for ex in r.get("examples", [])[:1])
+    return f'- {r["rule"]}: {r.get("explanation", "")} Example: {examples}'
+
+
+class RuleIndex:
+    """
+    BM25 index over the knowledge-base rules, for top-k retrieval by anomaly.
+
+    Built once from the rule files and rebuilt on the next ``search`` after any
+    file's mtime changes. Rules are scored on name, explanation and example
+    descriptions; a rule whose name equals the anomaly's ``rule`` always ranks
+    first. With an encoder (``hybrid``), BM25 scores are blended with the cosine
+    similarity of rule and query embeddings.
+    """
+
+    def __init__(self, paths: Sequence[str], k1: float = 1.2, b: float = 0.75):
+        self.paths = [pathlib.Path(p) for p in paths]
+        self.k1, self.b = k1, b
+        self._mtimes: dict[pathlib.Path, float] = {}
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._build()
+
+    def _stale(self) -> bool:
+        return any(p.stat().st_mtime != self._mtimes.get(p) for p in self.paths if p.exists())
+
+    def _build(self):
+        rules = []
+        for p in self.paths:
+            if not p.exists():
+                continue
+            self._mtimes[p] = p.stat().st_mtime
+            with open(p, "r", encoding="utf-8") as f:
+                rules.extend(json.load(f)["rules"])
+        self.rules = rules
+        self.lines = [rule_text(r) for r in rules]
+        self.names = [r["rule"] if isinstance(r, dict) else str(r) for r in rules]
+        docs = [tokenize(" ".join([r["rule"], r.get("explanation", "")] + [ex["description"] for ex in r.get("examples", [])])
+                         if isinstance(r, dict) else str(r)) for r in rules]
+        self.tf = [collections.Counter(d) for d in docs]
+        self.doc_len = np.array([len(d) for d in docs], dtype=np.float64)
+        self.avg_len = self.doc_len.mean() if len(docs) else 0.0
+        df = collections.Counter(t for d in self.tf for t in d)
+        n = len(docs)
+        self.idf = {t: math.log(1 + (n - c + 0.5) / (c + 0.5)) for t, c in df.items()}
+        self._vectors = None
+        log(f"RuleIndex ▶ indexed {n} rules from {len(self._mtimes)} files")
+
+    def _reload_if_changed(self):
+        with self._lock:
+            if self._stale():
+                log("RuleIndex ▶ rule file changed, rebuilding")
+                self._build()
+
+    def bm25(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.tf))
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / max(self.avg_len, 1e-9))
+        for t in set(tokenize(query)):
+            idf = self.idf.get(t)
+            if idf is None:
+                continue
+            f = np.array([tf.get(t, 0) for tf in self.tf], dtype=np.float64)
+            scores += idf * f * (self.k1 + 1) / (f + norm)
+        return scores
+
+    def _embedding_scores(self, query: str, encoder) -> np.ndarray:
+        if self._vectors is None:
+            v = np.asarray(encoder.encode([n + ". " + l for n, l in zip(self.names, self.lines)]), dtype=np.float32)
+            self._vectors = v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-9)
+        q = np.asarray(encoder.encode(query), dtype=np.float32)
+        return self._vectors @ (q / max(np.linalg.norm(q), 1e-9))
+
+    def search(self, query: str, k: int = 5, rule: Optional[str] = None, encoder=None) -> list[int]:
+        """Indices of the top-k rules for ``query``."""
+        self._reload_if_changed()
+        scores = self.bm25(query)
+        if encoder is not None:
+            top = scores.max()
+            scores = (scores / top if top > 0 else scores) + self._embedding_scores(query, encoder)
+        if rule and rule in self.names:
+            scores[self.names.index(rule)] = np.inf
+        order = np.argsort(-scores, kind="stable")
+        return [int(i) for i in order[:k] if scores[i] > 0]
+
+    def context(self, query: str, k: int = 5, rule: Optional[str] = None, encoder=None) -> str:
+        return "\n".join(self.lines[i] for i in self.search(query, k, rule, encoder))
+
+    def full_context(self) -> str:
+        return "\n".join(self.lines)
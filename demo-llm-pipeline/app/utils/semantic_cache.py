@@ -0,0 +1,86 @@
+import collections, threading, time
+from typing import Callable, Optional
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Answer cache keyed by query meaning rather than exact text.
+
+    A lookup embeds nothing itself: callers pass the query embedding, which is
+    compared (cosine) against every cached query in one matrix product; the
+    best match at or above ``threshold`` returns its answer. Entries expire
+    after ``ttl_s`` and the least recently used one is evicted beyond
+    ``max_items``. ``fingerprint`` is called on every lookup and the whole cache
+    is dropped when its value changes (e.g. the backing collection was updated).
+    """
+
+    def __init__(self, threshold: float = 0.92, ttl_s: float = 3600.0, max_items: int = 1000,
+                 fingerprint: Optional[Callable[[], object]] = None):
+        self.threshold, self.ttl_s, self.max_items = threshold, ttl_s, max_items
+        self.fingerprint = fingerprint
+        self._version = fingerprint() if fingerprint else None
+        self._vecs: Optional[np.ndarray] = None          # (max_items, dim), one row per slot
+        self._used = np.zeros(max_items, dtype=bool)
+        self._entries: collections.OrderedDict[int, tuple[str, object, float]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32).ravel()
+        return v / max(float(np.linalg.norm(v)), 1e-9)
+
+    def _check_version(self):
+        if self.fingerprint is None:
+            return
+        version = self.fingerprint()
+        if version != self._version:
+            self._version = version
+            self._entries.clear()
+            self._used[:] = False
+            self.invalidations += 1
+
+    def _evict(self, slot: int):
+        self._entries.pop(slot, None)
+        self._used[slot] = False
+
+    def get(self, vec) -> Optional[object]:
+        v = self._normalize(vec)
+        with self._lock:
+            self._check_version()
+            if self._vecs is None or not self._entries:
+                self.misses += 1
+                return None
+            slots = np.flatnonzero(self._used)
+            sims = self._vecs[slots] @ v
+            best = int(np.argmax(sims))
+            slot = int(slots[best])
+            if sims[best] >= self.threshold:
+                query, answer, expires = self._entries[slot]
+                if expires > time.monotonic():
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    return answer
+                self._evict(slot)
+            self.misses += 1
+            return None
+
+    def put(self, vec, answer, query: str = ""):
+        v = self._normalize(vec)
+        with self._lock:
+            if self._vecs is None or self._vecs.shape[1] != len(v):
+                self._vecs = np.zeros((self.max_items, len(v)), dtype=np.float32)
+                self._entries.clear()
+                self._used[:] = False
+            if self._used.all():
+                self._evict(next(iter(self._entries)))
+            slot = int(np.flatnonzero(~self._used)[0])
+            self._vecs[slot] = v
+            self._used[slot] = True
+            self._entries[slot] = (query, answer, time.monotonic() + self.ttl_s)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"items": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0, "invalidations": self.invalidations}
@@ -0,0 +1,38 @@
+import re
+
+try:
+    import tiktoken
+    _ENC = tiktoken.get_encoding("cl100k_base")
+except Exception:  # optional: fall back to an estimate
+    _ENC = None
+
+_WORDS = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """Prompt size in tokens: exact with tiktoken installed, otherwise ~1.3 tokens per word/punctuation mark."""
+    if _ENC is not None:
+        return len(_ENC.encode(text, disallowed_special=()))
+    return int(len(_WORDS.findall(text)) * 1.3)
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """Cut ``text`` to about ``budget`` tokens (proportional cut on the estimate)."""
+    n = count_tokens(text)
+    if n <= budget:
+        return text
+    return text[:max(0, int(len(text) * budget / n))].rstrip() + " …"
+
+
+def fit_budget(parts: list[str], budget: int) -> list[str]:
+    """Keep ``parts`` in rank order while they fit in ``budget`` tokens; the first one that overflows is truncated."""
+    out, used = [], 0
+    for p in parts:
+        n = count_tokens(p)
+        if used + n > budget:
+            if budget - used > 20:
+                out.append(truncate_tokens(p, budget - used))
+            break
+        out.append(p)
+        used += n
+    return out
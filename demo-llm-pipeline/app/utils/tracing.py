@@ -32,6 +32,16 @@ def log_gui(agent: str, msg: str, level: str = "info"):
         f.write(log_line)
 
         
+def stream_gui(agent: str, text: str):
+    """Append streamed ``text`` (e.g. LLM tokens) to the agent's GUI pane as-is; not written to the log files."""
+    try:
+        from app.global_gui import gui
+        if gui:
+            gui.gui_stream(agent, text)
+    except Exception:
+        pass
+
+
 import logging, uuid, contextvars
 import pathlib, datetime
 
@@ -50,6 +60,13 @@ def new_trace_id() -> str:
     trace_var.set(tid)
     return tid
 
+def child_trace_id(parent: str, index) -> str:
+    """Sub-trace of a batch trace, e.g. one per anomaly: ``T-1a2b3c4d.3``."""
+    return f"{parent}.{index}"
+
+def parent_trace_id(tid: str) -> str:
+    return tid.partition(".")[0]
+
 def get_trace_id() -> str:
     return trace_var.get() or "-"
 
@@ -0,0 +1,87 @@
+"""
+Micro-benchmarks for the columnar stages, on synthetic flows.
+
+    python bench_pipeline.py features --rows 2000000
+    python bench_pipeline.py rules --rows 2000000
+    python bench_pipeline.py stream --rows 2000000 --batch 50000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from app.utils.flow_schema import FLOW_DTYPES
+
+
+def synthetic_flows(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    internal = (np.uint32(0x0A010000) + rng.integers(0, 1 << 12, rows)).astype(np.uint32)
+    external = rng.integers(0x01000000, 0xDF000000, rows).astype(np.uint32)
+    outbound = rng.random(rows) < 0.7
+    ports = rng.choice([22, 53, 80, 443, 445, 3389, 8080], rows)
+    ephemeral = rng.integers(49152, 65535, rows)
+    df = pd.DataFrame({
+        "timestamp": 1693075200 + np.sort(rng.integers(0, 3600, rows)),
+        "src_ip": np.where(outbound, internal, external),
+        "dst_ip": np.where(outbound, external, internal),
+        "src_port": ephemeral,
+        "dst_port": ports,
+        "protocol": np.where(ports == 53, 17, 6),
+        "bytes": rng.lognormal(8, 2, rows).astype(np.int64),
+        "packets": rng.integers(1, 2000, rows),
+        "duration": rng.exponential(5, rows),
+        "cell_id": pd.Categorical.from_codes(rng.integers(0, 64, rows), [f"CELL_{i:03d}" for i in range(64)]),
+        "user_hash": pd.Categorical.from_codes(rng.integers(0, 5000, rows), [f"usr_{i:08x}" for i in range(5000)]),
+    })
+    df = df.astype({k: v for k, v in FLOW_DTYPES.items() if v != "category"})
+    df["datetime"] = pd.to_datetime(df["timestamp"], unit="s")
+    df["hour"] = df["datetime"].dt.hour.astype("int8")
+    return df
+
+
+def bench(name: str, fn, rows: int, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    print(f"{name:<40} {best * 1000:9.1f} ms  {rows / best:14,.0f} rows/s")
+
+
+def bench_features(rows: int):
+    from app.models.flow_features import add_flow_features
+    df = synthetic_flows(rows)
+    bench(f"add_flow_features ({rows:,} rows)", lambda: add_flow_features(df.copy()), rows)
+
+
+def bench_rules(rows: int):
+    from app.models.rule_engine import RuleEngineDetector
+    from app.models.flow_features import add_flow_features
+    df = add_flow_features(synthetic_flows(rows))
+    det = RuleEngineDetector()
+    for name, rate in det.benchmark(df).items():
+        print(f"{name[:60]:<60} {rate:14,.0f} rows/s")
+    bench(f"detect, all rules ({rows:,} rows)", lambda: det.detect(df), rows, repeat=1)
+
+
+def bench_stream(rows: int, batch: int):
+    from app.models.stream_detector import StreamingDetector
+    from app.models.flow_features import add_flow_features
+    df = add_flow_features(synthetic_flows(rows))
+    det = StreamingDetector()
+    batches = [df.iloc[i:i + batch] for i in range(0, rows, batch)]
+    found = []
+    bench(f"stream detect, {len(batches)} batches of {batch:,}",
+          lambda: found.extend(a for b in batches for a in det.detect(b)), rows, repeat=1)
+    print(f"{len(found)} anomalies, {det.nbytes / 2**20:.1f} MB of sketches")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stage", choices=["features", "rules", "stream"])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--batch", type=int, default=50_000, help="micro-batch size for the stream stage")
+    args = parser.parse_args()
+    if args.stage == "stream":
+        bench_stream(args.rows, args.batch)
+    else:
+        {"features": bench_features, "rules": bench_rules}[args.stage](args.rows)
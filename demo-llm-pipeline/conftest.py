@@ -0,0 +1,3 @@
+# Unit tests live in tests/. test_pipeline.py and bench_pipeline.py are end-to-end
+# scripts that need the full model stack and are run directly, not collected.
+collect_ignore = ["test_pipeline.py", "bench_pipeline.py", "main.py"]
@@ -1,19 +1,19 @@
 from app.GUI import PipelineGUI
 import threading
 import asyncio
-from test_pipeline import test_pipeline
+from test_pipeline import test_pipeline, stream_pipeline
 from app.utils.tracing import init_logger
+from app.utils.config import settings
 import app.global_gui
 
-# Crea l'istanza globale della GUI
-app.global_gui.gui = PipelineGUI()
-gui = app.global_gui.gui
-
 def run_pipeline():
     init_logger()
-    asyncio.run(test_pipeline())
+    asyncio.run(test_pipeline() if settings.INGEST_MODE == "once" else stream_pipeline())
     # gui.after(100, gui.destroy)  # chiude la GUI
 
 if __name__ == "__main__":
+    # Crea l'istanza globale della GUI (solo nel processo principale: gli shard del bus la re-importano)
+    app.global_gui.gui = PipelineGUI()
+    gui = app.global_gui.gui
     threading.Thread(target=run_pipeline, daemon=True).start()
     gui.mainloop()
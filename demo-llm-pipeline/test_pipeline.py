@@ -1,23 +1,23 @@
 import asyncio, textwrap, pathlib, functools
 from app.core.bus import EventBus
+from app.core.sharded_bus import ShardedEventBus
 from app.utils.tracing import init_logger
-from app.agents import proc, guardrail, anomaly_model, retriever_domain, retriever_history, notify, manager
+from app.agents import proc, guardrail, anomaly_model, retriever_domain, retriever_history, notify, manager, stream_source
 from app.GUI import PipelineGUI
 import chromadb
 from sentence_transformers import SentenceTransformer
-import csv
 from app.utils.config import settings
+from app.utils.history_index import bulk_index
+from app.utils.embedding_cache import CachedEncoder, get_embedding_cache
+from app.utils.incident_store import get_incident_store
 
 RAW_LOGS_PATH = pathlib.Path("demo-llm-pipeline/raw_logs_demo.txt")
-POOLDB_PATH = settings.POOL_DB_PATH
 
 with RAW_LOGS_PATH.open() as f:
     RAW_LOGS = f.read()
 
-async def test_pipeline():
-    bus = EventBus()
+def wire_agents(bus) -> manager.ManagerSequencer:
     seq = manager.ManagerSequencer(bus)
-    results = {}
 
     # --- Topic → agent subscriptions (reflection logic included) ---
     bus.subscribe("Proc",               functools.partial(proc.proc_listener, bus))
@@ -45,6 +45,40 @@ async def test_pipeline():
 
     # Fatal error
     bus.subscribe("FATAL",           seq.fatal_error)  # <-- fatal error handling
+    return seq
+
+def make_bus():
+    if settings.BUS_BACKEND == "sharded":
+        # agents live in the shard processes; the parent only starts traces and awaits ACKs
+        bus = ShardedEventBus("test_pipeline:wire_agents", shards=settings.BUS_SHARDS)
+        return bus, manager.ManagerSequencer(bus)
+    bus = EventBus.from_settings()
+    return bus, wire_agents(bus)
+
+async def stream_pipeline():
+    """Continuous mode: every micro-batch of the configured source becomes its own trace."""
+    bus, seq = make_bus()
+    asyncio.create_task(bus.start())
+    if settings.INGEST_MODE == "file":
+        # one trace over the whole file, parsed by Proc straight from disk
+        await seq.start_pipeline(path=str(pathlib.Path(settings.INGEST_PATH).resolve()))
+        return
+    if settings.INGEST_MODE == "tail":
+        chunks = stream_source.tail_file(settings.INGEST_PATH, from_start=settings.INGEST_FROM_START)
+    elif settings.INGEST_MODE == "socket":
+        chunks = stream_source.serve_socket(settings.INGEST_HOST, settings.INGEST_PORT)
+    elif settings.INGEST_MODE == "stdin":
+        chunks = stream_source.read_stdin()
+    else:
+        raise ValueError(f"unknown INGEST_MODE {settings.INGEST_MODE!r}")
+    await stream_source.stream_ingest(seq, chunks,
+                                      max_rows=settings.STREAM_MAX_ROWS,
+                                      max_wait_s=settings.STREAM_MAX_WAIT_S,
+                                      max_in_flight=settings.STREAM_MAX_IN_FLIGHT)
+
+async def test_pipeline():
+    results = {}
+    bus, seq = make_bus()
 
     # Intercetta la fine della pipeline (ACK_DONE)
     async def ack_done(msg):
@@ -60,30 +94,17 @@ async def test_pipeline():
             break
         await asyncio.sleep(0.2)
 
-    # Verifica che il file CSV sia stato scritto
-    csv_path = pathlib.Path("demo-llm-pipeline/app/db/pool_db.csv")
-    assert csv_path.exists(), "Il file pool_db.csv non è stato creato!"
-    # with csv_path.open() as f:
-    #     content = f.read()
-    #     print("Contenuto pool_db.csv:\n", content)
+    # Verifica che il report sia stato salvato
+    assert get_incident_store().count() > 0, "Nessun report nell'incident store!"
     print("Test completato: la pipeline e il bus funzionano correttamente.")
 
 def setup_vector_db():
     db = chromadb.Client()
-    collection = db.create_collection("incident_reports")
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    # Indicizza i report storici
-    with open(POOLDB_PATH, "r") as f:
-        reader = csv.reader(f)
-        for i, row in enumerate(reader):
-            if row:
-                text = row[-1]
-                embedding = model.encode(text).tolist()
-                collection.add(
-                    documents=[text],
-                    embeddings=[embedding],
-                    ids=[str(i)]
-                )
+    collection = db.get_or_create_collection("incident_reports")
+    model = CachedEncoder(SentenceTransformer(settings.EMBED_MODEL_NAME), get_embedding_cache(settings.EMBED_MODEL_NAME))
+    # Indicizza i report storici, a blocchi (un encode e un upsert per blocco)
+    docs = ((str(r["id"]), r["report"], {"trace_id": r["trace_id"]}) for r in get_incident_store().iter_all())
+    bulk_index(collection, model, docs, batch_size=settings.EMBED_BATCH_SIZE, workers=settings.EMBED_WORKERS)
     return collection, model
 
 if __name__ == "__main__":
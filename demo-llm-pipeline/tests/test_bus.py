@@ -0,0 +1,130 @@
+import asyncio
+import pytest
+from app.core.bus import EventBus, RoleLimits
+from app.core.messages import Msg
+
+
+def msg(role, tid="T-1", **payload):
+    return Msg(trace_id=tid, role=role, payload=payload)
+
+
+async def _idle(_msg):
+    await asyncio.sleep(3600)
+
+
+def test_publish_waits_when_role_is_full():
+    async def run():
+        bus = EventBus(limits={"Slow": RoleLimits(concurrency=1, maxsize=1)})
+        gate = asyncio.Event()
+
+        async def slow(_msg):
+            await gate.wait()
+        bus.subscribe("Slow", slow)
+        starter = asyncio.create_task(bus.start())
+        await bus.publish(msg("Slow", "T-1"))
+        await asyncio.sleep(0.01)                 # worker takes T-1
+        await bus.publish(msg("Slow", "T-2"))     # fills the single slot
+        blocked = asyncio.create_task(bus.publish(msg("Slow", "T-3")))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        assert bus.stats()["Slow"]["queued"] == 1
+        gate.set()
+        await asyncio.wait_for(blocked, 1)
+        starter.cancel()
+    asyncio.run(run())
+
+
+def test_drop_when_full_counts_drops():
+    async def run():
+        bus = EventBus(limits={"Data": RoleLimits(concurrency=1, maxsize=1, drop_when_full=True)})
+        bus.subscribe("Data", _idle)
+        starter = asyncio.create_task(bus.start())
+        await bus.publish(msg("Data", "T-1"))
+        await asyncio.sleep(0.01)             # worker takes T-1
+        for i in range(2, 5):
+            await bus.publish(msg("Data", f"T-{i}"))
+        stats = bus.stats()["Data"]
+        assert stats == {"queued": 1, "in_flight": 1, "processed": 0, "dropped": 2, "failed": 0}
+        starter.cancel()
+    asyncio.run(run())
+
+
+def test_drop_when_full_refused_for_control_roles():
+    with pytest.raises(ValueError):
+        EventBus(limits={"ACK_DONE": RoleLimits(drop_when_full=True)})
+
+
+def test_default_drop_never_applies_to_control_roles():
+    async def run():
+        bus = EventBus(default_limits=RoleLimits(concurrency=1, maxsize=1, drop_when_full=True))
+        bus.subscribe("ACK_DONE", _idle)
+        starter = asyncio.create_task(bus.start())
+        await bus.publish(msg("ACK_DONE", "T-1"))
+        await asyncio.sleep(0.01)             # worker takes T-1
+        await bus.publish(msg("ACK_DONE", "T-2"))
+        blocked = asyncio.create_task(bus.publish(msg("ACK_DONE", "T-3")))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()                 # waits instead of dropping
+        assert bus.stats()["ACK_DONE"]["dropped"] == 0
+        blocked.cancel()
+        starter.cancel()
+    asyncio.run(run())
+
+
+def test_handler_cycle_with_full_queues_does_not_deadlock():
+    # A_VALIDATE <-> A_VALIDATE_REFLECT with one slot and one worker each, like the GuardRail loop
+    async def run():
+        bus = EventBus(default_limits=RoleLimits(concurrency=1, maxsize=1))
+        chains, rounds = 5, 10
+        finished = []
+        done = asyncio.Event()
+
+        async def start(m):
+            for i in range(chains):
+                await bus.publish(msg("A_VALIDATE", f"T-{i}", n=0))
+
+        async def validate(m):
+            if m.payload["n"] < rounds:
+                await bus.publish(msg("A_VALIDATE_REFLECT", m.trace_id, n=m.payload["n"] + 1))
+                return
+            finished.append(m.trace_id)
+            if len(finished) == chains:
+                done.set()
+
+        async def reflect(m):
+            await bus.publish(msg("A_VALIDATE", m.trace_id, n=m.payload["n"]))
+        bus.subscribe("Start", start)
+        bus.subscribe("A_VALIDATE", validate)
+        bus.subscribe("A_VALIDATE_REFLECT", reflect)
+        starter = asyncio.create_task(bus.start())
+        await bus.publish(msg("Start"))
+        await asyncio.wait_for(done.wait(), 2)
+        starter.cancel()
+    asyncio.run(run())
+
+
+def test_stats_counts_processed_and_failed():
+    async def run():
+        bus = EventBus(default_limits=RoleLimits(concurrency=2, maxsize=10))
+        seen = []
+
+        async def handler(m):
+            if m.payload.get("boom"):
+                raise RuntimeError("boom")
+            seen.append(m.trace_id)
+        bus.subscribe("Work", handler)
+        starter = asyncio.create_task(bus.start())
+        for i in range(5):
+            await bus.publish(msg("Work", f"T-{i}", boom=i == 3))
+        await bus.publish(msg("Nobody", "T-x"))   # no subscriber: not queued, not counted
+        await asyncio.wait_for(bus.role_queues["Work"].join(), 1)
+        assert bus.stats() == {"Work": {"queued": 0, "in_flight": 0, "processed": 5, "dropped": 0, "failed": 1}}
+        assert len(seen) == 4
+        starter.cancel()
+    asyncio.run(run())
+
+
+def test_unbounded_stats():
+    bus = EventBus()
+    assert not bus.bounded
+    assert bus.stats() == {"*": {"queued": 0}}
@@ -0,0 +1,60 @@
+from app.models.anomaly_dummy import Anomaly
+from app.models.coalesce import AnomalyCoalescer
+
+
+def anomaly(src="10.0.0.1", dst="8.8.8.8", window=0, hits=1, flows=1, rule="SYN Flood"):
+    return Anomaly(id="A-0001", severity="high", description=rule, rule=rule, src_ip=src, dst_ip=dst,
+                   window_start=window, hits=hits, flows=[{"n": i} for i in range(flows)])
+
+
+def test_groups_one_batch_by_incident_and_window():
+    co = AnomalyCoalescer(cooldown_s=0, max_flows=3)
+    out = co.coalesce([anomaly(hits=5, flows=2), anomaly(hits=7, flows=2), anomaly(src="10.0.0.2")])
+    assert len(out) == 2
+    merged = out[0]
+    assert (merged.hits, merged.count, len(merged.flows)) == (12, 2, 3)
+    assert co.stats() == {"in": 3, "grouped": 1, "out": 2, "cooldown_keys": 0}
+
+
+def test_grouping_does_not_mutate_inputs():
+    first = anomaly(flows=1)
+    AnomalyCoalescer(cooldown_s=0, max_flows=5).coalesce([first, anomaly(flows=2)])
+    assert (first.hits, first.count, len(first.flows)) == (1, 1, 1)
+
+
+def test_cooldown_suppresses_and_reports_count():
+    co = AnomalyCoalescer(cooldown_s=60)
+    assert len(co.coalesce([anomaly(window=0)], now=0)) == 1
+    assert co.coalesce([anomaly(window=60)], now=10) == []
+    assert co.coalesce([anomaly(window=120), anomaly(window=120)], now=20) == []   # one group of 2
+    assert len(co.coalesce([anomaly(dst="1.1.1.1")], now=30)) == 1               # other incident
+    out = co.coalesce([anomaly(window=180)], now=61)
+    assert len(out) == 1 and out[0].suppressed == 3
+    assert co.stats()["suppressed"] == 3
+    assert co.coalesce([anomaly(window=240)], now=100) == []                      # new cooldown from t=61
+
+
+def test_same_incident_twice_in_one_batch_forwards_once():
+    co = AnomalyCoalescer(cooldown_s=60)
+    out = co.coalesce([anomaly(window=0), anomaly(window=60)], now=0)
+    assert len(out) == 1
+    assert co.stats()["suppressed"] == 1
+
+
+def test_expired_entries_are_swept_after_a_grace_cooldown():
+    co = AnomalyCoalescer(cooldown_s=60)
+    co.coalesce([anomaly()], now=0)
+    co.coalesce([anomaly(window=60)], now=30)     # suppressed, never reported
+    co.coalesce([], now=100)                      # expired at 60, kept until 120
+    assert co.stats()["cooldown_keys"] == 1
+    co.coalesce([], now=121)
+    assert co.stats()["cooldown_keys"] == 0
+    assert co.stats()["suppressed_unreported"] == 1
+
+
+def test_cooldown_keys_are_bounded():
+    co = AnomalyCoalescer(cooldown_s=60, max_keys=10)
+    for i in range(25):
+        co.coalesce([anomaly(src=f"10.0.0.{i}")], now=i)
+    assert co.stats()["cooldown_keys"] <= 11
+    assert len(co.coalesce([anomaly(src="10.0.0.0")], now=30)) == 1              # oldest key was evicted
@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+from app.core import completion
+from app.core.completion import CompletionRegistry
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(completion.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_resolve_sets_result_and_counts_status(clock):
+    async def run():
+        reg = CompletionRegistry(ttl_s=10)
+        fut = reg.register("T-1")
+        assert "T-1" in reg
+        assert reg.resolve("T-1", status="partial", result={"failed": 1})
+        assert await fut == {"failed": 1}
+        assert "T-1" not in reg
+        assert not reg.resolve("T-1")             # second ACK is a no-op
+        assert reg.stats() == {"in_flight": 0, "partial": 1}
+    asyncio.run(run())
+
+
+def test_sweep_expires_only_past_deadline(clock):
+    async def run():
+        reg = CompletionRegistry(ttl_s=10)
+        old = reg.register("T-old")
+        clock[0] += 5
+        new = reg.register("T-new")
+        assert reg.sweep() == []
+        clock[0] += 5                             # T-old deadline reached, T-new has 5s left
+        assert reg.sweep() == ["T-old"]
+        with pytest.raises(asyncio.TimeoutError):
+            await old
+        assert not new.done() and "T-new" in reg
+        assert reg.sweep(now=clock[0] + 5) == ["T-new"]
+        assert isinstance(new.exception(), asyncio.TimeoutError)
+        assert reg.stats() == {"in_flight": 0, "expired": 2}
+    asyncio.run(run())
+
+
+def test_reregister_moves_trace_to_deadline_order(clock):
+    async def run():
+        reg = CompletionRegistry(ttl_s=10)
+        reg.register("T-a")
+        clock[0] += 1
+        reg.register("T-b")
+        clock[0] += 1
+        fut = reg.register("T-a")                 # new deadline 1012, after T-b's 1011
+        assert list(reg._entries) == ["T-b", "T-a"]
+        clock[0] = 1011
+        assert reg.sweep() == ["T-b"]             # sweep does not stop at a stale head
+        assert not fut.done()
+        clock[0] = 1012
+        assert reg.sweep() == ["T-a"]
+    asyncio.run(run())
+
+
+def test_expire_then_resolve_is_ignored(clock):
+    async def run():
+        reg = CompletionRegistry(ttl_s=1)
+        fut = reg.register("T-1")
+        assert reg.expire("T-1")
+        assert not reg.expire("T-1")
+        assert not reg.resolve("T-1")
+        assert isinstance(fut.exception(), asyncio.TimeoutError)
+        assert reg.stats() == {"in_flight": 0, "expired": 1}
+    asyncio.run(run())
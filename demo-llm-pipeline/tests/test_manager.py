@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+from app.agents.manager import ManagerSequencer
+from app.core.bus import EventBus
+from app.core.messages import Msg
+from app.utils.config import settings
+
+
+@pytest.fixture(autouse=True)
+def agent_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(type(settings), "AGENT_LOG_FILE", str(tmp_path / "agents.log"))
+
+
+def wire(bus: EventBus, seq: ManagerSequencer, anomalies: list[dict], fail: str = "", failing=("KRETRIEVE", "HRETRIEVE")):
+    """Manager listeners plus stand-in agents; the ``failing`` retrievers of traces ending in ``fail`` report FATAL."""
+    acks = []
+
+    async def proc(msg):
+        await bus.publish(Msg(trace_id=msg.trace_id, role="MANAGER_PLAN", payload={"anomalies": anomalies}))
+
+    def retriever(kind, field):
+        async def run(msg):
+            if fail and kind in failing and msg.trace_id.endswith(fail):
+                await bus.publish(Msg(trace_id=msg.trace_id, role="FATAL", payload={"reason": kind}))
+                return
+            await asyncio.sleep(0.01)  # the sibling answers after the failure
+            await bus.publish(Msg(trace_id=msg.trace_id, role=f"{kind}_OK", payload={field: kind}))
+        return run
+
+    async def notify(msg):
+        await bus.publish(Msg(trace_id=msg.trace_id, role="ACK_DONE", payload={"status": "done"}))
+
+    async def spy(msg):
+        acks.append((msg.trace_id, msg.payload.get("status", "done")))
+
+    bus.subscribe("Proc", proc)
+    bus.subscribe("MANAGER_PLAN", seq.manager_plan_listener)
+    bus.subscribe("KRetriever", retriever("KRETRIEVE", "ctx"))
+    bus.subscribe("HRetriever", retriever("HRETRIEVE", "hist"))
+    bus.subscribe("KRETRIEVE_OK", seq.enr_ok_listener)
+    bus.subscribe("HRETRIEVE_OK", seq.enr_ok_listener)
+    bus.subscribe("NOTIFY_ASSEMBLE", notify)
+    bus.subscribe("FATAL", seq.fatal_error)
+    bus.subscribe("ACK_DONE", spy)
+    return acks
+
+
+def run_batch(anomalies, enrich_batch_size, fail="", failing=("KRETRIEVE", "HRETRIEVE")):
+    async def run():
+        bus = EventBus()
+        seq = ManagerSequencer(bus, ttl_s=5, enrich_batch_size=enrich_batch_size)
+        results = []
+        resolve = seq.completions.resolve
+        seq.completions.resolve = lambda tid, status="done", result=True: \
+            results.append((status, result)) or resolve(tid, status, result)
+        acks = wire(bus, seq, anomalies, fail, failing)
+        starter = asyncio.create_task(bus.start())
+        await asyncio.wait_for(seq.start_pipeline("1693075200,..."), 2)
+        await asyncio.sleep(0.05)  # let late enrichments arrive
+        starter.cancel()
+        return seq, results, acks
+    return asyncio.run(run())
+
+
+ANOMALIES = [{"rule": "scan", "id": "A-1"}, {"rule": "scan", "id": "A-2"},
+             {"rule": "scan", "id": "A-3"}, {"rule": "flood", "id": "A-4"}]
+
+
+def test_grouped_enrichment_completes_batch():
+    seq, results, acks = run_batch(ANOMALIES, enrich_batch_size=3)
+    assert results == [("done", {"expected": 4, "done": 4, "failed": 0})]
+    assert sorted(s for _, s in acks) == ["done"] * 4
+    assert seq.stats()["batches"] == 0 and seq.stats()["waiting"] == 0
+
+
+@pytest.mark.parametrize("failing", [("KRETRIEVE",), ("KRETRIEVE", "HRETRIEVE")])
+def test_failed_group_fails_every_member_and_batch_is_partial(failing):
+    # with one failing retriever the sibling's late *_OK is ignored; with two the second FATAL is
+    seq, results, acks = run_batch(ANOMALIES, enrich_batch_size=3, fail=".g1", failing=failing)
+    assert results == [("partial", {"expected": 4, "done": 4, "failed": 3})]
+    members = sorted(t.rsplit(".", 1)[1] for t, s in acks if s == "fatal")
+    assert members == ["1", "2", "3"]              # exactly one fatal ACK per member
+    assert [s for t, s in acks if t.endswith(".4")] == ["done"]
+    assert seq.stats()["waiting"] == 0 and ".g1" in next(iter(seq._closed))
+
+
+def test_single_anomaly_traces_without_grouping():
+    seq, results, acks = run_batch(ANOMALIES[:2], enrich_batch_size=1, fail=".2")
+    assert results == [("partial", {"expected": 2, "done": 2, "failed": 1})]
+    assert sorted(s for t, s in acks) == ["done", "fatal"]
+    assert [s for t, s in acks if t.endswith(".2")] == ["fatal"]
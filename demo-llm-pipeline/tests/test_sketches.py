@@ -0,0 +1,82 @@
+import numpy as np
+from app.models.sketches import CountMinSketch, HyperLogLogBank, SlidingWindow, combine
+
+
+def test_count_min_never_undercounts_and_error_is_bounded():
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 5000, size=50_000).astype(np.uint64)
+    cms = CountMinSketch(width=1 << 12, depth=4)
+    cms.add(keys)
+    uniq, true = np.unique(keys, return_counts=True)
+    est = cms.query(uniq)
+    assert (est >= true).all()
+    # standard bound: over-count ≤ e/width · N with probability 1 - e^-depth
+    assert np.mean(est - true <= np.e / cms.width * len(keys)) > 0.95
+
+
+def test_count_min_sums_weights_and_merges_panes():
+    a, b = CountMinSketch(width=1 << 10, depth=3, dtype=np.int64), CountMinSketch(width=1 << 10, depth=3, dtype=np.int64)
+    keys = np.array([1, 2, 1], dtype=np.uint64)
+    a.add(keys, np.array([100, 5, 10]))
+    b.add(np.array([1], dtype=np.uint64), 7)
+    assert a.query(np.array([1, 2], dtype=np.uint64)).tolist() == [110, 5]
+    assert CountMinSketch.merged_query([a, b], np.array([1, 2], dtype=np.uint64)).tolist() == [117, 5]
+    a.clear()
+    assert a.query(np.array([1], dtype=np.uint64)).tolist() == [0]
+
+
+def test_hll_estimate_within_error_bound():
+    hll = HyperLogLogBank(slots=256, registers=64, depth=2)
+    truth = {1: 10, 2: 1_000, 3: 20_000}
+    for key, n in truth.items():
+        items = combine(np.full(n, key), np.arange(n))
+        hll.add(np.full(n, key, dtype=np.uint64), items)
+        hll.add(np.full(n, key, dtype=np.uint64), items)      # duplicates do not count
+    est = hll.query(np.array(list(truth), dtype=np.uint64))
+    rel = np.abs(est - np.array(list(truth.values()))) / np.array(list(truth.values()))
+    # standard error 1.04/sqrt(64) ≈ 13%: allow three of them
+    assert (rel < 3 * 1.04 / np.sqrt(64)).all(), est
+    assert abs(est[0] - 10) <= 1                               # small counts use linear counting
+
+
+def test_hll_merge_is_union():
+    a, b = HyperLogLogBank(slots=64, registers=64), HyperLogLogBank(slots=64, registers=64)
+    key = np.full(500, 9, dtype=np.uint64)
+    a.add(key, np.arange(500, dtype=np.uint64))
+    b.add(key, np.arange(250, 750, dtype=np.uint64))
+    merged = HyperLogLogBank.merged_query([a, b], np.array([9], dtype=np.uint64))[0]
+    assert abs(merged - 750) / 750 < 0.4
+    assert HyperLogLogBank.merged_query([a, b], np.array([10], dtype=np.uint64))[0] < 1
+
+
+def _counter_window(panes=3, pane_s=10):
+    return SlidingWindow(lambda: CountMinSketch(width=64, depth=2), panes, pane_s)
+
+
+def _count(window, key=1):
+    live = window.live()
+    return int(CountMinSketch.merged_query(live, np.array([key], dtype=np.uint64))[0]) if live else 0
+
+
+def test_sliding_window_expires_old_panes():
+    w = _counter_window()
+    one = lambda n: np.ones(n, dtype=np.uint64)
+    w.add(np.array([0, 5, 12]), one(3))          # epochs 0 and 1
+    assert _count(w) == 3
+    w.add(np.array([25]), one(1))                # epoch 2: window is epochs 0..2
+    assert _count(w) == 4
+    w.add(np.array([31]), one(1))                # epoch 3 reuses pane 0: the two epoch-0 rows drop out
+    assert _count(w) == 3
+    assert w.live_ordered()[0] is w.sketches[1]
+    w.add(np.array([3]), one(1))                 # older than the window: ignored
+    assert _count(w) == 3
+    w.add(np.array([100]), one(1))               # a jump past the window leaves only the new pane
+    assert _count(w) == 1
+    assert w.live_ordered()[:2] == [None, None]
+
+
+def test_sliding_window_late_rows_in_live_pane_count():
+    w = _counter_window()
+    w.add(np.array([29]), np.ones(1, dtype=np.uint64))
+    w.add(np.array([11, 29]), np.ones(2, dtype=np.uint64))   # epoch 1 is still inside the window
+    assert _count(w) == 3